@@ -0,0 +1,240 @@
+"""
+Daily product metrics, computed incrementally with pandas.
+
+For every complete UTC day since the last run, `swipes`, `matches`,
+`messages` (hot and that month's archive partition) and `subscriptions`
+are read in keyset-paginated batches of ANALYTICS_BATCH_SIZE documents,
+each batch becomes a small DataFrame with only the columns a metric needs,
+and the batch is folded into that day's running totals. No collection is
+ever held in memory; what is held per day is the set of distinct swipers
+and of conversations with messages that day.
+
+One document per day goes into `analytics_daily`:
+
+    swipes, likes, super_likes, passes, active_swipers, likes_per_swiper
+    matches, match_rate                 matches per like sent that day
+    messages, active_conversations, messages_per_conversation
+    trials_ended, trial_conversions, trial_to_paid_rate
+
+A day is written with $set and only then is the watermark in
+`analytics_state` moved past it, so an interrupted run redoes at most one
+day and never double counts. Today is never processed; it is not complete.
+
+    python analytics.py run     # process every complete day since the watermark
+    python analytics.py show    # print the last 30 days
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Set
+
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING
+
+from archive import ARCHIVE_PREFIX, month_key
+from billing import RENEWAL_PERIOD
+from storage import parse_datetime, utcnow
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_BATCH_SIZE = 5000
+WATERMARK_ID = "daily"
+
+LIKE_ACTIONS = ("like", "super_like")
+
+# (collection, timestamp field) pairs a day is cut from
+SOURCES = (
+    ("swipes", "created_at"),
+    ("matches", "matched_at"),
+    ("messages", "created_at"),
+    ("subscriptions", "trial_end_date"),
+    ("subscriptions", "last_payment_date"),
+)
+
+
+async def ensure_indexes(db):
+    for name, field in SOURCES:
+        await db[name].create_index([(field, ASCENDING), ("id", ASCENDING)])
+    await db.analytics_daily.create_index("date", unique=True)
+    await db.analytics_state.create_index("id", unique=True)
+
+
+def _day_bounds(day: date):
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def _ratio(numerator: int, denominator: int) -> float:
+    return round(numerator / denominator, 4) if denominator else 0.0
+
+
+async def _batches(collection, field: str, day: date, columns: List[str], batch_size: int) -> AsyncIterator[pd.DataFrame]:
+    """The day's documents, in (field, id) order, as DataFrames of at most batch_size rows."""
+    start, end = _day_bounds(day)
+    projection = {"_id": 0, "id": 1, field: 1, **{c: 1 for c in columns}}
+    criteria = {field: {"$gte": start, "$lt": end}}
+    while True:
+        batch = await collection.find(criteria, projection).sort(
+            [(field, ASCENDING), ("id", ASCENDING)]
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            return
+        yield pd.DataFrame.from_records(batch, columns=["id", *columns])
+        last_value, last_id = batch[-1][field], batch[-1]['id']
+        criteria = {"$or": [
+            {field: {"$gt": last_value, "$lt": end}},
+            {field: last_value, "id": {"$gt": last_id}}
+        ]}
+
+
+class DailyMetrics:
+    """Running totals for one day, fed one batch at a time."""
+
+    def __init__(self, day: date):
+        self.day = day
+        self.swipes = self.likes = self.super_likes = 0
+        self.matches = 0
+        self.messages = 0
+        self.trials_ended = self.trial_conversions = 0
+        self.swipers: Set[str] = set()
+        self.conversations: Set[str] = set()
+
+    def add_swipes(self, frame: pd.DataFrame):
+        actions = frame['action'].value_counts()
+        self.swipes += len(frame)
+        self.likes += int(sum(actions.get(a, 0) for a in LIKE_ACTIONS))
+        self.super_likes += int(actions.get("super_like", 0))
+        self.swipers.update(frame['user_id'].unique())
+
+    def add_matches(self, frame: pd.DataFrame):
+        self.matches += len(frame)
+
+    def add_messages(self, frame: pd.DataFrame):
+        self.messages += len(frame)
+        self.conversations.update(frame['match_id'].unique())
+
+    def add_trials_ended(self, frame: pd.DataFrame):
+        self.trials_ended += len(frame)
+
+    def add_payments(self, frame: pd.DataFrame):
+        # A payment converted a trial when the period it paid for is the
+        # first one, i.e. it started at the end of the trial.
+        paid_from = pd.to_datetime(frame['next_payment_date'], utc=True) - RENEWAL_PERIOD
+        trial_end = pd.to_datetime(frame['trial_end_date'], utc=True)
+        self.trial_conversions += int((paid_from == trial_end).sum())
+
+    def to_document(self) -> dict:
+        return {
+            "date": self.day.isoformat(),
+            "swipes": self.swipes,
+            "likes": self.likes,
+            "super_likes": self.super_likes,
+            "passes": self.swipes - self.likes,
+            "active_swipers": len(self.swipers),
+            "likes_per_swiper": _ratio(self.likes, len(self.swipers)),
+            "matches": self.matches,
+            "match_rate": _ratio(self.matches, self.likes),
+            "messages": self.messages,
+            "active_conversations": len(self.conversations),
+            "messages_per_conversation": _ratio(self.messages, len(self.conversations)),
+            "trials_ended": self.trials_ended,
+            "trial_conversions": self.trial_conversions,
+            "trial_to_paid_rate": _ratio(self.trial_conversions, self.trials_ended),
+            "computed_at": utcnow()
+        }
+
+
+async def compute_day(db, day: date, batch_size: int = ANALYTICS_BATCH_SIZE) -> dict:
+    metrics = DailyMetrics(day)
+
+    async for frame in _batches(db.swipes, "created_at", day, ["user_id", "action"], batch_size):
+        metrics.add_swipes(frame)
+    async for frame in _batches(db.matches, "matched_at", day, [], batch_size):
+        metrics.add_matches(frame)
+
+    # Old days may already have been moved to the archive
+    message_collections = [db.messages]
+    partition = ARCHIVE_PREFIX + month_key(datetime.combine(day, time.min))
+    if partition in await db.list_collection_names():
+        message_collections.append(db[partition])
+    for collection in message_collections:
+        async for frame in _batches(collection, "created_at", day, ["match_id"], batch_size):
+            metrics.add_messages(frame)
+
+    async for frame in _batches(db.subscriptions, "trial_end_date", day, [], batch_size):
+        metrics.add_trials_ended(frame)
+    async for frame in _batches(
+        db.subscriptions, "last_payment_date", day, ["trial_end_date", "next_payment_date"], batch_size
+    ):
+        metrics.add_payments(frame)
+
+    return metrics.to_document()
+
+
+async def _first_day(db) -> Optional[date]:
+    """The earliest day any source has data for."""
+    first = None
+    for name, field in SOURCES:
+        # Strings sort before dates in Mongo, so look at both until migrated
+        for kind in ("date", "string"):
+            doc = await db[name].find_one({field: {"$type": kind}}, {"_id": 0, field: 1}, sort=[(field, ASCENDING)])
+            if doc:
+                day = parse_datetime(doc[field]).date()
+                first = day if first is None else min(first, day)
+    return first
+
+
+async def run_daily(db, batch_size: int = ANALYTICS_BATCH_SIZE) -> List[str]:
+    """Compute every complete day since the watermark; returns the days written."""
+    state = await db.analytics_state.find_one({"id": WATERMARK_ID}, {"_id": 0})
+    day = date.fromisoformat(state['next_day']) if state else await _first_day(db)
+    today = datetime.now(timezone.utc).date()
+    written = []
+    while day is not None and day < today:
+        document = await compute_day(db, day, batch_size)
+        await db.analytics_daily.update_one({"date": document['date']}, {"$set": document}, upsert=True)
+        day += timedelta(days=1)
+        await db.analytics_state.update_one(
+            {"id": WATERMARK_ID},
+            {"$set": {"next_day": day.isoformat()}},
+            upsert=True
+        )
+        written.append(document['date'])
+        logger.info("Analytics for %s: %s", document['date'], document)
+    return written
+
+
+async def load_daily(db, days: int = 30) -> pd.DataFrame:
+    """The last `days` daily documents as a frame indexed by date."""
+    documents = await db.analytics_daily.find({}, {"_id": 0}).sort("date", DESCENDING).limit(days).to_list(length=days)
+    if not documents:
+        return pd.DataFrame()
+    return pd.DataFrame.from_records(documents).drop(columns=["computed_at"]).set_index("date").sort_index()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1:]
+    if command not in (["run"], ["show"]):
+        print("usage: python analytics.py run|show")
+        sys.exit(2)
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    database = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+
+    async def main():
+        if command == ["run"]:
+            await ensure_indexes(database)
+            days = await run_daily(database)
+            print(f"{len(days)} day(s) computed")
+        else:
+            with pd.option_context("display.width", 200, "display.max_columns", None):
+                print(await load_daily(database))
+
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+"""
+Tiered storage for chat history.
+
+Messages older than MESSAGE_ARCHIVE_AFTER_DAYS (default 90) are moved out
+of `messages` into one collection per month, `messages_archive_YYYY_MM`,
+created with zstd block compression. `message_archive_catalog` records
+which months hold messages for each match, so paging back through a
+conversation only opens the partitions that can contain it.
+
+    python archive.py run      # move old messages, resumable, batch by batch
+    python archive.py stats    # hot vs archived document/index/storage sizes
+
+A run can be interrupted at any point: each batch is copied before it is
+deleted from `messages`, and copies that already exist are skipped on the
+next run via the unique index on `id`.
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = "messages_archive_"
+ARCHIVE_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+
+
+def month_key(created_at) -> str:
+    if isinstance(created_at, datetime):
+        return created_at.strftime("%Y_%m")
+    return created_at[:7].replace("-", "_")
+
+
+async def ensure_indexes(db):
+    await db.messages.create_index([("match_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)])
+    await db.messages.create_index("created_at")
+    await db.message_archive_catalog.create_index("match_id", unique=True)
+
+
+async def _partition(db, month: str):
+    name = ARCHIVE_PREFIX + month
+    try:
+        await db.create_collection(
+            name,
+            storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+        )
+        await db[name].create_index("id", unique=True)
+        await db[name].create_index([("match_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)])
+    except CollectionInvalid:
+        pass
+    return db[name]
+
+
+async def archive_messages(db, older_than_days: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move messages older than the cutoff into monthly partitions; returns how many moved."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        batch = await db.messages.find(
+            {"created_at": {"$lt": cutoff}},
+            {"_id": 0}
+        ).sort("created_at", ASCENDING).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        by_month = {}
+        for message in batch:
+            by_month.setdefault(month_key(message['created_at']), []).append(message)
+
+        catalog = {}
+        for month, messages in by_month.items():
+            partition = await _partition(db, month)
+            try:
+                await partition.insert_many(messages, ordered=False)
+            except BulkWriteError as e:
+                # Left over from an interrupted run; anything else is a real failure
+                if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                    raise
+            for message in messages:
+                catalog.setdefault(message['match_id'], set()).add(month)
+
+        await db.message_archive_catalog.bulk_write(
+            [
+                UpdateOne({"match_id": match_id}, {"$addToSet": {"months": {"$each": sorted(months)}}}, upsert=True)
+                for match_id, months in catalog.items()
+            ],
+            ordered=False
+        )
+        await db.messages.delete_many({"id": {"$in": [m['id'] for m in batch]}})
+        moved += len(batch)
+        logger.info("Archived %d messages", moved)
+    return moved
+
+
+def _older_than(before, before_id=None) -> dict:
+    """Keyset filter for messages that sort before (before, before_id); ties on created_at break on id."""
+    if before_id is None:
+        return {"created_at": {"$lt": before}}
+    return {"$or": [
+        {"created_at": {"$lt": before}},
+        {"created_at": before, "id": {"$lt": before_id}},
+    ]}
+
+
+async def load_messages(db, match_id: str, before=None, limit: int = DEFAULT_PAGE_SIZE, before_id: str = None):
+    """
+    Up to `limit` messages older than the cursor, oldest first, reading
+    through to the monthly partitions once the hot collection runs out.
+    The cursor is the first message of the previous page: its created_at
+    as `before` and its id as `before_id`, so messages sharing that
+    millisecond are neither skipped nor repeated. Returns (messages, has_more).
+    """
+    query = {"match_id": match_id, **_older_than(before, before_id)}
+    order = [("created_at", DESCENDING), ("id", DESCENDING)]
+    # One extra tells whether anything is left beyond this page
+    wanted = limit + 1
+    page = await db.messages.find(query, {"_id": 0}).sort(order).limit(wanted).to_list(length=wanted)
+
+    if len(page) < wanted:
+        catalog = await db.message_archive_catalog.find_one({"match_id": match_id}, {"_id": 0, "months": 1})
+        newest_month = month_key(before)
+        months = sorted((m for m in (catalog or {}).get('months', []) if m <= newest_month), reverse=True)
+        for month in months:
+            remaining = wanted - len(page)
+            page += await db[ARCHIVE_PREFIX + month].find(
+                query, {"_id": 0}
+            ).sort(order).limit(remaining).to_list(length=remaining)
+            if len(page) >= wanted:
+                break
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
+
+
+async def archive_stats(db) -> dict:
+    """Document, storage and index sizes of the hot collection versus the archive."""
+    async def coll_stats(name):
+        stats = await db.command("collStats", name)
+        return {
+            "count": stats.get('count', 0),
+            "size": stats.get('size', 0),
+            "storage_size": stats.get('storageSize', 0),
+            "index_size": stats.get('totalIndexSize', 0),
+        }
+
+    hot = await coll_stats("messages")
+    partitions: List[str] = sorted(n for n in await db.list_collection_names() if n.startswith(ARCHIVE_PREFIX))
+    archived = {"count": 0, "size": 0, "storage_size": 0, "index_size": 0}
+    for name in partitions:
+        for key, value in (await coll_stats(name)).items():
+            archived[key] += value
+
+    total_index = hot['index_size'] + archived['index_size']
+    total_size = hot['size'] + archived['size']
+    return {
+        "hot": hot,
+        "archive": archived,
+        "partitions": len(partitions),
+        # Share of index bytes and document bytes that no longer sit in the hot working set
+        "index_reduction": archived['index_size'] / total_index if total_index else 0.0,
+        "working_set_reduction": archived['size'] / total_size if total_size else 0.0,
+        "archive_compression_ratio": archived['size'] / archived['storage_size'] if archived['storage_size'] else None,
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["run"], ["stats"]):
+        print("usage: python archive.py run|stats")
+        sys.exit(2)
+
+    import json
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    database = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+
+    async def main(command: str):
+        if command == "run":
+            await ensure_indexes(database)
+            await archive_messages(database, int(os.environ.get('MESSAGE_ARCHIVE_AFTER_DAYS', '90')))
+        print(json.dumps(await archive_stats(database), indent=2))
+
+    asyncio.run(main(sys.argv[1]))
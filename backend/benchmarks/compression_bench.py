@@ -0,0 +1,89 @@
+"""
+Size and CPU cost of compressing list-endpoint responses, per encoding
+and level, to pick COMPRESSION_GZIP_LEVEL / COMPRESSION_BROTLI_QUALITY
+and COMPRESSION_THREAD_KB.
+
+    python benchmarks/compression_bench.py
+    python benchmarks/compression_bench.py --pages 10 --json
+
+Bodies are the discover/conversations/messages payloads from
+json_response_profile.py, rendered as the API sends them; --pages
+concatenates several pages to stand in for larger responses.
+"""
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fast_json import FastJSONResponse  # noqa: E402
+from json_response_profile import ENDPOINTS  # noqa: E402
+from storage import utcnow  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SETTINGS = [("gzip", level) for level in (1, 6, 9)]
+if brotli is not None:
+    SETTINGS += [("br", quality) for quality in (1, 4, 6, 11)]
+
+
+def compress(encoding: str, level: int, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, level, mtime=0)
+
+
+def best_of(repeat: int, function) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(args):
+    rnd = random.Random(args.seed)
+    now = utcnow()
+    results = []
+    for endpoint, factory in ENDPOINTS.items():
+        pages = [factory(rnd, now) for _ in range(args.pages)]
+        body = FastJSONResponse(pages[0] if args.pages == 1 else pages).body
+        for encoding, level in SETTINGS:
+            compressed = compress(encoding, level, body)
+            seconds = best_of(args.repeat, lambda: compress(encoding, level, body))
+            results.append({
+                "endpoint": endpoint,
+                "bytes": len(body),
+                "encoding": f"{encoding}-{level}",
+                "compressed_bytes": len(compressed),
+                "ratio": round(len(body) / len(compressed), 1),
+                "ms": round(seconds * 1000, 3),
+                "mb_per_second": round(len(body) / seconds / 1e6, 1),
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<30} {'bytes':>8} {'encoding':<9} {'compressed':>10} {'ratio':>6} {'ms':>8} {'MB/s':>7}")
+    for r in results:
+        print(
+            f"{r['endpoint']:<30} {r['bytes']:>8} {r['encoding']:<9} {r['compressed_bytes']:>10}"
+            f" {r['ratio']:>6} {r['ms']:>8} {r['mb_per_second']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
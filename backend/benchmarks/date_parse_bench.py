@@ -0,0 +1,134 @@
+"""
+Cost of dates stored as ISO strings versus native BSON datetimes, per
+page of list-endpoint documents (messages, matches/conversations).
+
+    python benchmarks/date_parse_bench.py
+    python benchmarks/date_parse_bench.py --docs 1000 --json
+
+For each representation it times, per document:
+
+    decode      BSON bytes -> dict, as the driver does for every result
+    as_datetime getting real datetimes out (fromisoformat for strings,
+                nothing for BSON dates), which every handler that compares
+                or does arithmetic on a date has to pay
+    respond     jsonable_encoder + json.dumps of the page, as FastAPI does
+
+and reports the BSON size of the documents. No Mongo needed: documents are
+encoded with the driver's own bson module.
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+import bson
+from bson.codec_options import CodecOptions
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import parse_datetime, utcnow  # noqa: E402
+
+TZ_AWARE = CodecOptions(tz_aware=True)
+
+
+def make_messages(count: int, as_string: bool):
+    start = utcnow() - timedelta(days=3)
+    documents = []
+    for index in range(count):
+        created_at = start + timedelta(seconds=index * 7)
+        documents.append({
+            "id": str(uuid.uuid4()),
+            "match_id": "5f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0",
+            "sender_id": "0a1b2c3d-4e5f-6071-8293-a4b5c6d7e8f9",
+            "receiver_id": "9f8e7d6c-5b4a-3928-1706-f5e4d3c2b1a0",
+            "content": "See you at eight?",
+            "message_type": "text",
+            "status": "sent",
+            "created_at": created_at.isoformat() if as_string else created_at,
+            "read_at": None,
+        })
+    return documents
+
+
+def make_matches(count: int, as_string: bool):
+    start = utcnow() - timedelta(days=30)
+    documents = []
+    for index in range(count):
+        matched_at = start + timedelta(minutes=index)
+        read_up_to = matched_at + timedelta(hours=1)
+        documents.append({
+            "id": str(uuid.uuid4()),
+            "user1_id": str(uuid.uuid4()),
+            "user2_id": str(uuid.uuid4()),
+            "matched_at": matched_at.isoformat() if as_string else matched_at,
+            "unmatched": False,
+            "user1_read_up_to": read_up_to.isoformat() if as_string else read_up_to,
+            "user2_read_up_to": read_up_to.isoformat() if as_string else read_up_to,
+        })
+    return documents
+
+
+def best_of(repeat: int, function) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def measure(name: str, documents, date_fields, repeat: int) -> dict:
+    raw = b"".join(bson.encode(document) for document in documents)
+    decoded = bson.decode_all(raw, TZ_AWARE)
+    count = len(documents)
+
+    def as_datetimes():
+        for document in decoded:
+            for field in date_fields:
+                parse_datetime(document[field])
+
+    def respond():
+        json.dumps(jsonable_encoder({"items": decoded}))
+
+    us = 1e6 / count
+    return {
+        "collection": name,
+        "bytes_per_doc": round(len(raw) / count, 1),
+        "decode_us": round(best_of(repeat, lambda: bson.decode_all(raw, TZ_AWARE)) * us, 2),
+        "as_datetime_us": round(best_of(repeat, as_datetimes) * us, 2),
+        "respond_us": round(best_of(repeat, respond) * us, 2),
+    }
+
+
+def main(args):
+    results = []
+    for name, factory, fields in (
+        ("messages", make_messages, ("created_at",)),
+        ("matches", make_matches, ("matched_at", "user1_read_up_to", "user2_read_up_to")),
+    ):
+        for storage in ("iso_string", "bson_date"):
+            result = measure(name, factory(args.docs, storage == "iso_string"), fields, args.repeat)
+            result["storage"] = storage
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'collection':<10} {'storage':<11} {'bytes/doc':>9} {'decode µs':>10} {'as_datetime µs':>15} {'respond µs':>11}")
+    for r in results:
+        print(
+            f"{r['collection']:<10} {r['storage']:<11} {r['bytes_per_doc']:>9} {r['decode_us']:>10}"
+            f" {r['as_datetime_us']:>15} {r['respond_us']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1000, help="documents per page")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,109 @@
+"""
+Event log writer and reader throughput.
+
+    python benchmarks/event_log_bench.py                  # 1M events in a temp dir
+    python benchmarks/event_log_bench.py --events 5000000 --dir /var/tmp/ev
+
+Writes a day's worth of a realistic mix (mostly swipes, then messages,
+matches, registrations and premium subscriptions) through EventLog.emit,
+then reads it back per segment and as a merged, time-ordered replay,
+with and without decoding every event's fields.
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from event_log import DAY_US, EventLog, read_segment, replay, segments  # noqa: E402
+
+MIX = (("swipe", 0.70), ("message", 0.22), ("match", 0.05), ("register", 0.02), ("premium_subscribe", 0.01))
+CONTENTS = ["مرحبا", "كيف حالك؟", "hi!", "نلتقي غداً في المقهى؟", "😂😂", "Sounds good, see you at 8"]
+
+
+def make_events(count: int, seed: int):
+    rnd = random.Random(seed)
+    users = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(10_000)]
+    matches = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(2_000)]
+    types = rnd.choices([t for t, _ in MIX], weights=[w for _, w in MIX], k=count)
+    later = datetime.now(timezone.utc) + timedelta(days=14)
+    for event_type in types:
+        if event_type == "swipe":
+            yield event_type, {"user_id": rnd.choice(users), "swiped_user_id": rnd.choice(users), "action": rnd.choice(("like", "pass", "super_like"))}
+        elif event_type == "message":
+            yield event_type, {
+                "message_id": str(uuid.uuid4()), "match_id": rnd.choice(matches), "sender_id": rnd.choice(users),
+                "receiver_id": rnd.choice(users), "message_type": "text", "content_length": len(rnd.choice(CONTENTS))
+            }
+        elif event_type == "match":
+            yield event_type, {"match_id": str(uuid.uuid4()), "user1_id": rnd.choice(users), "user2_id": rnd.choice(users)}
+        elif event_type == "register":
+            yield event_type, {"user_id": str(uuid.uuid4()), "trial_end_date": later}
+        else:
+            yield event_type, {"user_id": rnd.choice(users), "tier": "gold", "duration": "1month", "end_date": later}
+
+
+def main(args):
+    directory = Path(args.dir or tempfile.mkdtemp(prefix="event_log_bench_"))
+    events = list(make_events(args.events, args.seed))
+    # Spread the events over one UTC day so the replay covers a full day
+    day_start = (time.time_ns() // 1000 // DAY_US - 1) * DAY_US
+    step = DAY_US // len(events)
+
+    log = EventLog(directory, segment_bytes=args.segment_mb * 1024 * 1024)
+    started = time.perf_counter()
+    for index, (event_type, data) in enumerate(events):
+        log.emit(event_type, timestamp=day_start + index * step, **data)
+    log.close()
+    write_seconds = time.perf_counter() - started
+
+    paths = segments(directory)
+    started = time.perf_counter()
+    scanned = sum(1 for path in paths for _ in read_segment(path))
+    scan_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    day = datetime.fromtimestamp(day_start / 1e6, timezone.utc).date()
+    replayed = sum(1 for _ in replay(directory, day))
+    replay_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = sum(1 for event in replay(directory, day) if event.data)
+    decode_seconds = time.perf_counter() - started
+
+    size = sum(p.stat().st_size for p in paths)
+    result = {
+        "events": len(events),
+        "segments": len(paths),
+        "bytes": size,
+        "bytes_per_event": round(size / len(events), 1),
+        "write_events_per_second": round(len(events) / write_seconds),
+        "write_mb_per_second": round(size / write_seconds / 1e6, 1),
+        "scan_events_per_second": round(scanned / scan_seconds),
+        "replay_events_per_second": round(replayed / replay_seconds),
+        "replay_seconds": round(replay_seconds, 2),
+        "replay_decoded_events_per_second": round(decoded / decode_seconds),
+        "replay_decoded_seconds": round(decode_seconds, 2),
+        "directory": str(directory),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:>26}  {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--segment-mb", type=int, default=64)
+    parser.add_argument("--dir", help="where to write segments (default: a new temp dir)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,132 @@
+"""
+Throughput/latency curve for send_message inserts: one insert_one per
+message versus GroupCommitter.
+
+    python benchmarks/group_commit_bench.py              # against MONGO_URL / DB_NAME
+    python benchmarks/group_commit_bench.py --simulate   # no Mongo needed
+
+--simulate replaces the collection with a model of the server: every write
+command costs one network round trip (`--rtt`, concurrent) plus one journal
+sync (`--sync`) that is serialized across writers. It shows the shape of
+the curve, not real numbers; run against a real deployment for those.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from group_commit import GroupCommitter  # noqa: E402
+
+
+class SimulatedCollection:
+    def __init__(self, rtt: float, sync: float, per_doc: float):
+        self.rtt = rtt
+        self.sync = sync
+        self.per_doc = per_doc
+        self._journal = asyncio.Lock()
+
+    async def _write(self, count: int):
+        await asyncio.sleep(self.rtt / 2)
+        async with self._journal:
+            await asyncio.sleep(self.sync + self.per_doc * count)
+        await asyncio.sleep(self.rtt / 2)
+
+    async def insert_one(self, document):
+        await self._write(1)
+
+    async def insert_many(self, documents, ordered=True):
+        await self._write(len(documents))
+
+    async def drop(self):
+        pass
+
+
+def make_message(sender: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "match_id": f"bench-match-{sender}",
+        "sender_id": f"bench-user-{sender}",
+        "receiver_id": f"bench-user-{sender + 1}",
+        "content": "benchmark message",
+        "message_type": "text",
+        "status": "sent",
+        "created_at": datetime.now(timezone.utc),
+        "read_at": None,
+    }
+
+
+async def run_mode(collection, mode: str, concurrency: int, per_sender: int, window: float, max_batch: int):
+    writer = GroupCommitter(collection, window=window, max_batch=max_batch) if mode == "group" else None
+    latencies = []
+
+    async def sender(index: int):
+        for _ in range(per_sender):
+            document = make_message(index)
+            started = time.perf_counter()
+            if writer is not None:
+                await writer.insert(document)
+            else:
+                await collection.insert_one(document)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "messages": len(latencies),
+        "throughput": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(args):
+    if args.simulate:
+        collection = SimulatedCollection(args.rtt / 1000, args.sync / 1000, args.per_doc / 1000)
+    else:
+        from dotenv import load_dotenv
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        collection = client[os.environ['DB_NAME']].bench_group_commit
+
+    results = []
+    for concurrency in args.concurrency:
+        for mode in ("single", "group"):
+            result = await run_mode(collection, mode, concurrency, args.per_sender, args.window / 1000, args.max_batch)
+            results.append(result)
+            if not args.json:
+                print(
+                    f"{result['mode']:>6}  c={result['concurrency']:<5} {result['throughput']:>8} msg/s"
+                    f"  p50 {result['p50_ms']:>7} ms  p99 {result['p99_ms']:>7} ms"
+                )
+    if not args.simulate:
+        await collection.drop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--simulate", action="store_true")
+    parser.add_argument("--rtt", type=float, default=0.5, help="simulated round trip, ms")
+    parser.add_argument("--sync", type=float, default=0.2, help="simulated journal sync per write command, ms")
+    parser.add_argument("--per-doc", type=float, default=0.005, help="simulated cost per document, ms")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    parser.add_argument("--per-sender", type=int, default=50)
+    parser.add_argument("--window", type=float, default=2.0, help="group commit window, ms")
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,196 @@
+"""
+CPU cost of turning a list endpoint's result into response bytes, before
+and after FastJSONResponse, for the payloads of /profiles/discover?limit=50,
+/conversations and /conversations/{id}/messages.
+
+    python benchmarks/json_response_profile.py
+    python benchmarks/json_response_profile.py --profile          # cProfile top functions
+    python benchmarks/json_response_profile.py --json
+
+    before      what FastAPI does with a returned dict and no response_model:
+                jsonable_encoder, then JSONResponse.render (json.dumps)
+    stdlib      FastJSONResponse with JSON_ENCODER=stdlib
+    orjson      FastJSONResponse with orjson (skipped if not installed)
+
+Payloads are built in memory with the same shape and types (aware
+datetimes included) as the documents the driver returns; no Mongo needed.
+"""
+import argparse
+import cProfile
+import io
+import json
+import pstats
+import random
+import sys
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fast_json import ENCODERS, FastJSONResponse, use_encoder  # noqa: E402
+from storage import utcnow  # noqa: E402
+
+INTERESTS = ["السفر", "القراءة", "الطبخ", "الرياضة", "الموسيقى", "التصوير", "الفن", "السينما"]
+CONTENTS = ["مرحبا", "كيف حالك؟", "hi!", "نلتقي غداً في المقهى؟", "😂😂", "Sounds good, see you at 8"]
+
+
+def make_profile(rnd: random.Random, now) -> dict:
+    created_at = now - timedelta(days=rnd.randint(1, 400))
+    return {
+        "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+        "user_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+        "display_name": rnd.choice(["سارة", "ليلى", "نور", "Maya", "Omar", "خالد"]),
+        "bio": "أحب السفر والقهوة الصباحية والكتب الجيدة. أبحث عن شخص يشاركني المغامرات.",
+        "date_of_birth": "1996-04-12",
+        "gender": rnd.choice(["female", "male"]),
+        "height": rnd.randint(155, 190),
+        "looking_for": "علاقة جدية",
+        "interests": rnd.sample(INTERESTS, 4),
+        "photos": [f"https://images.example.com/{uuid.UUID(int=rnd.getrandbits(128))}.jpg" for _ in range(3)],
+        "location": "الرياض، السعودية",
+        "occupation": "مهندسة برمجيات",
+        "education": "بكالوريوس",
+        "relationship_goals": "serious",
+        "smoking": "no",
+        "drinking": "no",
+        "has_children": False,
+        "wants_children": True,
+        "languages": ["العربية", "English"],
+        "created_at": created_at,
+        "updated_at": created_at + timedelta(days=3),
+    }
+
+
+def discover_payload(rnd, now) -> dict:
+    return {"profiles": [make_profile(rnd, now) for _ in range(50)]}
+
+
+def conversations_payload(rnd, now) -> dict:
+    conversations = []
+    for _ in range(40):
+        matched_at = now - timedelta(days=rnd.randint(1, 60))
+        conversations.append({
+            "match_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "user": {
+                "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+                "name": "Layla",
+                "display_name": "ليلى",
+                "photo": f"https://images.example.com/{uuid.UUID(int=rnd.getrandbits(128))}.jpg",
+                "is_online": rnd.random() < 0.3,
+                "last_seen": now - timedelta(minutes=rnd.randint(1, 5000)),
+            },
+            "last_message": {
+                "content": rnd.choice(CONTENTS),
+                "created_at": matched_at + timedelta(hours=rnd.randint(1, 200)),
+                "sender_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            },
+            "unread_count": rnd.randint(0, 5),
+            "matched_at": matched_at,
+        })
+    return {"conversations": conversations}
+
+
+def messages_payload(rnd, now) -> dict:
+    match_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+    users = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(2)]
+    start = now - timedelta(days=2)
+    messages = []
+    for index in range(200):
+        sender = users[index % 2]
+        messages.append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "match_id": match_id,
+            "sender_id": sender,
+            "receiver_id": users[1 - index % 2],
+            "content": rnd.choice(CONTENTS),
+            "message_type": "text",
+            "status": "read",
+            "created_at": start + timedelta(seconds=index * 40),
+            "read_at": None,
+        })
+    return {"messages": messages, "has_more": True}
+
+
+ENDPOINTS = {
+    "/profiles/discover?limit=50": discover_payload,
+    "/conversations": conversations_payload,
+    "/conversations/{id}/messages": messages_payload,
+}
+
+
+def before(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def after(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def best_of(repeat: int, function, content) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        for _ in range(10):
+            function(content)
+        best = min(best, (time.process_time() - started) / 10)
+    return best
+
+
+def top_functions(function, content, count: int) -> str:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(50):
+        function(content)
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("tottime").print_stats(count)
+    return out.getvalue()
+
+
+def main(args):
+    rnd = random.Random(args.seed)
+    now = utcnow()
+    results = []
+    for endpoint, factory in ENDPOINTS.items():
+        content = factory(rnd, now)
+        reference = json.loads(before(content))
+        row = {"endpoint": endpoint, "bytes": len(before(content))}
+        row["before_us"] = round(best_of(args.repeat, before, content) * 1e6)
+        profiles = {"before": top_functions(before, content, args.top)} if args.profile else {}
+        for name in ("stdlib", "orjson"):
+            if name not in ENCODERS:
+                continue
+            use_encoder(name)
+            assert json.loads(after(content)) == reference, f"{name} output differs on {endpoint}"
+            row[f"{name}_us"] = round(best_of(args.repeat, after, content) * 1e6)
+            if args.profile:
+                profiles[name] = top_functions(after, content, args.top)
+        results.append(row)
+        for name, text in profiles.items():
+            print(f"===== {endpoint} [{name}] =====\n{text}", file=sys.stderr)
+    use_encoder("auto")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<30} {'bytes':>7} {'before µs':>10} {'stdlib µs':>10} {'orjson µs':>10}")
+    for r in results:
+        print(
+            f"{r['endpoint']:<30} {r['bytes']:>7} {r['before_us']:>10} {r.get('stdlib_us', '-'):>10}"
+            f" {r.get('orjson_us', '-'):>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", action="store_true", help="print cProfile top functions per path to stderr")
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
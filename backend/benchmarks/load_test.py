@@ -0,0 +1,302 @@
+"""
+Async load harness: realistic user flows against the API, with latency
+percentiles and throughput per endpoint as JSON that can be diffed
+between commits.
+
+    python benchmarks/load_test.py                                  # server:app in-process, in-memory Mongo
+    python benchmarks/load_test.py --mongo real                     # in-process, MONGO_URL / DB_NAME
+    python benchmarks/load_test.py --url http://localhost:8001/api  # a running server
+    python benchmarks/load_test.py --users 50 --concurrency 25 --out before.json
+
+In-process runs drive `server:app` through httpx's ASGI transport on the
+same event loop, so no port or uvicorn is involved. `--mongo memory`
+replaces Motor with mongomock-motor (a dev-only dependency:
+`pip install mongomock-motor==0.0.36`); it has no network or journal
+cost, so it measures the application's own CPU per request. Use
+`--mongo real` with a scratch database for end-to-end numbers.
+
+Phases run in order; each reports wall time, total requests per second
+and, per endpoint, count, errors and p50/p95/p99/max latency:
+
+    signup        register, profile setup, first page loads, settings
+    swipe_storm   every user pages through discover and swipes on each profile
+    chat          matched pairs exchange messages while polling their
+                  conversation list, unread badge and message history
+    browse        dashboard/profile/likes page loads and conditional refetches
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+PHASES = ("signup", "swipe_storm", "chat", "browse")
+PERCENTILES = (50, 95, 99)
+MESSAGES = ["مرحبا", "كيف حالك؟", "hi!", "نلتقي غداً في المقهى؟", "😂😂", "Sounds good, see you at 8"]
+INTERESTS = ["السفر", "القراءة", "الطبخ", "الرياضة", "الموسيقى", "التصوير", "الفن", "السينما"]
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def summary(self, seconds: float) -> dict:
+        endpoints = {}
+        for name in sorted(self.latencies):
+            ordered = sorted(self.latencies[name])
+            row = {
+                "count": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(ordered) / seconds, 1) if seconds else 0.0,
+            }
+            for p in PERCENTILES:
+                row[f"p{p}_ms"] = round(percentile(ordered, p) * 1000, 2)
+            row["max_ms"] = round(ordered[-1] * 1000, 2)
+            endpoints[name] = row
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            "seconds": round(seconds, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "rps": round(total / seconds, 1) if seconds else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class User:
+    def __init__(self, index: int, run_id: str):
+        self.name = f"load{index}"
+        self.email = f"load-{run_id}-{index}@example.com"
+        self.password = "load-test-password"
+        self.headers: Dict[str, str] = {}
+
+
+class Harness:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.users: List[User] = []
+        self.recorder = Recorder()
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(self, name: str, method: str, path: str, user: Optional[User] = None, expect=(200,), **kwargs):
+        headers = {**(user.headers if user else {}), **kwargs.pop("headers", {})}
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, headers=headers, **kwargs)
+            except httpx.HTTPError:
+                self.recorder.errors[name] += 1
+                self.recorder.latencies[name].append(time.perf_counter() - started)
+                return None
+            self.recorder.latencies[name].append(time.perf_counter() - started)
+        if response.status_code not in expect:
+            self.recorder.errors[name] += 1
+        return response
+
+    async def run_users(self, flow, users: List[User]):
+        await asyncio.gather(*(flow(user) for user in users))
+
+    # ----- phases -----
+
+    async def signup(self, user: User):
+        response = await self.call("POST /auth/register", "POST", "/auth/register", json={
+            "name": user.name,
+            "email": user.email,
+            "phone_number": "+966500000000",
+            "password": user.password,
+            "terms_accepted": True,
+        })
+        if response is None or response.status_code != 200:
+            return
+        user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        await self.call("POST /profile/create", "POST", "/profile/create", user, json={
+            "display_name": user.name,
+            "bio": "أحب السفر والقهوة الصباحية والكتب الجيدة.",
+            "gender": self.random.choice(["female", "male"]),
+            "interests": self.random.sample(INTERESTS, 4),
+            "location": "الرياض، السعودية",
+            "languages": ["العربية", "English"],
+        })
+        await self.call(
+            "GET /composite (profile page)", "GET", "/composite", user,
+            params={"sections": "profile,user_profile"}
+        )
+        await self.call("GET /settings", "GET", "/settings", user)
+        await self.call("PUT /settings", "PUT", "/settings", user, json={"theme": "dark"})
+
+    async def swipe_storm(self, user: User):
+        response = await self.call("GET /profiles/discover", "GET", "/profiles/discover", user, params={"limit": 50})
+        if response is None or response.status_code != 200:
+            return
+        for profile in response.json()['profiles']:
+            action = self.random.choices(("like", "pass", "super_like"), weights=(6, 3, 1))[0]
+            await self.call("POST /swipe", "POST", "/swipe", user, json={
+                "swiped_user_id": profile['user_id'],
+                "action": action,
+            })
+        await self.call("GET /matches", "GET", "/matches", user)
+
+    async def chat(self, user: User):
+        response = await self.call("GET /conversations", "GET", "/conversations", user)
+        if response is None or response.status_code != 200:
+            return
+        match_ids = [c['match_id'] for c in response.json()['conversations']]
+        if not match_ids:
+            return
+        for _ in range(self.args.chat_rounds):
+            match_id = self.random.choice(match_ids)
+            await self.call(
+                "POST /conversations/{match_id}/messages", "POST", f"/conversations/{match_id}/messages", user,
+                params={"content": self.random.choice(MESSAGES)}
+            )
+            await self.call("GET /conversations/unread", "GET", "/conversations/unread", user)
+            await self.call("GET /conversations", "GET", "/conversations", user)
+            await self.call(
+                "GET /conversations/{match_id}/messages", "GET", f"/conversations/{match_id}/messages", user,
+                params={"limit": 50}
+            )
+            await self.call(
+                "POST /conversations/{match_id}/read-receipts", "POST", f"/conversations/{match_id}/read-receipts", user
+            )
+
+    async def browse(self, user: User):
+        for page, sections in (
+            ("dashboard", "subscription_status,payment_status"),
+            ("profile", "profile,user_profile"),
+            ("likes", "likes_received,premium_subscription"),
+        ):
+            await self.call(f"GET /composite ({page} page)", "GET", "/composite", user, params={"sections": sections})
+        await self.call("GET /premium/plans", "GET", "/premium/plans", user)
+        for path in ("/profile/me", "/settings", "/subscription/status"):
+            response = await self.call(f"GET {path}", "GET", path, user)
+            if response is not None and response.headers.get("etag"):
+                # What a browser does on the next visit
+                await self.call(
+                    f"GET {path} (revalidate)", "GET", path, user, expect=(304,),
+                    headers={"If-None-Match": response.headers["etag"]}
+                )
+
+    async def run(self) -> dict:
+        self.users = [User(index, self.run_id) for index in range(self.args.users)]
+        results = {}
+        for phase in self.args.phases:
+            self.recorder = Recorder()
+            users = [u for u in self.users if u.headers] if phase != "signup" else self.users
+            started = time.perf_counter()
+            await self.run_users(getattr(self, phase), users)
+            results[phase] = self.recorder.summary(time.perf_counter() - started)
+        return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_app(mongo: str):
+    """Import server:app, with Motor swapped for mongomock-motor when `mongo` is "memory"."""
+    os.environ.setdefault("DB_NAME", f"load_test_{uuid.uuid4().hex[:8]}")
+    if mongo == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mongo memory needs mongomock-motor (pip install mongomock-motor==0.0.36)")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+    import server
+    return server.app
+
+
+async def main(args):
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        app = None
+    else:
+        app = load_app(args.mongo)
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load-test/api", timeout=args.timeout)
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+
+    try:
+        async with client:
+            phases = await Harness(client, args).run()
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "target": args.url or f"in-process ({args.mongo} mongo)",
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "chat_rounds": args.chat_rounds,
+            "seed": args.seed,
+            "python": platform.python_version(),
+        },
+        "phases": phases,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    if args.table:
+        for phase, result in phases.items():
+            print(f"\n{phase}: {result['requests']} requests in {result['seconds']}s, {result['rps']} req/s, {result['errors']} errors")
+            print(f"  {'endpoint':<48} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rps':>8}")
+            for name, row in result['endpoints'].items():
+                print(
+                    f"  {name:<48} {row['count']:>6} {row['errors']:>4} {row['p50_ms']:>8} {row['p95_ms']:>8}"
+                    f" {row['p99_ms']:>8} {row['rps']:>8}"
+                )
+    elif not args.out:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running API (…/api); default: server:app in-process")
+    parser.add_argument("--mongo", choices=("memory", "real"), default="memory", help="in-process only")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at most")
+    parser.add_argument("--chat-rounds", type=int, default=10, help="messages sent per user in the chat phase")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--log-level", default="error", help="server log level during the run")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--table", action="store_true", help="print a table instead of JSON")
+    main_args = parser.parse_args()
+    if "signup" not in main_args.phases:
+        parser.error("the other phases need the users created by signup")
+    asyncio.run(main(main_args))
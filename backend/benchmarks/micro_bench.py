@@ -0,0 +1,224 @@
+"""
+Microbenchmarks for the pure-Python helpers on every request's path, with
+a stored baseline and a regression gate.
+
+    python benchmarks/micro_bench.py                  # run, compare with the baseline
+    python benchmarks/micro_bench.py --check          # same, exit 1 on a regression
+    python benchmarks/micro_bench.py --update         # run and write a new baseline
+    python benchmarks/micro_bench.py --only jwt --json
+
+Each benchmark calls the real function from server.py (no Mongo involved)
+and reports ns per call: the fastest of `--repeat` runs, each long enough
+(timeit's autorange, at least 0.2 s) to swamp timer noise. The fastest
+run is the one least disturbed by the rest of the machine, which makes it
+the stable number to gate on; the median is shown alongside to make noise
+visible.
+
+The baseline (micro_baseline.json) holds the numbers and the Python
+version and machine they came from. Timings only compare on the same
+kind of machine, so --check warns when those differ; regenerate the
+baseline with --update where the check runs, and commit it together with
+any change that legitimately moves a number. A benchmark regresses when
+it is more than --threshold (default 25%) slower than its baseline.
+A shared or single-core machine can slow one run by that much on its
+own, so a benchmark that looks regressed is measured again, up to
+CONFIRM_RUNS more times, and only fails if every run stays over.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# server reads these at import; the client it creates never connects here
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "micro_bench")
+
+import server  # noqa: E402
+from storage import utcnow  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / "micro_baseline.json"
+THRESHOLD = 0.25
+MIN_RUN_SECONDS = 0.2
+CONFIRM_RUNS = 2
+
+
+def make_benchmarks():
+    """name -> zero-argument callable; inputs are built once, here."""
+    user_id = str(uuid.uuid4())
+    other_id = str(uuid.uuid4())
+    now = utcnow()
+
+    claims = {
+        "sub": user_id,
+        "typ": "access",
+        "sst": "trial",
+        "ted": (now + timedelta(days=30)).isoformat(),
+        "tier": "gold",
+        "ftr": server.TIER_FEATURES["gold"],
+    }
+    claims_token = server.create_access_token(data=claims, expires_delta=timedelta(minutes=15))
+
+    user_document = {
+        "id": user_id,
+        "name": "Layla",
+        "email": "layla@example.com",
+        "phone_number": "+966500000000",
+        "password_hash": "$2b$12$" + "x" * 53,
+        "created_at": now,
+        "trial_end_date": now + timedelta(days=30),
+        "subscription_status": "trial",
+        "terms_accepted": True,
+        "terms_accepted_at": now,
+        "profile_completed": True,
+    }
+    profile_document = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "display_name": "Layla",
+        "bio": "أحب السفر والقهوة الصباحية والكتب الجيدة.",
+        "gender": "female",
+        "interests": ["السفر", "القراءة", "الطبخ", "الموسيقى"],
+        "photos": [f"https://cdn.example.com/photos/{index}.jpg" for index in range(4)],
+        "location": "الرياض، السعودية",
+        "languages": ["العربية", "English"],
+        "created_at": now,
+        "updated_at": now,
+    }
+    subscription = {
+        "status": "trial",
+        "trial_end_date": now + timedelta(days=12),
+        "next_payment_date": now + timedelta(days=12),
+        "annual_amount": 396.0,
+        "currency": "CHF",
+    }
+
+    # /conversations builds one of these per match, then sorts them
+    shuffle = random.Random(1)
+    conversations = [
+        {
+            "match_id": str(uuid.uuid4()),
+            "last_message": {
+                "content": "See you at eight?",
+                "created_at": now - timedelta(minutes=shuffle.randrange(100000)),
+                "sender_id": other_id,
+            },
+            "unread_count": 0,
+        }
+        for _ in range(100)
+    ]
+
+    return {
+        "create_access_token": lambda: server.create_access_token(data={"sub": user_id}),
+        "create_access_token_claims": lambda: server.create_access_token(
+            data=claims, expires_delta=timedelta(minutes=15)
+        ),
+        "jwt_decode_claims": lambda: server.jwt.decode(
+            claims_token, server.SECRET_KEY, algorithms=[server.ALGORITHM]
+        ),
+        "user_model_dump": lambda: server.User(**user_document).model_dump(),
+        "profile_model_dump_json": lambda: server.Profile(**profile_document).model_dump(mode="json"),
+        "subscription_status_json": lambda: server.subscription_status_payload(subscription).model_dump(mode="json"),
+        "swipe_document": lambda: server.Swipe(
+            user_id=user_id, swiped_user_id=other_id, action="like"
+        ).model_dump(),
+        "match_document": lambda: server.Match(user1_id=user_id, user2_id=other_id).model_dump(),
+        "sort_conversations_100": lambda: server.sort_conversations(list(conversations)),
+    }
+
+
+def run(function, repeat: int) -> dict:
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    if elapsed < MIN_RUN_SECONDS:
+        number = int(number * MIN_RUN_SECONDS / elapsed) + 1
+    per_call = [total / number * 1e9 for total in timer.repeat(repeat, number)]
+    return {"ns": round(min(per_call)), "median_ns": round(statistics.median(per_call))}
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "machine": f"{platform.system()} {platform.machine()}"}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Names of the benchmarks more than `threshold` slower than their baseline."""
+    return [
+        name for name, result in results.items()
+        if name in baseline and result["ns"] > baseline[name]["ns"] * (1 + threshold)
+    ]
+
+
+def main(args):
+    benchmarks = make_benchmarks()
+    if args.only:
+        benchmarks = {name: fn for name, fn in benchmarks.items() if any(part in name for part in args.only)}
+    results = {name: run(function, args.repeat) for name, function in benchmarks.items()}
+
+    if args.update:
+        existing = json.loads(BASELINE.read_text())["benchmarks"] if BASELINE.exists() and args.only else {}
+        existing.update({name: {"ns": result["ns"]} for name, result in results.items()})
+        BASELINE.write_text(json.dumps(
+            {"environment": environment(), "benchmarks": dict(sorted(existing.items()))}, indent=2
+        ) + "\n")
+
+    stored = json.loads(BASELINE.read_text()) if BASELINE.exists() and not args.update else None
+    baseline = stored["benchmarks"] if stored else {}
+    regressions = compare(results, baseline, args.threshold)
+    for _ in range(CONFIRM_RUNS):
+        if not regressions:
+            break
+        for name in regressions:
+            rerun = run(benchmarks[name], args.repeat)
+            if rerun["ns"] < results[name]["ns"]:
+                results[name] = rerun
+        regressions = compare(results, baseline, args.threshold)
+
+    if args.json:
+        print(json.dumps({
+            "environment": environment(),
+            "threshold": args.threshold,
+            "results": {
+                name: {**result, "baseline_ns": baseline.get(name, {}).get("ns")} for name, result in results.items()
+            },
+            "regressions": regressions,
+        }, indent=2))
+    else:
+        print(f"{'benchmark':<28} {'ns/call':>10} {'median':>10} {'baseline':>10} {'change':>8}")
+        for name, result in results.items():
+            base = baseline.get(name, {}).get("ns")
+            change = f"{(result['ns'] / base - 1) * 100:+.1f}%" if base else "new"
+            flag = "  REGRESSED" if name in regressions else ""
+            print(f"{name:<28} {result['ns']:>10} {result['median_ns']:>10} {base or '-':>10} {change:>8}{flag}")
+
+    if stored and stored.get("environment") != environment():
+        print(
+            f"warning: baseline is from {stored.get('environment')}, this is {environment()};"
+            " timings may not be comparable",
+            file=sys.stderr
+        )
+    if args.check and regressions:
+        print(
+            f"{len(regressions)} benchmark(s) more than {args.threshold:.0%} slower than baseline: "
+            + ", ".join(regressions),
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--only", nargs="+", help="run benchmarks whose name contains any of these")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any benchmark regressed")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,338 @@
+"""
+Replay captured traffic (see traffic_capture.py) against a local instance,
+at the original rate or faster, with synthetic users standing in for the
+captured ones.
+
+    python benchmarks/traffic_replay.py CAPTURE_DIR                      # in-process, in-memory Mongo
+    python benchmarks/traffic_replay.py CAPTURE_DIR --speed 10          # an hour in six minutes
+    python benchmarks/traffic_replay.py traffic-*.jsonl --url http://localhost:8001 --out peak.json
+
+Before the clock starts, every captured caller gets a synthetic account
+(with a profile, unless the capture shows them creating one), and every
+captured match a real match between the
+synthetic users who used it (both like each other); a match only one
+side was captured using gets a synthetic partner. Then each record is
+sent at its original offset divided by --speed, with pseudonyms
+substituted consistently: a user pseudonym becomes that user's id, a
+match pseudonym that match's id, and any other id a fixed uuid derived
+from it. Conditional GETs send the ETag the same synthetic user last got
+for that URL. "<str:N>" becomes N characters of filler text, "<email>" and
+"<datetime>" plausible values. Registrations create fresh synthetic
+accounts and logins sign in a seeded user; refreshes and requests whose
+body was too large to capture are skipped and counted.
+
+With the same capture and --seed, a replay sends the same requests in
+the same order at the same offsets. The report is JSON like
+load_test.py's, for one `replay` phase: per endpoint (route template)
+count, p50/p95/p99/max latency and rps; `errors` there counts responses
+whose status differs from the captured one. `lag_ms` is how late
+requests went out against their schedule; when its p99 grows, the
+replayer or the box is saturated and the offered rate is lower than
+asked for. In-process, the replayer shares the event loop with the app,
+so anything that blocks the loop (bcrypt in register, for one) shows up
+as lag too; use --url against a separate process to tell them apart.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from load_test import INTERESTS, Recorder, git_commit, load_app, percentile  # noqa: E402
+
+FILLER = "مرحبا كيف حالك اليوم؟ see you at eight "
+PASSWORD = "replay-password"
+SKIPPED_ROUTES = frozenset({"/api/auth/refresh"})
+NAMESPACE = uuid.UUID("6f1c8a52-3f0e-4f7e-9d2c-3b8b1a4c5e70")
+
+
+def capture_files(paths: List[str]) -> List[Path]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("traffic-*.jsonl")) if path.is_dir() else [path])
+    return files
+
+
+def _read(path: Path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A torn last line from a worker that was killed mid-write
+                continue
+
+
+def read_capture(files: List[Path]) -> List[dict]:
+    """All records of all workers' files, in start-time order."""
+    return list(heapq.merge(*(_read(path) for path in files), key=lambda record: record["t"]))
+
+
+def filler(length: int) -> str:
+    return (FILLER * (length // len(FILLER) + 1))[:length]
+
+
+class SyntheticUser:
+    def __init__(self, email: str):
+        self.email = email
+        self.id: Optional[str] = None
+        self.headers: Dict[str, str] = {}
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, records: List[dict], args):
+        self.client = client
+        self.records = records
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.accounts = 0
+        self.users: Dict[str, SyntheticUser] = {}
+        self.matches: Dict[str, str] = {}
+        self.recorder = Recorder()
+        self.lag: List[float] = []
+        # (caller, url) -> last ETag seen, for conditional requests
+        self.etags: Dict[tuple, str] = {}
+        self.skipped = 0
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+
+    # ----- synthetic users and matches -----
+
+    def new_account(self) -> SyntheticUser:
+        self.accounts += 1
+        return SyntheticUser(f"replay-{self.run_id}-{self.accounts}@example.com")
+
+    async def register(self, user: SyntheticUser, with_profile: bool = True):
+        response = await self.client.post("/api/auth/register", json={
+            "name": user.email.split("@")[0],
+            "email": user.email,
+            "phone_number": "+966500000000",
+            "password": PASSWORD,
+            "terms_accepted": True,
+        })
+        response.raise_for_status()
+        user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        if with_profile:
+            response = await self.client.post("/api/profile/create", headers=user.headers, json={
+                "display_name": user.email.split("@")[0],
+                "gender": self.random.choice(["female", "male"]),
+                "interests": self.random.sample(INTERESTS, 3),
+            })
+            response.raise_for_status()
+        response = await self.client.get("/api/user/profile", headers=user.headers)
+        response.raise_for_status()
+        user.id = response.json()["id"]
+
+    async def seed(self):
+        callers = list(dict.fromkeys(record["u"] for record in self.records if record.get("u")))
+        self.users = {caller: self.new_account() for caller in callers}
+        # Captured signing up: their profile/create is part of the replay
+        new_users = {record["u"] for record in self.records if record["r"] == "/api/profile/create"}
+
+        # Who used each match: both sides when both were captured
+        sides: Dict[str, List[str]] = {}
+        for record in self.records:
+            match = record.get("p", {}).get("match_id", "")
+            if match.startswith("@") and record.get("u"):
+                used_by = sides.setdefault(match[1:], [])
+                if record["u"] not in used_by:
+                    used_by.append(record["u"])
+        partners = {match: self.new_account() for match, used_by in sides.items() if len(used_by) == 1}
+
+        async def register(user, with_profile=True):
+            async with self.semaphore:
+                await self.register(user, with_profile)
+
+        await asyncio.gather(
+            *(register(user, caller not in new_users) for caller, user in self.users.items()),
+            *(register(user) for user in partners.values())
+        )
+
+        async def pair(match: str, first: SyntheticUser, second: SyntheticUser):
+            async with self.semaphore:
+                for swiper, swiped in ((first, second), (second, first)):
+                    response = await self.client.post("/api/swipe", headers=swiper.headers, json={
+                        "swiped_user_id": swiped.id, "action": "like"
+                    })
+                    response.raise_for_status()
+                response = await self.client.get("/api/conversations", headers=first.headers)
+                response.raise_for_status()
+                for item in response.json()["conversations"]:
+                    if item["user"]["id"] == second.id:
+                        self.matches[match] = item["match_id"]
+
+        await asyncio.gather(*(
+            pair(match, self.users[used_by[0]], self.users[used_by[1]] if len(used_by) > 1 else partners[match])
+            for match, used_by in sides.items()
+        ))
+
+    # ----- substitution -----
+
+    def substitute(self, value):
+        if isinstance(value, dict):
+            return {key: self.substitute(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.substitute(item) for item in value]
+        if not isinstance(value, str):
+            return value
+        if value.startswith("@"):
+            pseudonym = value[1:]
+            if pseudonym in self.users:
+                return self.users[pseudonym].id
+            if pseudonym in self.matches:
+                return self.matches[pseudonym]
+            return str(uuid.uuid5(NAMESPACE, pseudonym))
+        if value.startswith("<str:") and value.endswith(">"):
+            return filler(int(value[5:-1]))
+        if value == "<email>":
+            return "replay@example.com"
+        if value == "<datetime>":
+            return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        return value
+
+    def request(self, record: dict) -> Optional[dict]:
+        """httpx.request arguments for a record, or None to skip it."""
+        route = record["r"]
+        body = record.get("b")
+        if route in SKIPPED_ROUTES or (isinstance(body, str) and body.startswith("<body:")):
+            return None
+        headers = {}
+        if route == "/api/auth/register":
+            account = self.new_account()
+            body = {"name": "replay", "email": account.email, "phone_number": "+966500000000",
+                    "password": PASSWORD, "terms_accepted": True}
+        elif route == "/api/auth/login":
+            body = {"email": self.random.choice(list(self.users.values())).email, "password": PASSWORD} if self.users else None
+        else:
+            body = self.substitute(body) if body is not None else None
+            if record.get("u") in self.users:
+                headers = self.users[record["u"]].headers
+
+        path = route
+        for name, value in record.get("p", {}).items():
+            path = path.replace("{" + name + "}", str(self.substitute(value)))
+        params = [(key, self.substitute(value)) for key, value in record.get("q", [])]
+        return {"method": record["m"], "url": path, "params": params, "json": body, "headers": headers}
+
+    # ----- replay -----
+
+    async def issue(self, record: dict, arguments: dict):
+        name = f"{record['m']} {record['r']}"
+        if record.get("c"):
+            # Looked up at send time: the response that set it may have only just arrived
+            etag = self.etags.get((record.get("u"), arguments["url"]))
+            if etag:
+                arguments["headers"] = {**arguments["headers"], "If-None-Match": etag}
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(**arguments)
+                status_code = response.status_code
+                if "etag" in response.headers:
+                    self.etags[(record.get("u"), arguments["url"])] = response.headers["etag"]
+            except httpx.HTTPError:
+                status_code = None
+            self.recorder.latencies[name].append(time.perf_counter() - started)
+        if status_code != record["s"]:
+            self.recorder.errors[name] += 1
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        origin = self.records[0]["t"]
+        started = loop.time()
+        tasks = []
+        for record in self.records:
+            arguments = self.request(record)
+            if arguments is None:
+                self.skipped += 1
+                continue
+            due = started + (record["t"] - origin) / self.args.speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.lag.append(max(0.0, loop.time() - due))
+            tasks.append(asyncio.create_task(self.issue(record, arguments)))
+        await asyncio.gather(*tasks)
+        summary = self.recorder.summary(loop.time() - started)
+        ordered = sorted(self.lag)
+        summary["lag_ms"] = {
+            **{f"p{p}": round(percentile(ordered, p) * 1000, 2) for p in (50, 99)},
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        }
+        summary["skipped"] = self.skipped
+        return summary
+
+
+async def main(args):
+    files = capture_files(args.capture)
+    records = read_capture(files)[:args.limit]
+    if not records:
+        sys.exit("no records in " + ", ".join(args.capture))
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        app = None
+    else:
+        app = load_app(args.mongo)
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay", timeout=args.timeout)
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+
+    try:
+        async with client:
+            replayer = Replayer(client, records, args)
+            seed_started = time.perf_counter()
+            await replayer.seed()
+            seed_seconds = time.perf_counter() - seed_started
+            replay = await replayer.run()
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "target": args.url or f"in-process ({args.mongo} mongo)",
+            "capture": [str(path) for path in files],
+            "records": len(records),
+            "captured_seconds": round(records[-1]["t"] - records[0]["t"], 3),
+            "speed": args.speed,
+            "seed": args.seed,
+            "synthetic_users": len(replayer.users),
+            "matches": len(replayer.matches),
+            "seed_seconds": round(seed_seconds, 3),
+            "python": platform.python_version(),
+        },
+        "phases": {"replay": replay},
+    }
+    text = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="+", help="capture directories or traffic-*.jsonl files")
+    parser.add_argument("--url", help="root URL of a running server; default: server:app in-process")
+    parser.add_argument("--mongo", choices=("memory", "real"), default="memory", help="in-process only")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay rate as a multiple of the captured one")
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--concurrency", type=int, default=200, help="requests in flight at most")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--log-level", default="error", help="server log level during the run")
+    parser.add_argument("--out", help="write the JSON report here")
+    asyncio.run(main(parser.parse_args()))
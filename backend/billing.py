@@ -0,0 +1,285 @@
+"""
+Billing scheduler: ends trials and renews annual subscriptions.
+
+Due subscriptions (status trial/active with next_payment_date <= now) are
+claimed a chunk at a time with a lease, charged concurrently through a
+PaymentGateway with at most `max_in_flight` charges outstanding, and their
+outcomes are written back with one bulk write per collection per chunk:
+
+    charged     status "active", next_payment_date + 1 year, payment recorded
+    declined    status "expired" (also when no payment method is on file)
+    failed      a timeout or gateway error: the charge may or may not have
+                gone through, so nothing changes but billing_attempts; the
+                lease is kept and the next run after it runs out retries
+                with the same idempotency key, for as long as it takes
+    deferred    the circuit breaker refused the call, nothing was sent; the
+                lease is released without counting an attempt and the run
+                stops, the next run picks the subscription up again
+
+Only a decline ends a subscription: an outage, however long, leaves users
+on their current status until the gateway answers. A subscription still
+failing after WARN_AFTER_ATTEMPTS runs is logged for someone to look at.
+
+Crash safety: the idempotency key of a charge is the subscription id plus
+the next_payment_date being paid (`idempotency_key`), so when a crashed run's leases expire and
+another run picks the same subscriptions up, the gateway replays the
+original outcome instead of charging again. Several schedulers (one per
+worker, or a cron job next to them) can run at once; leases keep their
+chunks disjoint.
+
+Throughput is bounded by gateway latency / max_in_flight: at 100 ms per
+charge and 200 in flight that is ~2000 renewals/s, so a 1M renewal day
+takes ~8.5 minutes. Mongo work is ~6 round trips per chunk of 1000.
+
+    python billing.py run     # one pass over everything due, through PAYMENT_GATEWAY_URL
+"""
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from pymongo import ASCENDING, UpdateOne
+
+from payments import CircuitOpenError, PaymentDeclined, PaymentGateway, create_payment_gateway
+from storage import parse_datetime, utcnow
+import versions
+
+logger = logging.getLogger(__name__)
+
+BILLING_CHUNK_SIZE = 1000
+MAX_IN_FLIGHT = 200
+LEASE_SECONDS = 600
+WARN_AFTER_ATTEMPTS = 3
+RENEWAL_PERIOD = timedelta(days=365)
+
+
+async def ensure_indexes(db):
+    await db.subscriptions.create_index([("next_payment_date", ASCENDING), ("status", ASCENDING)])
+    await db.subscriptions.create_index("id")
+    await db.payments.create_index("idempotency_key", unique=True)
+
+
+def idempotency_key(subscription: dict) -> str:
+    """
+    "<id>:<next_payment_date as ISO string>", byte for byte what it was when
+    dates were stored as strings: a date migrated from one is keyed by the
+    original string (kept in billing_key_date while it still names the
+    same instant), which carries microseconds BSON no longer does.
+    """
+    paying = subscription['next_payment_date']
+    if isinstance(paying, str):
+        return f"{subscription['id']}:{paying}"
+    original = subscription.get('billing_key_date')
+    if original is not None:
+        kept = parse_datetime(original)
+        if kept.replace(microsecond=kept.microsecond // 1000 * 1000) == paying:
+            return f"{subscription['id']}:{original}"
+    return f"{subscription['id']}:{paying.isoformat()}"
+
+
+class BillingScheduler:
+    def __init__(
+        self,
+        db,
+        gateway: PaymentGateway,
+        chunk_size: int = BILLING_CHUNK_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        lease_seconds: int = LEASE_SECONDS
+    ):
+        self.db = db
+        self.gateway = gateway
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.lease = timedelta(seconds=lease_seconds)
+        self.run_id = str(uuid.uuid4())
+
+    async def run_once(self) -> Dict[str, int]:
+        """Process everything due right now; returns outcome counts."""
+        totals = {"charged": 0, "declined": 0, "failed": 0, "deferred": 0}
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        while True:
+            chunk = await self._claim_chunk()
+            if not chunk:
+                break
+            outcomes = await self._charge_chunk(chunk, semaphore)
+            await self._record(chunk, outcomes)
+            for outcome in outcomes.values():
+                totals[outcome[0]] += 1
+            logger.info("Billing run %s: %s", self.run_id, totals)
+            if totals["deferred"]:
+                # The breaker is open; claiming more would only lease them idle
+                break
+        return totals
+
+    async def _claim_chunk(self) -> List[dict]:
+        now = utcnow()
+        due = await self.db.subscriptions.find(
+            {
+                "status": {"$in": ["trial", "active"]},
+                "next_payment_date": {"$lte": now},
+                "$or": [
+                    {"billing_lease_until": {"$exists": False}},
+                    {"billing_lease_until": {"$lt": now}}
+                ]
+            },
+            {"_id": 0, "id": 1}
+        ).sort("next_payment_date", ASCENDING).limit(self.chunk_size).to_list(length=self.chunk_size)
+        if not due:
+            return []
+
+        # Another scheduler may claim some of these between the find and
+        # the update; only what carries our run id afterwards is ours.
+        ids = [s['id'] for s in due]
+        await self.db.subscriptions.update_many(
+            {
+                "id": {"$in": ids},
+                "$or": [
+                    {"billing_lease_until": {"$exists": False}},
+                    {"billing_lease_until": {"$lt": now}}
+                ]
+            },
+            {"$set": {"billing_lease_until": now + self.lease, "billing_lease_owner": self.run_id}}
+        )
+        return await self.db.subscriptions.find(
+            {"id": {"$in": ids}, "billing_lease_owner": self.run_id},
+            {"_id": 0}
+        ).to_list(length=len(ids))
+
+    async def _charge_chunk(self, chunk: List[dict], semaphore: asyncio.Semaphore) -> Dict[str, tuple]:
+        methods = {
+            m['user_id']: m
+            for m in await self.db.payment_methods.find(
+                {"user_id": {"$in": [s['user_id'] for s in chunk]}, "is_active": True},
+                {"_id": 0}
+            ).to_list(length=None)
+        }
+
+        async def charge(subscription):
+            method = methods.get(subscription['user_id'])
+            if method is None:
+                return "declined", None
+            async with semaphore:
+                try:
+                    result = await self.gateway.charge(
+                        user_id=subscription['user_id'],
+                        payment_method=method,
+                        amount=subscription['annual_amount'],
+                        currency=subscription['currency'],
+                        idempotency_key=idempotency_key(subscription)
+                    )
+                except PaymentDeclined:
+                    return "declined", None
+                except CircuitOpenError:
+                    return "deferred", None
+                except Exception as e:
+                    logger.warning("Charge for subscription %s failed: %s", subscription['id'], e)
+                    return "failed", None
+            return "charged", result
+
+        results = await asyncio.gather(*(charge(s) for s in chunk))
+        return {s['id']: outcome for s, outcome in zip(chunk, results)}
+
+    async def _record(self, chunk: List[dict], outcomes: Dict[str, tuple]):
+        now = utcnow()
+        subscription_updates = []
+        user_updates = []
+        payments = []
+        release = {"billing_lease_until": "", "billing_lease_owner": ""}
+
+        for subscription in chunk:
+            outcome, result = outcomes[subscription['id']]
+            if outcome == "charged":
+                paid_until = subscription['next_payment_date'] + RENEWAL_PERIOD
+                subscription_updates.append(UpdateOne(
+                    {"id": subscription['id']},
+                    {
+                        "$set": {"status": "active", "next_payment_date": paid_until, "last_payment_date": now, "billing_attempts": 0},
+                        "$unset": {**release, "billing_key_date": ""},
+                        "$inc": versions.BUMP
+                    }
+                ))
+                user_updates.append(UpdateOne(
+                    {"id": subscription['user_id']},
+                    {"$set": {"subscription_status": "active"}, "$inc": versions.BUMP}
+                ))
+                payments.append(UpdateOne(
+                    {"idempotency_key": result.idempotency_key},
+                    {"$setOnInsert": {
+                        "id": str(uuid.uuid4()),
+                        "subscription_id": subscription['id'],
+                        "user_id": subscription['user_id'],
+                        "amount": result.amount,
+                        "currency": result.currency,
+                        "transaction_id": result.transaction_id,
+                        "idempotency_key": result.idempotency_key,
+                        "created_at": now
+                    }},
+                    upsert=True
+                ))
+            elif outcome == "declined":
+                subscription_updates.append(UpdateOne(
+                    {"id": subscription['id']},
+                    {"$set": {"status": "expired"}, "$unset": release, "$inc": versions.BUMP}
+                ))
+                user_updates.append(UpdateOne(
+                    {"id": subscription['user_id']},
+                    {"$set": {"subscription_status": "expired"}, "$inc": versions.BUMP}
+                ))
+            elif outcome == "deferred":
+                subscription_updates.append(UpdateOne({"id": subscription['id']}, {"$unset": release}))
+            else:
+                # Keep the lease so this run does not pick it up again; the
+                # next run after it expires retries with the same key.
+                attempts = subscription.get('billing_attempts', 0) + 1
+                if attempts >= WARN_AFTER_ATTEMPTS:
+                    logger.error("Subscription %s: charge failed %d times in a row", subscription['id'], attempts)
+                subscription_updates.append(UpdateOne({"id": subscription['id']}, {"$inc": {"billing_attempts": 1}}))
+
+        # Payments first: if we crash after this, the retry finds the charge
+        # replayed by the gateway and the payment upsert is a no-op.
+        if payments:
+            await self.db.payments.bulk_write(payments, ordered=False)
+        if subscription_updates:
+            await self.db.subscriptions.bulk_write(subscription_updates, ordered=False)
+        if user_updates:
+            await self.db.users.bulk_write(user_updates, ordered=False)
+
+
+async def run_billing(scheduler: BillingScheduler, interval: float):
+    """Background task: a billing pass every `interval` seconds."""
+    while True:
+        try:
+            await scheduler.run_once()
+        except Exception as e:
+            logger.warning("Billing pass failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["run"]:
+        print("usage: python billing.py run")
+        sys.exit(2)
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    database = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+
+    async def main():
+        await ensure_indexes(database)
+        gateway = create_payment_gateway(
+            os.environ.get('PAYMENT_GATEWAY_URL', 'fake://'),
+            api_key=os.environ.get('PAYMENT_GATEWAY_API_KEY', '')
+        )
+        try:
+            print(await BillingScheduler(database, gateway).run_once())
+        finally:
+            await gateway.close()
+
+    asyncio.run(main())
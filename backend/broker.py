@@ -0,0 +1,417 @@
+"""
+Pub/sub fan-out between the worker processes serving `server:app`.
+
+A message published on one worker reaches every subscriber of the channel,
+whichever worker it is connected to. Backends are picked by URL:
+
+    memory://                 single process (default)
+    unix:///tmp/pizoo.sock    several workers on one host; the first worker
+                              to take the lock file hosts the hub, the
+                              others connect to it and take over if it dies
+    tcp://broker-host:7400    external hub; `python broker.py serve URL`
+                              runs a local stand-in
+
+Every subscription owns a bounded queue. When it is full the subscription's
+policy decides what happens: drop the oldest queued message, drop the new
+one, or make the publisher wait (for at most `block_timeout` seconds, after
+which the message is dropped so one stuck client cannot stall the rest).
+"""
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sys
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from storage import json_default
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+DEFAULT_QUEUE_SIZE = 256
+# Outgoing frames buffered per connection inside the hub
+HUB_QUEUE_SIZE = 4096
+# StreamReader line limit; a frame is one JSON document per line
+MAX_FRAME_SIZE = 1024 * 1024
+
+
+class Subscription:
+    """Bounded mailbox for one consumer of one or more channels."""
+
+    def __init__(self, broker: "Broker", channels: Tuple[str, ...], maxsize: int, policy: str, block_timeout: float):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown broker policy: {policy}")
+        self.broker = broker
+        self.channels = channels
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    async def deliver(self, channel: str, message: dict):
+        item = (channel, message)
+        if self.policy == BLOCK:
+            try:
+                await asyncio.wait_for(self.queue.put(item), self.block_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+            return
+
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+
+    async def get(self) -> Tuple[str, dict]:
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        return await self.get()
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self.broker.unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class Broker:
+    """Base class: keeps the local subscriber table and fans messages out to it."""
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE, policy: str = DROP_OLDEST, block_timeout: float = 1.0):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                subscription.closed = True
+        self._subscribers.clear()
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    async def subscribe(self, *channels: str, maxsize: Optional[int] = None, policy: Optional[str] = None) -> Subscription:
+        subscription = Subscription(
+            self,
+            channels,
+            maxsize or self.queue_size,
+            policy or self.policy,
+            self.block_timeout,
+        )
+        for channel in channels:
+            first = channel not in self._subscribers
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            if first:
+                await self._channel_added(channel)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        for channel in subscription.channels:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[channel]
+                await self._channel_removed(channel)
+
+    async def _channel_added(self, channel: str):
+        pass
+
+    async def _channel_removed(self, channel: str):
+        pass
+
+    async def _dispatch(self, channel: str, message: dict):
+        subscribers = self._subscribers.get(channel)
+        if not subscribers:
+            return
+        deliveries = [s.deliver(channel, message) for s in list(subscribers)]
+        if len(deliveries) == 1:
+            await deliveries[0]
+        else:
+            await asyncio.gather(*deliveries)
+
+
+class InProcessBroker(Broker):
+    """Fan-out within a single worker process."""
+
+    async def publish(self, channel: str, message: dict):
+        await self._dispatch(channel, message)
+
+
+# ===== Socket transport =====
+
+def _encode(frame: dict) -> bytes:
+    return json.dumps(frame, separators=(",", ":"), default=json_default).encode() + b"\n"
+
+
+def _decode(line: bytes) -> Optional[Tuple[str, dict]]:
+    """(channel, message) of a published frame, or None (logged) for a malformed one."""
+    try:
+        frame = json.loads(line)
+        channel, message = frame["ch"], frame["msg"]
+        if not isinstance(channel, str):
+            raise TypeError(f"channel is {type(channel).__name__}")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Skipping malformed broker frame: %r", e)
+        return None
+    return channel, message
+
+
+async def _open_connection(url):
+    if url.scheme == "unix":
+        return await asyncio.open_unix_connection(url.path, limit=MAX_FRAME_SIZE)
+    return await asyncio.open_connection(url.hostname, url.port, limit=MAX_FRAME_SIZE)
+
+
+class BrokerHub:
+    """
+    Routes frames between connected workers. Frames are JSON lines:
+    {"op": "sub"|"unsub", "ch": ...} and {"op": "pub", "ch": ..., "msg": ...}.
+    Each connection gets its own outgoing queue; a connection that falls
+    behind loses its oldest frames instead of slowing the publisher down.
+    """
+
+    def __init__(self, url: str, queue_size: int = HUB_QUEUE_SIZE):
+        self.url = urlparse(url)
+        self.queue_size = queue_size
+        self._routes: Dict[str, Set[asyncio.Queue]] = {}
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._server = None
+
+    async def start(self):
+        if self.url.scheme == "unix":
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.url.path)
+            self._server = await asyncio.start_unix_server(self._handle, self.url.path, limit=MAX_FRAME_SIZE)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.url.hostname, self.url.port, limit=MAX_FRAME_SIZE)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        outgoing: asyncio.Queue = asyncio.Queue(self.queue_size)
+        channels: Set[str] = set()
+        sender = asyncio.create_task(self._send_loop(outgoing, writer))
+        self._connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    frame = json.loads(line)
+                    op = frame.get("op")
+                    channel = frame.get("ch")
+                    if not isinstance(channel, str):
+                        raise TypeError(f"channel is {type(channel).__name__}")
+                except (ValueError, AttributeError, TypeError) as e:
+                    logger.warning("Broker hub skipping malformed frame: %r", e)
+                    continue
+                if op == "sub":
+                    channels.add(channel)
+                    self._routes.setdefault(channel, set()).add(outgoing)
+                elif op == "unsub":
+                    channels.discard(channel)
+                    self._route_remove(channel, outgoing)
+                elif op == "pub":
+                    for queue in self._routes.get(channel, ()):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(line)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Broker hub dropped a connection: %s", e)
+        finally:
+            for channel in channels:
+                self._route_remove(channel, outgoing)
+            self._connections.discard(writer)
+            sender.cancel()
+            writer.close()
+
+    def _route_remove(self, channel: str, queue: asyncio.Queue):
+        queues = self._routes.get(channel)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._routes[channel]
+
+    @staticmethod
+    async def _send_loop(outgoing: asyncio.Queue, writer: asyncio.StreamWriter):
+        with contextlib.suppress(ConnectionError):
+            while True:
+                writer.write(await outgoing.get())
+                # Coalesce whatever else is already queued into the same drain
+                while not outgoing.empty():
+                    writer.write(outgoing.get_nowait())
+                await writer.drain()
+
+
+class SocketBroker(Broker):
+    """
+    Fan-out through a BrokerHub over a Unix or TCP socket. For unix:// URLs
+    the workers elect a hub among themselves with a lock file next to the
+    socket, so no extra process has to be deployed on a single host.
+    """
+
+    def __init__(self, url: str, reconnect_delay: float = 0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.url = urlparse(url)
+        self.reconnect_delay = reconnect_delay
+        self.hub: Optional[BrokerHub] = None
+        self._lock_file = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        await self._connect()
+        self._reader_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._closing = True
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+        if self._writer is not None:
+            self._writer.close()
+        if self.hub is not None:
+            await self.hub.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+        await super().close()
+
+    async def publish(self, channel: str, message: dict):
+        if not self._connected.is_set():
+            # Fan-out is best effort; clients fall back to polling
+            logger.warning("Broker disconnected, dropping message on %s", channel)
+            return
+        await self._send({"op": "pub", "ch": channel, "msg": message})
+
+    async def _channel_added(self, channel: str):
+        await self._send({"op": "sub", "ch": channel})
+
+    async def _channel_removed(self, channel: str):
+        await self._send({"op": "unsub", "ch": channel})
+
+    async def _send(self, frame: dict):
+        if not self._connected.is_set():
+            return
+        try:
+            self._writer.write(_encode(frame))
+            await self._writer.drain()
+        except (ConnectionError, OSError) as e:
+            # The hub went away: drop the frame rather than fail the caller
+            # (the message is already stored), and close our end so the
+            # reader sees EOF and reconnects, electing a new hub if needed
+            logger.warning("Broker write failed, dropping %s frame: %s", frame.get("op"), e)
+            self._connected.clear()
+            self._writer.close()
+
+    def _try_become_hub(self) -> bool:
+        if self.url.scheme != "unix" or self.hub is not None:
+            return False
+        lock_file = open(self.url.path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _connect(self):
+        while True:
+            if self._try_become_hub():
+                self.hub = BrokerHub(self.url.geturl())
+                await self.hub.start()
+                logger.info("Hosting broker hub on %s (pid %s)", self.url.path, os.getpid())
+            try:
+                self._reader, self._writer = await _open_connection(self.url)
+                break
+            except (FileNotFoundError, ConnectionError) as e:
+                if self._closing:
+                    raise
+                logger.info("Waiting for broker hub at %s: %s", self.url.geturl(), e)
+                await asyncio.sleep(self.reconnect_delay)
+
+        for channel in self._subscribers:
+            self._writer.write(_encode({"op": "sub", "ch": channel}))
+        await self._writer.drain()
+        self._connected.set()
+
+    async def _run(self):
+        while True:
+            try:
+                while True:
+                    line = await self._reader.readline()
+                    if not line:
+                        break
+                    decoded = _decode(line)
+                    if decoded is not None:
+                        await self._dispatch(*decoded)
+            except (ConnectionError, ValueError) as e:
+                logger.warning("Broker connection error: %s", e)
+            self._connected.clear()
+            if self._closing:
+                return
+            logger.warning("Lost connection to broker hub, reconnecting")
+            await asyncio.sleep(self.reconnect_delay)
+            await self._connect()
+
+
+def create_broker(url: str = "memory://", **kwargs) -> Broker:
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return InProcessBroker(**kwargs)
+    if scheme in ("unix", "tcp"):
+        return SocketBroker(url, **kwargs)
+    raise ValueError(f"Unsupported broker URL: {url}")
+
+
+if __name__ == "__main__":
+    # Stand-in for an external broker: python broker.py serve tcp://127.0.0.1:7400
+    if len(sys.argv) != 3 or sys.argv[1] != "serve":
+        print("usage: python broker.py serve <unix:///path | tcp://host:port>")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(BrokerHub(sys.argv[2]).serve_forever())
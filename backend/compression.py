@@ -0,0 +1,157 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Brotli is preferred when the client accepts it and the module is
+installed, then gzip. Responses are passed through untouched when they:
+
+    - are smaller than `minimum_size` (the headers would cost more than the saving)
+    - already carry a Content-Encoding (e.g. StaticResponse's pre-compressed variants)
+    - have a content type that is already compressed (images, video, archives)
+      or must not be buffered (text/event-stream)
+
+A single-chunk body of `thread_size` bytes or more is compressed in a
+worker thread, so a large page does not stall every other request on the
+event loop. Streaming bodies are compressed chunk by chunk inline.
+"""
+import asyncio
+import gzip
+import zlib
+from typing import Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from static_responses import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+THREAD_SIZE = 64 * 1024
+
+EXCLUDED_CONTENT_TYPES: Tuple[str, ...] = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+    "application/pdf",
+    "text/event-stream",
+)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = MINIMUM_SIZE,
+        gzip_level: int = GZIP_LEVEL,
+        brotli_quality: int = BROTLI_QUALITY,
+        thread_size: int = THREAD_SIZE,
+        excluded_content_types: Tuple[str, ...] = EXCLUDED_CONTENT_TYPES
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_size = thread_size
+        self.excluded_content_types = excluded_content_types
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        accepted = accepted_encodings(accept_encoding)
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, self.gzip_level, mtime=0)
+
+    def compressor(self, encoding: str):
+        """Incremental compressor for streaming bodies: (compress(chunk), flush())."""
+        if encoding == "br":
+            state = brotli.Compressor(quality=self.brotli_quality)
+            return state.process, state.finish
+        state = zlib.compressobj(self.gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        return state.compress, state.flush
+
+    def compressible(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return not content_type.startswith(self.excluded_content_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        stream = None  # (compress, flush) once a streaming body is being compressed
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, stream, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows how large the response is
+                start = message
+                if not self.compressible(Headers(raw=message["headers"])):
+                    passthrough = True
+                    await send(start)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                if not more_body:
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    if len(body) >= self.thread_size:
+                        compressed = await asyncio.to_thread(self.compress, encoding, body)
+                    else:
+                        compressed = self.compress(encoding, body)
+                    headers = MutableHeaders(raw=start["headers"])
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(compressed))
+                    headers.add_vary_header("Accept-Encoding")
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                stream = self.compressor(encoding)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                del headers["Content-Length"]
+                await send(start)
+
+            compress, flush = stream
+            chunk = compress(body)
+            if not more_body:
+                chunk += flush()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
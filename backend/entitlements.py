@@ -0,0 +1,111 @@
+"""
+Premium entitlements, cached per worker.
+
+`EntitlementResolver.get(user_id)` returns what `/premium/subscription`
+returns: the user's premium subscription while it is active, or the free
+tier. Entries are kept in memory for at most ENTRY_TTL seconds (less when
+the subscription's end_date comes first), so repeat lookups are a dict hit.
+subscribe_premium invalidates the entry on every worker through the broker;
+fan-out is best effort (a disconnected broker or a subscriber stuck past
+block_timeout drops messages), so a lost invalidation is stale for
+ENTRY_TTL at most.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from broker import BLOCK
+from storage import parse_datetime
+
+INVALIDATE_CHANNEL = "invalidate:entitlements"
+MAX_ENTRIES = 100_000
+ENTRY_TTL = 300
+
+FREE_FEATURES = {
+    "unlimited_likes": False,
+    "see_who_liked": False,
+    "unlimited_rewinds": False,
+    "super_likes_per_day": 1,
+    "boosts_per_month": 0,
+    "top_picks": False,
+    "read_receipts": False,
+    "profile_controls": False
+}
+
+TIER_FEATURES = {
+    "gold": {
+        "unlimited_likes": True,
+        "see_who_liked": True,
+        "unlimited_rewinds": True,
+        "super_likes_per_day": 5,
+        "boosts_per_month": 1,
+        "top_picks": True,
+        "read_receipts": False,
+        "profile_controls": False
+    },
+    "platinum": {
+        "unlimited_likes": True,
+        "see_who_liked": True,
+        "unlimited_rewinds": True,
+        "super_likes_per_day": 10,
+        "boosts_per_month": 2,
+        "top_picks": True,
+        "read_receipts": True,
+        "profile_controls": True
+    },
+}
+
+
+def free_tier() -> dict:
+    return {"tier": "free", "status": "active", "features": dict(FREE_FEATURES)}
+
+
+def _expires_at(subscription: dict) -> Optional[float]:
+    end_date = parse_datetime(subscription.get('end_date'))
+    return end_date.timestamp() if end_date else None
+
+
+class EntitlementResolver:
+    def __init__(self, db, broker, max_entries: int = MAX_ENTRIES, ttl: float = ENTRY_TTL):
+        self.db = db
+        self.broker = broker
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, user_id: str) -> dict:
+        entry = self._cache.get(user_id)
+        if entry is not None and time.time() < entry[1]:
+            self._cache.move_to_end(user_id)
+            return entry[0]
+        return await self._load(user_id)
+
+    async def _load(self, user_id: str) -> dict:
+        subscription = await self.db.premium_subscriptions.find_one({"user_id": user_id}, {"_id": 0})
+        now = time.time()
+        expires_at = _expires_at(subscription) if subscription else None
+
+        until = now + self.ttl
+        if subscription and subscription.get('status') == "active" and (expires_at is None or expires_at > now):
+            entitlement, until = subscription, min(until, expires_at or until)
+        else:
+            entitlement = free_tier()
+
+        self._cache[user_id] = (entitlement, until)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return entitlement
+
+    async def invalidate(self, user_id: str):
+        """Drop the entry here and on every other worker."""
+        self._cache.pop(user_id, None)
+        await self.broker.publish(INVALIDATE_CHANNEL, {"user_id": user_id})
+
+    async def run_invalidations(self):
+        """Background task: apply invalidations published by other workers."""
+        # Block rather than drop while a burst is applied; anything still lost
+        # (block_timeout, a broker outage) is stale until its entry's TTL
+        async with await self.broker.subscribe(INVALIDATE_CHANNEL, maxsize=4096, policy=BLOCK) as subscription:
+            async for _, message in subscription:
+                self._cache.pop(message['user_id'], None)
@@ -0,0 +1,379 @@
+"""
+Append-only binary event log.
+
+Write paths emit compact events (register, swipe, match, message,
+premium_subscribe) into local segment files so analytics and replays can
+read history without querying the live collections. Message events carry
+ids and the content's length, never the text. Events are buffered in
+memory and appended every EVENT_LOG_FLUSH_MS (or as soon as the buffer
+fills) by `run`, which does the file I/O in a worker thread so the event
+loop never waits on a write or fsync; a crash loses at most that window,
+and a torn record at the end of a segment is detected and skipped by
+readers.
+
+Layout: one directory, segments named `YYYYMMDD-<pid>-<seq>.evlog`. A
+segment holds events of one UTC day from one process and is rotated when
+it reaches `segment_bytes` or the day changes. Each segment starts with
+an 8-byte header (MAGIC, version) followed by records:
+
+    u32 body length | u32 crc32 | u8 type | i64 timestamp (us) | body
+
+The body is the event's fixed fields (ids as 16 raw bytes, timestamps as
+i64 microseconds) followed by its length-prefixed strings, so a swipe is
+~55 bytes on disk against ~250 as a Mongo document. An event with an id
+that is not a UUID (the seeded dummy-user-N accounts) is written in its
+type's wide form instead: type code + WIDE, every id a length-prefixed
+string.
+
+Readers mmap segments and never touch Mongo:
+
+    for event in replay(directory, date(2026, 10, 18)):
+        event.type, event.time, event.data
+
+    python event_log.py stats DIR [YYYY-MM-DD]   # counts per type and read rate
+    python event_log.py dump DIR YYYY-MM-DD      # events as JSON lines
+"""
+import asyncio
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage import json_default
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PZEV"
+VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sB3x")
+RECORD_HEADER = struct.Struct("<IIBq")
+_RECORD_PREFIX = struct.Struct("<II")  # length, crc32 of everything after it
+_RECORD_META = struct.Struct("<Bq")
+SEGMENT_SUFFIX = ".evlog"
+SEGMENT_BYTES = 64 * 1024 * 1024
+FLUSH_INTERVAL = 0.2
+FLUSH_BYTES = 256 * 1024
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+DAY_US = 86_400_000_000
+
+# Field kinds: fixed-size ones go into the struct, strings after it
+_FIXED = {"id": "16s", "ts": "q", "bool": "?", "u32": "I"}
+_LENGTH = {"str": struct.Struct("<H"), "text": struct.Struct("<I"), "sid": struct.Struct("<H")}
+# Added to the type code of an event whose ids are written as "sid" (required strings)
+WIDE = 0x80
+
+# type name -> (code, fields); codes and field order are the on-disk format,
+# append new types and never renumber
+EVENT_TYPES = {
+    "register": (1, (("user_id", "id"), ("trial_end_date", "ts"))),
+    "swipe": (2, (("user_id", "id"), ("swiped_user_id", "id"), ("action", "str"))),
+    "match": (3, (("match_id", "id"), ("user1_id", "id"), ("user2_id", "id"))),
+    "message": (4, (
+        ("message_id", "id"), ("match_id", "id"), ("sender_id", "id"), ("receiver_id", "id"),
+        ("message_type", "str"), ("content_length", "u32")
+    )),
+    "premium_subscribe": (5, (("user_id", "id"), ("tier", "str"), ("duration", "str"), ("end_date", "ts"))),
+}
+
+
+def _to_us(value) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def _from_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _id_bytes(value: str) -> bytes:
+    if len(value) != 36:
+        raise ValueError(f"not a UUID: {value!r}")
+    return bytes.fromhex(value.replace("-", ""))
+
+
+def _id_str(value: bytes) -> str:
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+_FROM_DISK = {"id": _id_str, "ts": _from_us}
+
+
+class _Codec:
+    def __init__(self, name: str, code: int, fields):
+        self.name = name
+        self.code = code
+        self.fixed = [(n, k) for n, k in fields if k in _FIXED]
+        self.strings = [(n, _LENGTH[k], k == "sid") for n, k in fields if k in _LENGTH]
+        self.struct = struct.Struct("<" + "".join(_FIXED[k] for _, k in self.fixed))
+        self._names = [n for n, _ in self.fixed]
+        self._converters = [(i, _FROM_DISK[k]) for i, (_, k) in enumerate(self.fixed) if k in _FROM_DISK]
+
+    def encode(self, data: dict) -> bytes:
+        fixed = []
+        for name, kind in self.fixed:
+            value = data[name]
+            if kind == "id":
+                value = _id_bytes(value)
+            elif kind == "ts":
+                value = _to_us(value)
+            fixed.append(value)
+        parts = [self.struct.pack(*fixed)]
+        for name, length, required in self.strings:
+            encoded = (data[name] if required else data.get(name) or "").encode("utf-8")
+            parts.append(length.pack(len(encoded)))
+            parts.append(encoded)
+        return b"".join(parts)
+
+    def decode(self, buffer, offset: int) -> dict:
+        values = list(self.struct.unpack_from(buffer, offset))
+        for index, convert in self._converters:
+            values[index] = convert(values[index])
+        data = dict(zip(self._names, values))
+        offset += self.struct.size
+        for name, length, _ in self.strings:
+            (size,) = length.unpack_from(buffer, offset)
+            offset += length.size
+            data[name] = str(buffer[offset:offset + size], "utf-8")
+            offset += size
+        return data
+
+
+_CODECS = {name: _Codec(name, code, fields) for name, (code, fields) in EVENT_TYPES.items()}
+_WIDE_CODECS = {
+    name: _Codec(name, code + WIDE, tuple((n, "sid" if k == "id" else k) for n, k in fields))
+    for name, (code, fields) in EVENT_TYPES.items()
+}
+_BY_CODE = {codec.code: codec for codec in (*_CODECS.values(), *_WIDE_CODECS.values())}
+
+
+class Event:
+    """One record; `data` is decoded on first access, so scans that only look at type/time stay cheap."""
+
+    __slots__ = ("type", "timestamp", "_codec", "_body", "_data")
+
+    def __init__(self, codec: _Codec, timestamp: int, body: bytes):
+        self.type = codec.name
+        self.timestamp = timestamp  # microseconds since the epoch, UTC
+        self._codec = codec
+        self._body = body
+        self._data = None
+
+    @property
+    def time(self) -> datetime:
+        return _from_us(self.timestamp)
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = self._codec.decode(self._body, 0)
+        return self._data
+
+    def __repr__(self):
+        return f"Event({self.type!r}, {self.time.isoformat()}, {self.data!r})"
+
+
+class EventLog:
+    """Per-process writer. `emit` is synchronous and cheap; `run` flushes in the background."""
+
+    def __init__(
+        self,
+        directory,
+        segment_bytes: int = SEGMENT_BYTES,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_bytes: int = FLUSH_BYTES
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._buffer = bytearray()
+        self._buffer_day: Optional[int] = None
+        # Full buffers of earlier days, waiting to be written
+        self._sealed: List[Tuple[int, bytearray]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Held while writing; a write in a worker thread may outlive a cancelled `run`
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._segment_day: Optional[int] = None
+        self._segment_size = 0
+
+    def emit(self, event_type: str, timestamp: Optional[int] = None, **data):
+        """Buffer one event; malformed events are logged and dropped, never raised."""
+        codec = _CODECS[event_type]
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000
+        try:
+            try:
+                body = codec.encode(data)
+            except ValueError:
+                # An id that is not a UUID; the wide form takes any string
+                codec = _WIDE_CODECS[event_type]
+                body = codec.encode(data)
+        except (KeyError, ValueError, TypeError, AttributeError, struct.error) as e:
+            logger.warning("Dropping %s event: %s", event_type, e)
+            return
+
+        day = timestamp // DAY_US
+        if day != self._buffer_day:
+            # Segments never mix days
+            self._seal()
+            self._buffer_day = day
+        meta = _RECORD_META.pack(codec.code, timestamp)
+        self._buffer += _RECORD_PREFIX.pack(len(body), zlib.crc32(body, zlib.crc32(meta)))
+        self._buffer += meta
+        self._buffer += body
+        if len(self._buffer) >= self.flush_bytes:
+            if self._wakeup is not None:
+                self._wakeup.set()
+            else:
+                # No background task (scripts, benchmarks): write inline
+                self.flush()
+
+    def _seal(self):
+        if self._buffer:
+            self._sealed.append((self._buffer_day, self._buffer))
+            self._buffer = bytearray()
+
+    def _take(self) -> List[Tuple[int, bytearray]]:
+        self._seal()
+        batches, self._sealed = self._sealed, []
+        return batches
+
+    def _write(self, batches: List[Tuple[int, bytearray]]):
+        with self._lock:
+            for day, data in batches:
+                if self._fd is None or self._segment_day != day or self._segment_size >= self.segment_bytes:
+                    self._rotate(day)
+                os.write(self._fd, data)
+                self._segment_size += len(data)
+
+    def flush(self):
+        """Write everything buffered, blocking the caller; `run` does this off the event loop."""
+        self._write(self._take())
+
+    def _rotate(self, day: int):
+        self._close_segment()
+        prefix = f"{_from_us(day * DAY_US):%Y%m%d}-{os.getpid()}-"
+        taken = [int(p.name[len(prefix):-len(SEGMENT_SUFFIX)]) for p in self.directory.glob(prefix + "*" + SEGMENT_SUFFIX)]
+        path = self.directory / f"{prefix}{max(taken, default=0) + 1:06d}{SEGMENT_SUFFIX}"
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        os.write(self._fd, SEGMENT_HEADER.pack(MAGIC, VERSION))
+        self._segment_day = day
+        self._segment_size = SEGMENT_HEADER.size
+
+    def _close_segment(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    async def run(self):
+        """Background task: write buffered events every flush_interval seconds, or once flush_bytes are buffered."""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                batches = self._take()
+                if not batches:
+                    continue
+                try:
+                    await asyncio.to_thread(self._write, batches)
+                except OSError as e:
+                    logger.warning("Event log flush failed: %s", e)
+                    # Kept for the next attempt, in order
+                    self._sealed[:0] = batches
+        finally:
+            self._wakeup = None
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._close_segment()
+
+
+def segments(directory, day: Optional[date] = None) -> List[Path]:
+    pattern = f"{day:%Y%m%d}-*{SEGMENT_SUFFIX}" if day else f"*{SEGMENT_SUFFIX}"
+    return sorted(Path(directory).glob(pattern))
+
+
+def read_segment(path) -> Iterator[Event]:
+    """Events of one segment in write order; stops at a torn or corrupt record."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= SEGMENT_HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            magic, version = SEGMENT_HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path}: not an event log segment")
+            view = memoryview(mapped)
+            try:
+                offset = SEGMENT_HEADER.size
+                while offset + RECORD_HEADER.size <= size:
+                    length, crc, code, timestamp = RECORD_HEADER.unpack_from(view, offset)
+                    body = offset + RECORD_HEADER.size
+                    end = body + length
+                    if end > size or zlib.crc32(view[body:end], zlib.crc32(view[offset + _RECORD_PREFIX.size:body])) != crc:
+                        logger.warning("%s: torn record at offset %d, stopping", path, offset)
+                        break
+                    codec = _BY_CODE.get(code)
+                    if codec is not None:
+                        yield Event(codec, timestamp, bytes(view[body:end]))
+                    offset = end
+            finally:
+                view.release()
+
+
+def replay(directory, day: date) -> Iterator[Event]:
+    """All events of a UTC day across every writer's segments, in timestamp order."""
+    return heapq.merge(*(read_segment(path) for path in segments(directory, day)), key=lambda e: e.timestamp)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) not in (2, 3) or args[0] not in ("stats", "dump") or (args[0] == "dump" and len(args) != 3):
+        print("usage: python event_log.py stats DIR [YYYY-MM-DD] | dump DIR YYYY-MM-DD")
+        sys.exit(2)
+
+    directory = args[1]
+    day = date.fromisoformat(args[2]) if len(args) == 3 else None
+    if args[0] == "dump":
+        for event in replay(directory, day):
+            print(json.dumps({"type": event.type, "time": event.time, **event.data}, default=json_default, ensure_ascii=False))
+    else:
+        counts: Dict[str, int] = {}
+        paths = segments(directory, day)
+        started = time.perf_counter()
+        for path in paths:
+            for event in read_segment(path):
+                counts[event.type] = counts.get(event.type, 0) + 1
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        print(json.dumps({
+            "segments": len(paths),
+            "bytes": sum(p.stat().st_size for p in paths),
+            "events": total,
+            "by_type": counts,
+            "seconds": round(elapsed, 3),
+            "events_per_second": int(total / elapsed) if elapsed else None
+        }, indent=2))
@@ -0,0 +1,60 @@
+"""
+Fast JSON responses for large list endpoints.
+
+A handler that returns a dict goes through FastAPI's jsonable_encoder,
+which walks and copies every value, and then json.dumps. For list
+endpoints whose payload is documents straight from Mongo (already plain
+dicts, lists, strings, numbers and datetimes) that walk is redundant.
+Returning a FastJSONResponse skips it: the content is handed to a C
+encoder as-is.
+
+The encoder is orjson when it is installed, otherwise the stdlib json
+module; JSON_ENCODER=stdlib forces the latter. Both produce the same
+output as the default path for these payloads (dates as isoformat()).
+"""
+import json
+from typing import Callable, Dict
+
+from starlette.responses import JSONResponse
+
+from storage import json_default
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+
+def _stdlib_dumps(content) -> bytes:
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=json_default
+    ).encode("utf-8")
+
+
+ENCODERS: Dict[str, Callable[[object], bytes]] = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    def _orjson_dumps(content) -> bytes:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+    ENCODERS["orjson"] = _orjson_dumps
+
+
+class FastJSONResponse(JSONResponse):
+    dumps = staticmethod(ENCODERS.get("orjson", _stdlib_dumps))
+
+    def render(self, content) -> bytes:
+        return self.dumps(content)
+
+
+def use_encoder(name: str = "auto") -> str:
+    """Select the encoder FastJSONResponse uses ("auto", "orjson" or "stdlib"); returns the one chosen."""
+    if name == "auto":
+        name = "orjson" if "orjson" in ENCODERS else "stdlib"
+    if name not in ENCODERS:
+        raise ValueError(f"JSON encoder {name!r} is not available (have: {', '.join(ENCODERS)})")
+    FastJSONResponse.dumps = staticmethod(ENCODERS[name])
+    return name
@@ -0,0 +1,73 @@
+"""
+Group commit for hot insert paths.
+
+Concurrent inserts that arrive within `window` seconds of each other are
+sent to Mongo as one unordered insert_many, so a burst of N sends costs one
+round trip and one journal sync instead of N. Every caller still awaits its
+own document: it gets None on success or the write error for that document
+(e.g. DuplicateKeyError) raised at its own call site.
+"""
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitter:
+    def __init__(self, collection, window: float = 0.002, max_batch: int = 100):
+        self.collection = collection
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._commits = set()
+
+    async def insert(self, document: dict):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    async def drain(self):
+        """Commit whatever is pending and wait for in-flight batches (used at shutdown)."""
+        self._flush()
+        if self._commits:
+            await asyncio.gather(*self._commits, return_exceptions=True)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._commit(batch))
+        self._commits.add(task)
+        task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch: List[Tuple[dict, asyncio.Future]]):
+        errors = {}
+        try:
+            await self.collection.insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                error_class = DuplicateKeyError if error.get('code') == 11000 else WriteError
+                errors[error['index']] = error_class(error.get('errmsg'), error.get('code'), error)
+        except Exception as e:
+            logger.warning("Group commit of %d documents failed: %s", len(batch), e)
+            errors = {index: e for index in range(len(batch))}
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                # Caller went away (client disconnected)
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
@@ -0,0 +1,244 @@
+"""
+Request and Mongo command metrics in Prometheus text format.
+
+    http_requests_in_flight                           gauge
+    http_requests_total{method,route,status}          counter
+    http_request_duration_seconds{method,route}       histogram
+    mongodb_commands_total{collection,command,outcome} counter
+    mongodb_command_duration_seconds{collection,command} histogram
+
+`route` is the route template (`/api/conversations/{match_id}/messages`),
+never the raw path, so label cardinality stays bounded by the number of
+endpoints. Mongo timings come from a pymongo CommandListener attached to
+the client.
+
+Recording is meant to stay on in production. Histograms have fixed
+buckets; an observation is a bisect and two additions on a row owned
+by the recording thread. Motor runs pymongo (and so the listener) on its
+executor threads, so every thread writes to its own shard and `render()`
+sums the shards when scraped; no lock is taken on the recording path.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """Per-thread dicts of label values -> row; rows are only written by their own thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[tuple, list]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Dict[tuple, list]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Once per thread
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged(self, width: int) -> Dict[tuple, list]:
+        merged: Dict[tuple, list] = {}
+        for shard in list(self._shards):
+            for labels, row in list(shard.items()):
+                total = merged.setdefault(labels, [0] * width)
+                for index, value in enumerate(row):
+                    total[index] += value
+        return merged
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = [0]
+        row[0] += amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(row[0])}"
+            for labels, row in sorted(self._merged(1).items())
+        ]
+
+
+class Gauge:
+    """Event-loop-only gauge (no sharding needed: one thread writes it)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_number(self.value)}"]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = REQUEST_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Row: one count per bucket, one for +Inf, then the sum
+        self._width = len(self.buckets) + 2
+
+    def observe(self, labels: tuple, value: float):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = [0] * self._width
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = ['le="%s"' % _number(float(b)) for b in self.buckets] + ['le="+Inf"']
+        for labels, row in sorted(self._merged(self._width).items()):
+            cumulative = 0
+            for bound, count in zip(bounds, row):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class RequestMetrics:
+    """In-flight gauge, per-route request counts and latency; recorded by MetricsMiddleware."""
+
+    def __init__(self, registry: Registry):
+        self.in_flight = registry.register(Gauge("http_requests_in_flight", "Requests currently being served"))
+        self.requests = registry.register(Counter(
+            "http_requests_total", "Requests served", ("method", "route", "status")
+        ))
+        self.duration = registry.register(Histogram(
+            "http_request_duration_seconds", "Time from request to end of response", ("method", "route")
+        ))
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        started = time.perf_counter()
+        metrics.in_flight.value += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight.value -= 1
+            # The router leaves the matched route in the scope
+            template = getattr(scope.get("route"), "path", None) or "unmatched"
+            metrics.duration.observe((scope["method"], template), time.perf_counter() - started)
+            metrics.requests.inc((scope["method"], template, str(status_code)))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener: per collection and command, counts, failures and durations."""
+
+    def __init__(self, registry: Registry):
+        self.commands = registry.register(Counter(
+            "mongodb_commands_total", "Mongo commands by outcome", ("collection", "command", "outcome")
+        ))
+        self.duration = registry.register(Histogram(
+            "mongodb_command_duration_seconds",
+            "Mongo command round trip as seen by the driver",
+            ("collection", "command"),
+            MONGO_BUCKETS
+        ))
+        # (request_id, operation_id) -> collection, between started and succeeded/failed
+        self._collections: Dict[Tuple[int, int], str] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple[int, int]:
+        return event.request_id, event.operation_id
+
+    def started(self, event):
+        command = event.command
+        target = command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = command.get("collection")
+        self._collections[self._key(event)] = target if isinstance(target, str) else ""
+
+    def _finished(self, event, outcome: str):
+        collection = self._collections.pop(self._key(event), "")
+        labels = (collection, event.command_name)
+        self.duration.observe(labels, event.duration_micros / 1e6)
+        self.commands.inc(labels + (outcome,))
+
+    def succeeded(self, event):
+        self._finished(event, "succeeded")
+
+    def failed(self, event):
+        self._finished(event, "failed")
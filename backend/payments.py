@@ -0,0 +1,312 @@
+"""
+Payment gateway interface used by billing.
+
+A gateway charges a stored payment method and must treat the idempotency
+key as the identity of the charge: replaying a key returns the original
+outcome instead of charging again. That is what lets the billing
+scheduler retry after a crash without double-charging anyone.
+
+    HTTPPaymentGateway      a REST gateway over one pooled keep-alive client
+    FakePaymentGateway      the contract in memory, with configurable latency,
+                            decline and failure rates, for local runs and load tests
+    ResilientGateway        wraps either: per-attempt timeout, jittered
+                            retries with the same key, circuit breaker
+
+`create_payment_gateway(url)` builds the stack from PAYMENT_GATEWAY_URL:
+
+    fake://?latency_ms=100&failure_rate=0.05&decline_rate=0.02
+    https://api.gateway.example      (key from PAYMENT_GATEWAY_API_KEY)
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 100
+CALL_TIMEOUT = 10.0
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 5.0
+BREAKER_FAILURE_THRESHOLD = 10
+BREAKER_RESET_TIMEOUT = 30.0
+# Error codes a gateway answers with when the card itself refused the charge
+DECLINE_CODES = frozenset({
+    "card_declined", "insufficient_funds", "expired_card", "incorrect_cvc",
+    "do_not_honor", "lost_card", "stolen_card",
+})
+
+
+class PaymentDeclined(Exception):
+    """The charge was refused (card declined, insufficient funds, ...). Retrying will not help."""
+
+
+class PaymentGatewayError(Exception):
+    """The gateway could not be reached or failed; the charge may be retried with the same key."""
+
+
+class CircuitOpenError(PaymentGatewayError):
+    """The gateway has been failing; calls are refused until the breaker lets a probe through."""
+
+
+class ChargeResult(BaseModel):
+    transaction_id: str
+    amount: float
+    currency: str
+    idempotency_key: str
+
+
+class PaymentGateway:
+    async def charge(
+        self,
+        *,
+        user_id: str,
+        payment_method: dict,
+        amount: float,
+        currency: str,
+        idempotency_key: str
+    ) -> ChargeResult:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class FakePaymentGateway(PaymentGateway):
+    """
+    In-memory gateway. Each call takes `latency` seconds (+/- `latency_jitter`);
+    `decline_rate` of charges are declined and `failure_rate` of calls raise
+    PaymentGatewayError, half of them after the charge went through (a lost
+    response), which is what the idempotency key has to absorb.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        decline_rate: float = 0.0,
+        seed: Optional[int] = None,
+        failure_rate: float = 0.0,
+        latency_jitter: float = 0.0
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.decline_rate = decline_rate
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._charges: Dict[str, object] = {}
+        self.calls = 0
+
+    async def charge(self, *, user_id, payment_method, amount, currency, idempotency_key):
+        self.calls += 1
+        delay = self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        failed = self._random.random() < self.failure_rate
+        if failed and self._random.random() < 0.5:
+            raise PaymentGatewayError("fake gateway unavailable")
+
+        if idempotency_key not in self._charges:
+            if self._random.random() < self.decline_rate:
+                self._charges[idempotency_key] = PaymentDeclined("card_declined")
+            else:
+                self._charges[idempotency_key] = ChargeResult(
+                    transaction_id=f"fake_{uuid.uuid4().hex}",
+                    amount=amount,
+                    currency=currency,
+                    idempotency_key=idempotency_key
+                )
+        if failed:
+            raise PaymentGatewayError("fake gateway response lost")
+
+        outcome = self._charges[idempotency_key]
+        if isinstance(outcome, PaymentDeclined):
+            raise outcome
+        return outcome
+
+
+class HTTPPaymentGateway(PaymentGateway):
+    """
+    Charges through a REST gateway (`POST /v1/charges` with an
+    Idempotency-Key header). One AsyncClient per process keeps up to
+    `max_connections` connections alive, so charges reuse TLS sessions
+    instead of opening one each.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        max_connections: int = MAX_CONNECTIONS,
+        timeout: float = CALL_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            transport=transport
+        )
+
+    async def charge(self, *, user_id, payment_method, amount, currency, idempotency_key):
+        try:
+            response = await self._client.post(
+                "/v1/charges",
+                json={
+                    "amount": amount,
+                    "currency": currency,
+                    "customer": user_id,
+                    "payment_method": payment_method.get('id'),
+                },
+                headers={"Idempotency-Key": idempotency_key}
+            )
+        except httpx.HTTPError as e:
+            raise PaymentGatewayError(f"{type(e).__name__}: {e}") from e
+
+        # Only a refusal of the card is a decline (billing expires on it):
+        # 402, or a card error code. 408/409 (concurrent request with the
+        # same key)/429 and 5xx are transient, and other 4xx (bad key, wrong
+        # URL, malformed request) are our fault; both leave it to a retry.
+        if response.status_code >= 400:
+            try:
+                error = response.json().get('error') or {}
+            except (ValueError, AttributeError):
+                error = {}
+            code = error.get('code') if isinstance(error, dict) else None
+            if response.status_code == 402 or code in DECLINE_CODES:
+                raise PaymentDeclined(code or "declined")
+            raise PaymentGatewayError(f"gateway returned {response.status_code}" + (f" ({code})" if code else ""))
+
+        body = response.json()
+        return ChargeResult(
+            transaction_id=body['id'],
+            amount=body.get('amount', amount),
+            currency=body.get('currency', currency),
+            idempotency_key=idempotency_key
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and refuses calls
+    for `reset_timeout` seconds, then lets a single probe through: success
+    closes it, failure keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError("payment gateway circuit open")
+        if state == "half_open":
+            # Restarting the window lets this call through alone; if it never
+            # reports back, another probe goes out after reset_timeout
+            self.opened_at = time.monotonic()
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning("Payment gateway circuit opened after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class ResilientGateway(PaymentGateway):
+    """
+    Per-attempt timeout, up to `max_attempts` tries with full-jitter
+    exponential backoff, all with the caller's idempotency key, behind a
+    circuit breaker. Declines are final and do not count as failures.
+    """
+
+    def __init__(
+        self,
+        gateway: PaymentGateway,
+        timeout: float = CALL_TIMEOUT,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.gateway = gateway
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+
+    async def charge(self, *, idempotency_key, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            try:
+                result = await asyncio.wait_for(
+                    self.gateway.charge(idempotency_key=idempotency_key, **kwargs),
+                    self.timeout
+                )
+            except PaymentDeclined:
+                self.breaker.record_success()
+                raise
+            except (PaymentGatewayError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_attempts:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise PaymentGatewayError(f"charge timed out after {self.timeout}s") from e
+                    raise
+                await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def close(self):
+        await self.gateway.close()
+
+
+def create_payment_gateway(url: str = "fake://", api_key: str = "", **kwargs) -> ResilientGateway:
+    """Gateway for `url` wrapped in ResilientGateway; kwargs go to the wrapper."""
+    parts = urlsplit(url)
+    if parts.scheme == "fake":
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        gateway = FakePaymentGateway(
+            latency=float(query.get('latency_ms', 0)) / 1000,
+            latency_jitter=float(query.get('jitter_ms', 0)) / 1000,
+            decline_rate=float(query.get('decline_rate', 0)),
+            failure_rate=float(query.get('failure_rate', 0)),
+            seed=int(query['seed']) if 'seed' in query else None
+        )
+    elif parts.scheme in ("http", "https"):
+        gateway = HTTPPaymentGateway(url, api_key, timeout=kwargs.get('timeout', CALL_TIMEOUT))
+    else:
+        raise ValueError(f"Unsupported payment gateway URL: {url}")
+    return ResilientGateway(gateway, **kwargs)
@@ -0,0 +1,192 @@
+"""
+Per-request Mongo round-trip accounting and N+1 detection.
+
+QueryBudgetMiddleware puts a QueryTrace in a contextvar for each request.
+QueryBudgetListener, a pymongo CommandListener, adds every command to the
+trace of the request that issued it (Motor runs pymongo on its executor
+with a copy of the caller's context, so the trace is visible there).
+
+When a request goes over `max_queries` round trips or `max_seconds` of DB
+time, or repeats one query shape `repeat_threshold` times (a query in a
+loop), a warning names the route and the shapes it ran, most frequent
+first:
+
+    Query budget exceeded on GET /api/matches: 41 queries, 38.2 ms
+      40x find profiles {user_id}
+       1x find matches {$or:[{user1_id},{user2_id}],unmatched}
+
+A shape is the command, the collection and the filter's keys and
+operators with the values left out, so the same query with different
+ids counts as one shape.
+
+The listener runs on whichever thread finished the command, and one
+request's queries can finish on several executor threads at once
+(asyncio.gather over Motor calls), so a trace is updated under its lock.
+
+With `server_timing` on (DEBUG=1) every response carries
+`Server-Timing: db;dur=38.2;desc="41 queries"`, which shows up in the
+browser's network panel and is easy to assert on in API tests.
+"""
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERIES = 20
+MAX_SECONDS = 0.25
+REPEAT_THRESHOLD = 10
+SHAPES_LOGGED = 10
+
+
+class QueryTrace:
+    __slots__ = ("count", "seconds", "shapes", "_pending", "_lock")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+        # (request_id, operation_id) -> shape, between started and succeeded/failed
+        self._pending: Dict[Tuple[int, int], str] = {}
+        self._lock = threading.Lock()
+
+
+_current: ContextVar[Optional[QueryTrace]] = ContextVar("query_trace", default=None)
+
+
+def current_trace() -> Optional[QueryTrace]:
+    return _current.get()
+
+
+def _shape(value) -> str:
+    if isinstance(value, dict):
+        parts = []
+        for key, item in value.items():
+            nested = _shape(item)
+            parts.append(f"{key}:{nested}" if nested else key)
+        return "{" + ",".join(parts) + "}"
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return "[" + ",".join(dict.fromkeys(_shape(item) for item in value)) + "]"
+    return ""
+
+
+def _operator_shape(value) -> str:
+    """Like _shape, but a field compared with operators shows them: {user_id:{$in}}."""
+    if isinstance(value, dict) and value and all(key.startswith("$") for key in value):
+        return "{" + ",".join(value) + "}"
+    return _shape(value)
+
+
+def _filter_shape(value) -> str:
+    if not isinstance(value, dict):
+        return ""
+    parts = []
+    for key, item in value.items():
+        if key in ("$or", "$and", "$nor") and isinstance(item, list):
+            parts.append(f"{key}:[" + ",".join(dict.fromkeys(_filter_shape(clause) for clause in item)) + "]")
+        else:
+            nested = _operator_shape(item) if isinstance(item, dict) else ""
+            parts.append(f"{key}:{nested}" if nested else key)
+    return "{" + ",".join(parts) + "}"
+
+
+def command_shape(command_name: str, command: dict) -> str:
+    """`find profiles {user_id}`: command, collection and filter structure, without values."""
+    collection = command.get(command_name)
+    if command_name == "getMore":
+        collection = command.get("collection")
+    if not isinstance(collection, str):
+        collection = ""
+
+    if command_name == "find":
+        query = command.get("filter")
+    elif command_name in ("count", "findAndModify", "distinct"):
+        query = command.get("query")
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        query = statements[0].get("q")
+    elif command_name == "aggregate":
+        pipeline = command.get("pipeline") or [{}]
+        query = pipeline[0].get("$match")
+    else:
+        query = None
+    return " ".join(part for part in (command_name, collection, _filter_shape(query)) if part)
+
+
+class QueryBudgetListener(monitoring.CommandListener):
+    def started(self, event):
+        trace = _current.get()
+        if trace is not None:
+            shape = command_shape(event.command_name, event.command)
+            with trace._lock:
+                trace._pending[(event.request_id, event.operation_id)] = shape
+
+    def _finished(self, event):
+        trace = _current.get()
+        if trace is None:
+            return
+        with trace._lock:
+            shape = trace._pending.pop((event.request_id, event.operation_id), event.command_name)
+            trace.count += 1
+            trace.seconds += event.duration_micros / 1e6
+            trace.shapes[shape] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+class QueryBudgetMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_queries: int = MAX_QUERIES,
+        max_seconds: float = MAX_SECONDS,
+        repeat_threshold: int = REPEAT_THRESHOLD,
+        server_timing: bool = False
+    ):
+        self.app = app
+        self.max_queries = max_queries
+        self.max_seconds = max_seconds
+        self.repeat_threshold = repeat_threshold
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = QueryTrace()
+        token = _current.set(trace)
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start" and self.server_timing:
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append("Server-Timing", f'db;dur={trace.seconds * 1000:.1f};desc="{trace.count} queries"')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self.check(scope, trace)
+
+    def check(self, scope: Scope, trace: QueryTrace):
+        repeated = trace.shapes and max(trace.shapes.values()) >= self.repeat_threshold
+        if trace.count <= self.max_queries and trace.seconds <= self.max_seconds and not repeated:
+            return
+        route = getattr(scope.get("route"), "path", None) or scope["path"]
+        shapes = "".join(f"\n  {count:>4}x {shape}" for shape, count in trace.shapes.most_common(SHAPES_LOGGED))
+        reason = "Query budget exceeded" if not repeated else "Repeated query (possible N+1)"
+        logger.warning(
+            "%s on %s %s: %d queries, %.1f ms%s",
+            reason, scope["method"], route, trace.count, trace.seconds * 1000, shapes
+        )
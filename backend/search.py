@@ -0,0 +1,222 @@
+"""
+Per-user full-text search over chat messages.
+
+Every message gets one `search_postings` document per participant holding
+the normalized prefixes of its words, e.g. "مرحبا" -> ["مر", "مرح", ...,
+"مرحبا"]. A query becomes an equality match on (user_id, terms) that the
+compound index answers already sorted by created_at, so latency depends on
+the page size rather than on how much history the user has.
+
+Normalization folds what users type inconsistently in Arabic (diacritics,
+tatweel, alef/yaa/hamza variants, taa marbuta) and casefolds everything
+else, so "أحمد", "احمد" and "إحمد" all match. A word with the definite
+article (ال, also after و/ف/ب/ك, and لل) is indexed under its stem as
+well, and a query word with the article searches the stem, so "الحب"
+and "حب" find each other; a query that is still only the article plus
+a letter ("الح", mid-typing) matches the full word's prefixes.
+
+With several words, the rarest one drives the query: each word's
+postings are counted up to RARITY_CAP, and the rarest goes first in
+`$all`, which is the element the index bounds are built from. The scan
+is then bounded by the rarest word's postings rather than the most
+common one's.
+
+Changing normalization needs `python search.py reindex`, which rewrites
+every posting's terms in place.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from archive import ARCHIVE_PREFIX, month_key
+
+logger = logging.getLogger(__name__)
+
+MIN_PREFIX = 2
+MAX_PREFIX = 15
+RARITY_CAP = 1000
+REINDEX_BATCH_SIZE = 1000
+
+# Harakat, superscript alef, Quranic marks and tatweel
+_DIACRITICS = re.compile("[\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_FOLD = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ی": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+})
+_TOKEN = re.compile(r"\w+")
+# Longest first: "وال" before "ال"
+_ARTICLES = ("وال", "فال", "بال", "كال", "لل", "ال")
+
+
+def normalize(text: str) -> str:
+    return _DIACRITICS.sub("", text).translate(_FOLD).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(normalize(text))
+
+
+def strip_article(token: str) -> str:
+    """The stem of an Arabic word with the definite article, or the word itself."""
+    for article in _ARTICLES:
+        if token.startswith(article) and len(token) - len(article) >= MIN_PREFIX:
+            return token[len(article):]
+    return token
+
+
+def index_terms(text: str) -> List[str]:
+    terms = set()
+    for token in tokenize(text):
+        for word in {token, strip_article(token)}:
+            if len(word) < MIN_PREFIX:
+                continue
+            for end in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1):
+                terms.add(word[:end])
+    return sorted(terms)
+
+
+def query_terms(text: str) -> List[str]:
+    # Query words longer than MAX_PREFIX match on their indexed prefix
+    words = (strip_article(t) for t in tokenize(text))
+    return sorted({w if len(w) <= MAX_PREFIX else w[:MAX_PREFIX] for w in words if len(w) >= MIN_PREFIX})
+
+
+async def ensure_indexes(db):
+    await db.search_postings.create_index(
+        [("user_id", ASCENDING), ("terms", ASCENDING), ("created_at", DESCENDING)]
+    )
+    await db.search_postings.create_index([("user_id", ASCENDING), ("message_id", ASCENDING)], unique=True)
+
+
+def _postings(message: dict) -> List[dict]:
+    terms = index_terms(message.get('content') or "")
+    if not terms:
+        return []
+    return [
+        {
+            "user_id": user_id,
+            "message_id": message['id'],
+            "match_id": message['match_id'],
+            "created_at": message['created_at'],
+            "terms": terms,
+        }
+        for user_id in (message['sender_id'], message['receiver_id'])
+    ]
+
+
+async def _replace_postings(db, postings: List[dict]):
+    if postings:
+        await db.search_postings.bulk_write(
+            [
+                ReplaceOne({"user_id": p['user_id'], "message_id": p['message_id']}, p, upsert=True)
+                for p in postings
+            ],
+            ordered=False
+        )
+
+
+async def _insert_postings(db, postings: List[dict]):
+    if not postings:
+        return
+    try:
+        await db.search_postings.insert_many(postings, ordered=False)
+    except BulkWriteError as e:
+        # Already indexed (reindex over existing postings)
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+
+async def index_message(db, message: dict):
+    await _insert_postings(db, _postings(message))
+
+
+async def rarest_first(db, user_id: str, terms: List[str]) -> List[str]:
+    """`terms` ordered by how many of the user's postings hold them (counted up to RARITY_CAP)."""
+    if len(terms) < 2:
+        return terms
+    counts = await asyncio.gather(*(
+        db.search_postings.count_documents({"user_id": user_id, "terms": term}, limit=RARITY_CAP)
+        for term in terms
+    ))
+    # Ties (all capped): longer prefixes are rarer
+    return [term for _, _, term in sorted(zip(counts, (-len(t) for t in terms), terms))]
+
+
+async def search_messages(db, user_id: str, query: str, before=None, limit: int = 20) -> List[dict]:
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    criteria = {"user_id": user_id, "terms": {"$all": await rarest_first(db, user_id, terms)}}
+    if before is not None:
+        criteria["created_at"] = {"$lt": before}
+    hits = await db.search_postings.find(
+        criteria,
+        {"_id": 0, "message_id": 1, "created_at": 1}
+    ).sort("created_at", DESCENDING).limit(limit).to_list(length=limit)
+    if not hits:
+        return []
+
+    ids = [hit['message_id'] for hit in hits]
+    found: Dict[str, dict] = {
+        m['id']: m for m in await db.messages.find({"id": {"$in": ids}}, {"_id": 0}).to_list(length=limit)
+    }
+
+    # Whatever is not in the hot collection has been archived
+    missing_by_month: Dict[str, List[str]] = {}
+    for hit in hits:
+        if hit['message_id'] not in found:
+            missing_by_month.setdefault(month_key(hit['created_at']), []).append(hit['message_id'])
+    for month, month_ids in missing_by_month.items():
+        async for message in db[ARCHIVE_PREFIX + month].find({"id": {"$in": month_ids}}, {"_id": 0}):
+            found[message['id']] = message
+
+    return [found[message_id] for message_id in ids if message_id in found]
+
+
+async def reindex(db, batch_size: int = REINDEX_BATCH_SIZE) -> int:
+    """Write postings for existing messages, hot and archived, replacing stale terms; safe to re-run."""
+    indexed = 0
+    names = ["messages"] + sorted(n for n in await db.list_collection_names() if n.startswith(ARCHIVE_PREFIX))
+    for name in names:
+        last_id = ""
+        while True:
+            batch = await db[name].find(
+                {"id": {"$gt": last_id}},
+                {"_id": 0, "id": 1, "match_id": 1, "sender_id": 1, "receiver_id": 1, "content": 1, "created_at": 1}
+            ).sort("id", ASCENDING).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]['id']
+            await _replace_postings(db, [p for message in batch for p in _postings(message)])
+            indexed += len(batch)
+            logger.info("Indexed %d messages", indexed)
+    return indexed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reindex"]:
+        print("usage: python search.py reindex")
+        sys.exit(2)
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    database = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+
+    async def main():
+        await ensure_indexes(database)
+        await reindex(database)
+
+    asyncio.run(main())
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -12,13 +13,55 @@ import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+
+from broker import create_broker
+from presence import PresenceTracker, flush_presence, run_presence
+import unread
+from group_commit import GroupCommitter
+import archive
+import search
+import billing
+from payments import create_payment_gateway
+from entitlements import EntitlementResolver, TIER_FEATURES
+from static_responses import StaticResponse
+from event_log import EventLog
+from storage import EPOCH, json_default, parse_datetime, utcnow
+from fast_json import FastJSONResponse, use_encoder
+from compression import CompressionMiddleware
+import versions
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MongoCommandMetrics, Registry, RequestMetrics
+from query_budget import QueryBudgetListener, QueryBudgetMiddleware
+import profiler
+from traffic_capture import TrafficCaptureMiddleware, TrafficRecorder
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Request and Mongo command metrics, served at /metrics; METRICS=0 turns recording off
+METRICS = os.environ.get('METRICS', '1') == '1'
+metrics_registry = Registry()
+request_metrics = RequestMetrics(metrics_registry)
+mongo_metrics = MongoCommandMetrics(metrics_registry)
+
+# Per-request DB round trips: warn past QUERY_BUDGET queries / QUERY_BUDGET_MS (0 turns it off);
+# DEBUG=1 also reports them in a Server-Timing header
+DEBUG = os.environ.get('DEBUG', '0') == '1'
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', '20'))
+
+mongo_listeners = []
+if METRICS:
+    mongo_listeners.append(mongo_metrics)
+if QUERY_BUDGET:
+    mongo_listeners.append(QueryBudgetListener())
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=mongo_listeners)
 db = client[os.environ['DB_NAME']]
 
 # Password hashing
@@ -29,9 +72,73 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-produc
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Claims mode: short-lived access tokens carrying subscription/entitlement
+# claims (no DB read to authorize) plus a refresh token to re-issue them
+TOKEN_CLAIMS = os.environ.get('TOKEN_CLAIMS', '0') == '1'
+CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+
 # Security
 security = HTTPBearer()
 
+# Cross-worker pub/sub (memory://, unix:///path or tcp://host:port)
+broker = create_broker(
+    os.environ.get('BROKER_URL', 'memory://'),
+    queue_size=int(os.environ.get('BROKER_QUEUE_SIZE', '256')),
+    policy=os.environ.get('BROKER_POLICY', 'drop_oldest'),
+)
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Online status, kept in memory per worker and shared through the broker
+presence = PresenceTracker(
+    ttl=float(os.environ.get('PRESENCE_TTL_SECONDS', '60')),
+    resolution=float(os.environ.get('PRESENCE_RESOLUTION_SECONDS', '15')),
+)
+background_tasks = []
+
+# Premium features per user, cached until the subscription's end_date
+entitlements = EntitlementResolver(db, broker)
+
+# Optional group commit for send_message: concurrent inserts within the
+# window are written with one insert_many
+message_writer = None
+if os.environ.get('MESSAGE_GROUP_COMMIT', '0') == '1':
+    message_writer = GroupCommitter(
+        db.messages,
+        window=float(os.environ.get('MESSAGE_GROUP_COMMIT_WINDOW_MS', '2')) / 1000,
+        max_batch=int(os.environ.get('MESSAGE_GROUP_COMMIT_MAX_BATCH', '100')),
+    )
+
+# Charges for billing; fake:// (in-process, see payments.py) unless a gateway URL is set
+payment_gateway = create_payment_gateway(
+    os.environ.get('PAYMENT_GATEWAY_URL', 'fake://'),
+    api_key=os.environ.get('PAYMENT_GATEWAY_API_KEY', ''),
+    timeout=float(os.environ.get('PAYMENT_GATEWAY_TIMEOUT_SECONDS', '10')),
+    max_attempts=int(os.environ.get('PAYMENT_GATEWAY_MAX_ATTEMPTS', '3')),
+)
+
+# Append-only binary event log of write activity; off unless a directory is set
+event_log = None
+if os.environ.get('EVENT_LOG_DIR'):
+    event_log = EventLog(
+        os.environ['EVENT_LOG_DIR'],
+        segment_bytes=int(os.environ.get('EVENT_LOG_SEGMENT_MB', '64')) * 1024 * 1024,
+        flush_interval=float(os.environ.get('EVENT_LOG_FLUSH_MS', '200')) / 1000,
+    )
+
+# Sampled, anonymized request shapes for benchmarks/traffic_replay.py; off unless a directory is set
+traffic_recorder = None
+if os.environ.get('TRAFFIC_CAPTURE_DIR'):
+    traffic_recorder = TrafficRecorder(
+        os.environ['TRAFFIC_CAPTURE_DIR'],
+        # Same pseudonyms on every worker, unguessable without the key
+        key=hashlib.sha256(b"traffic-capture:" + SECRET_KEY.encode()).digest(),
+        sample_rate=float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE', '0.1')),
+    )
+
+# Encoder behind FastJSONResponse on the list endpoints: auto (orjson if installed), orjson or stdlib
+use_encoder(os.environ.get('JSON_ENCODER', 'auto'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -49,7 +156,7 @@ class User(BaseModel):
     email: EmailStr
     phone_number: str
     password_hash: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
     trial_end_date: datetime
     subscription_status: str = "trial"  # trial, active, cancelled, expired
     terms_accepted: bool = False
@@ -79,8 +186,8 @@ class Profile(BaseModel):
     has_children: Optional[bool] = None
     wants_children: Optional[bool] = None
     languages: List[str] = []
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
 
 
 class Subscription(BaseModel):
@@ -89,12 +196,12 @@ class Subscription(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     status: str  # trial, active, cancelled, expired
-    start_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    start_date: datetime = Field(default_factory=utcnow)
     trial_end_date: datetime
     next_payment_date: datetime
     annual_amount: float = 396.0  # CHF
     currency: str = "CHF"
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
 
 
 class PaymentMethod(BaseModel):
@@ -108,7 +215,7 @@ class PaymentMethod(BaseModel):
     paypal_email: Optional[EmailStr] = None
     bank_account_country: Optional[str] = None
     is_active: bool = True
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
 
 
 class Swipe(BaseModel):
@@ -118,7 +225,7 @@ class Swipe(BaseModel):
     user_id: str
     swiped_user_id: str
     action: str  # like, pass, super_like
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
 
 
 class Match(BaseModel):
@@ -127,7 +234,7 @@ class Match(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user1_id: str
     user2_id: str
-    matched_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    matched_at: datetime = Field(default_factory=utcnow)
     unmatched: bool = False
 
 
@@ -138,7 +245,7 @@ class PremiumSubscription(BaseModel):
     user_id: str
     tier: str  # free, gold, platinum
     status: str  # active, expired, cancelled
-    start_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    start_date: datetime = Field(default_factory=utcnow)
     end_date: Optional[datetime] = None
     features: dict = Field(default_factory=lambda: {
         "unlimited_likes": False,
@@ -151,8 +258,8 @@ class PremiumSubscription(BaseModel):
         "profile_controls": False
     })
     auto_renew: bool = False
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
 
 
 class Message(BaseModel):
@@ -165,7 +272,7 @@ class Message(BaseModel):
     content: str
     message_type: str = "text"  # text, gif, sticker, audio
     status: str = "sent"  # sent, delivered, read
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
     read_at: Optional[datetime] = None
 
 
@@ -180,8 +287,8 @@ class Conversation(BaseModel):
     last_message_at: Optional[datetime] = None
     unread_count_user1: int = 0
     unread_count_user2: int = 0
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
 
 
 class UserSettings(BaseModel):
@@ -197,8 +304,8 @@ class UserSettings(BaseModel):
     auto_play_videos: bool = True
     show_activity_status: bool = True
     theme: str = "system"  # system, light, dark
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
 
 
 # ===== Request/Response Models =====
@@ -216,8 +323,13 @@ class LoginRequest(BaseModel):
     password: str
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
 class TokenResponse(BaseModel):
     access_token: str
+    refresh_token: Optional[str] = None
     token_type: str = "bearer"
     user: dict
 
@@ -318,17 +430,73 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("typ") == "refresh":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
+    if "tier" in payload:
+        # Claims token: what handlers need is signed into it, no DB read
+        presence.touch(user_id)
+        return {
+            "id": user_id,
+            "subscription_status": payload["sst"],
+            "trial_end_date": parse_datetime(payload["ted"]),
+            "tier": payload["tier"],
+            "features": payload["ftr"]
+        }
+    
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if user is None:
         raise credentials_exception
+    presence.touch(user_id)
+    return user
+
+
+async def load_current_user(current_user: dict = Depends(get_current_user)):
+    """Full user document, for handlers that need more than a claims token carries"""
+    if 'email' in current_user:
+        return current_user
+    user = await db.users.find_one({"id": current_user['id']}, {"_id": 0})
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 
+async def issue_tokens(user: dict) -> dict:
+    """Access token for a user document, plus a refresh token in claims mode"""
+    if not TOKEN_CLAIMS:
+        return {"access_token": create_access_token(data={"sub": user['id']})}
+    
+    entitlement = await entitlements.get(user['id'])
+    now = datetime.now(timezone.utc)
+    expires = now + timedelta(minutes=CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES)
+    if entitlement.get('end_date'):
+        # Claims must not outlive the subscription they describe
+        expires = min(expires, parse_datetime(entitlement['end_date']))
+    
+    access_token = create_access_token(
+        data={
+            "sub": user['id'],
+            "typ": "access",
+            "sst": user['subscription_status'],
+            "ted": parse_datetime(user['trial_end_date']).isoformat(),
+            "tier": entitlement['tier'],
+            "ftr": entitlement['features']
+        },
+        expires_delta=expires - now
+    )
+    refresh_token = create_access_token(
+        data={"sub": user['id'], "typ": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {"access_token": access_token, "refresh_token": refresh_token}
+
+
 # ===== API Endpoints =====
 
 @api_router.get("/")
@@ -354,7 +522,7 @@ async def register(request: RegisterRequest):
         )
     
     # Create user
-    trial_end_date = datetime.now(timezone.utc) + timedelta(days=14)
+    trial_end_date = utcnow() + timedelta(days=14)
     user = User(
         name=request.name,
         email=request.email,
@@ -363,15 +531,14 @@ async def register(request: RegisterRequest):
         trial_end_date=trial_end_date,
         subscription_status="trial",
         terms_accepted=True,
-        terms_accepted_at=datetime.now(timezone.utc)
+        terms_accepted_at=utcnow()
     )
     
     user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    user_dict['trial_end_date'] = user_dict['trial_end_date'].isoformat()
-    user_dict['terms_accepted_at'] = user_dict['terms_accepted_at'].isoformat()
     
     await db.users.insert_one(user_dict)
+    if event_log is not None:
+        event_log.emit("register", user_id=user.id, trial_end_date=trial_end_date)
     
     # Create subscription
     next_payment_date = trial_end_date
@@ -383,24 +550,20 @@ async def register(request: RegisterRequest):
     )
     
     subscription_dict = subscription.model_dump()
-    subscription_dict['created_at'] = subscription_dict['created_at'].isoformat()
-    subscription_dict['start_date'] = subscription_dict['start_date'].isoformat()
-    subscription_dict['trial_end_date'] = subscription_dict['trial_end_date'].isoformat()
-    subscription_dict['next_payment_date'] = subscription_dict['next_payment_date'].isoformat()
     
     await db.subscriptions.insert_one(subscription_dict)
     
     # Create access token
-    access_token = create_access_token(data={"sub": user.id})
+    tokens = await issue_tokens(user_dict)
     
     return TokenResponse(
-        access_token=access_token,
+        **tokens,
         user={
             "id": user.id,
             "name": user.name,
             "email": user.email,
             "subscription_status": user.subscription_status,
-            "trial_end_date": user.trial_end_date.isoformat()
+            "trial_end_date": user.trial_end_date
         }
     )
 
@@ -415,10 +578,10 @@ async def login(request: LoginRequest):
             detail="البريد الإلكتروني أو كلمة المرور غير صحيحة"
         )
     
-    access_token = create_access_token(data={"sub": user['id']})
+    tokens = await issue_tokens(user)
     
     return TokenResponse(
-        access_token=access_token,
+        **tokens,
         user={
             "id": user['id'],
             "name": user['name'],
@@ -429,18 +592,61 @@ async def login(request: LoginRequest):
     )
 
 
-@api_router.get("/user/profile", response_model=UserProfile)
-async def get_profile(current_user: dict = Depends(get_current_user)):
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_tokens(request: RefreshRequest):
+    """Re-issue tokens, e.g. after a subscription change (claims mode)"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("typ") != "refresh" or payload.get("sub") is None:
+        raise credentials_exception
+    
+    user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0})
+    if user is None:
+        raise credentials_exception
+    
+    tokens = await issue_tokens(user)
+    
+    return TokenResponse(
+        **tokens,
+        user={
+            "id": user['id'],
+            "name": user['name'],
+            "email": user['email'],
+            "subscription_status": user['subscription_status'],
+            "trial_end_date": user['trial_end_date']
+        }
+    )
+
+
+def user_profile_payload(user: dict) -> UserProfile:
     return UserProfile(
-        id=current_user['id'],
-        name=current_user['name'],
-        email=current_user['email'],
-        subscription_status=current_user['subscription_status'],
-        trial_end_date=datetime.fromisoformat(current_user['trial_end_date']) if isinstance(current_user['trial_end_date'], str) else current_user['trial_end_date'],
-        created_at=datetime.fromisoformat(current_user['created_at']) if isinstance(current_user['created_at'], str) else current_user['created_at']
+        id=user['id'],
+        name=user['name'],
+        email=user['email'],
+        subscription_status=user['subscription_status'],
+        trial_end_date=user['trial_end_date'],
+        created_at=user['created_at']
     )
 
 
+@api_router.get("/user/profile", response_model=UserProfile)
+async def get_profile(request: Request, response: Response, current_user: dict = Depends(load_current_user)):
+    # The user document is already loaded for auth; the version check is free
+    tag = versions.etag(current_user)
+    cached = versions.not_modified(request, tag)
+    if cached is not None:
+        return cached
+    versions.set_etag(response, tag)
+    return user_profile_payload(current_user)
+
+
 class AddPaymentRequest(BaseModel):
     payment_type: str  # card, paypal
     card_number: Optional[str] = None
@@ -476,17 +682,13 @@ async def add_payment_method(request: AddPaymentRequest, current_user: dict = De
     
     payment_method = PaymentMethod(**payment_method_data)
     payment_dict = payment_method.model_dump()
-    payment_dict['created_at'] = payment_dict['created_at'].isoformat()
     
     await db.payment_methods.insert_one(payment_dict)
     
     return {"message": "تم إضافة طريقة الدفع بنجاح"}
 
 
-@api_router.get("/payment/status")
-async def get_payment_status(current_user: dict = Depends(get_current_user)):
-    payment = await db.payment_methods.find_one({"user_id": current_user['id']}, {"_id": 0})
-    
+def payment_status_payload(payment: Optional[dict]) -> dict:
     if not payment:
         return {"has_payment": False}
     
@@ -498,33 +700,61 @@ async def get_payment_status(current_user: dict = Depends(get_current_user)):
     }
 
 
-@api_router.get("/subscription/status", response_model=SubscriptionStatus)
-async def get_subscription_status(current_user: dict = Depends(get_current_user)):
-    subscription = await db.subscriptions.find_one({"user_id": current_user['id']}, {"_id": 0})
-    
+@api_router.get("/payment/status")
+async def get_payment_status(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    cached = await versions.check(request, db.payment_methods, {"user_id": current_user['id']})
+    if cached is not None:
+        return cached
+    payment = await db.payment_methods.find_one({"user_id": current_user['id']}, {"_id": 0})
+    versions.set_etag(response, versions.etag(payment))
+    return payment_status_payload(payment)
+
+
+def subscription_days_remaining(subscription: dict) -> int:
+    return max(0, (parse_datetime(subscription['trial_end_date']) - datetime.now(timezone.utc)).days)
+
+
+def subscription_etag(subscription: Optional[dict]) -> Optional[str]:
+    # days_remaining changes with the clock, not the document
+    if subscription is None:
+        return None
+    return versions.etag(subscription, subscription_days_remaining(subscription))
+
+
+def subscription_status_payload(subscription: Optional[dict]) -> SubscriptionStatus:
     if not subscription:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="الاشتراك غير موجود"
         )
     
-    trial_end = datetime.fromisoformat(subscription['trial_end_date']) if isinstance(subscription['trial_end_date'], str) else subscription['trial_end_date']
-    days_remaining = max(0, (trial_end - datetime.now(timezone.utc)).days)
-    
-    next_payment = None
-    if subscription['next_payment_date']:
-        next_payment = datetime.fromisoformat(subscription['next_payment_date']) if isinstance(subscription['next_payment_date'], str) else subscription['next_payment_date']
-    
     return SubscriptionStatus(
         status=subscription['status'],
-        trial_end_date=trial_end,
-        next_payment_date=next_payment,
-        days_remaining=days_remaining,
+        trial_end_date=subscription['trial_end_date'],
+        next_payment_date=subscription.get('next_payment_date'),
+        days_remaining=subscription_days_remaining(subscription),
         annual_amount=subscription['annual_amount'],
         currency=subscription['currency']
     )
 
 
+@api_router.get("/subscription/status", response_model=SubscriptionStatus)
+async def get_subscription_status(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    cached = await versions.check(
+        request,
+        db.subscriptions,
+        {"user_id": current_user['id']},
+        make_etag=subscription_etag,
+        fields=("trial_end_date",)
+    )
+    if cached is not None:
+        return cached
+    subscription = await db.subscriptions.find_one({"user_id": current_user['id']}, {"_id": 0})
+    payload = subscription_status_payload(subscription)
+    versions.set_etag(response, subscription_etag(subscription))
+    return payload
+
+
 @api_router.post("/profile/create")
 async def create_profile(request: ProfileCreateRequest, current_user: dict = Depends(get_current_user)):
     # Check if profile already exists
@@ -557,15 +787,13 @@ async def create_profile(request: ProfileCreateRequest, current_user: dict = Dep
     )
     
     profile_dict = profile.model_dump()
-    profile_dict['created_at'] = profile_dict['created_at'].isoformat()
-    profile_dict['updated_at'] = profile_dict['updated_at'].isoformat()
     
     await db.profiles.insert_one(profile_dict)
     
     # Update user profile_completed status
     await db.users.update_one(
         {"id": current_user['id']},
-        {"$set": {"profile_completed": True}}
+        {"$set": {"profile_completed": True}, "$inc": versions.BUMP}
     )
     
     # Remove non-serializable fields from response
@@ -573,17 +801,24 @@ async def create_profile(request: ProfileCreateRequest, current_user: dict = Dep
     return {"message": "تم إنشاء الملف الشخصي بنجاح", "profile": response_profile}
 
 
-@api_router.get("/profile/me")
-async def get_my_profile(current_user: dict = Depends(get_current_user)):
-    profile = await db.profiles.find_one({"user_id": current_user['id']}, {"_id": 0})
-    
+def my_profile_payload(profile: Optional[dict]) -> dict:
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="الملف الشخصي غير موجود"
         )
-    
-    return profile
+    return versions.without_version(profile)
+
+
+@api_router.get("/profile/me")
+async def get_my_profile(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    cached = await versions.check(request, db.profiles, {"user_id": current_user['id']})
+    if cached is not None:
+        return cached
+    profile = await db.profiles.find_one({"user_id": current_user['id']}, {"_id": 0})
+    payload = my_profile_payload(profile)
+    versions.set_etag(response, versions.etag(profile))
+    return payload
 
 
 @api_router.put("/profile/update")
@@ -598,11 +833,11 @@ async def update_profile(request: ProfileUpdateRequest, current_user: dict = Dep
     
     # Update only provided fields
     update_data = {k: v for k, v in request.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = utcnow()
     
     await db.profiles.update_one(
         {"user_id": current_user['id']},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": versions.BUMP}
     )
     
     return {"message": "تم تحديث الملف الشخصي بنجاح"}
@@ -630,7 +865,7 @@ async def upload_photo(request: PhotoUploadRequest, current_user: dict = Depends
     
     await db.profiles.update_one(
         {"user_id": current_user['id']},
-        {"$set": {"photos": photos, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"photos": photos, "updated_at": utcnow()}, "$inc": versions.BUMP}
     )
     
     return {"message": "تم رفع الصورة بنجاح", "photo_count": len(photos)}
@@ -657,13 +892,13 @@ async def delete_photo(index: int, current_user: dict = Depends(get_current_user
     
     await db.profiles.update_one(
         {"user_id": current_user['id']},
-        {"$set": {"photos": photos, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"photos": photos, "updated_at": utcnow()}, "$inc": versions.BUMP}
     )
     
     return {"message": "تم حذف الصورة بنجاح"}
 
 
-@api_router.get("/profiles/discover")
+@api_router.get("/profiles/discover", response_class=FastJSONResponse)
 async def discover_profiles(current_user: dict = Depends(get_current_user), limit: int = 20):
     # Get current user's profile
     my_profile = await db.profiles.find_one({"user_id": current_user['id']}, {"_id": 0})
@@ -683,10 +918,10 @@ async def discover_profiles(current_user: dict = Depends(get_current_user), limi
         {
             "user_id": {"$ne": current_user['id'], "$nin": swiped_ids}
         },
-        {"_id": 0}
+        versions.PUBLIC_PROJECTION
     ).limit(limit).to_list(length=limit)
     
-    return {"profiles": profiles}
+    return FastJSONResponse({"profiles": profiles})
 
 
 @api_router.post("/swipe")
@@ -699,9 +934,10 @@ async def swipe_action(request: SwipeRequest, current_user: dict = Depends(get_c
     )
     
     swipe_dict = swipe.model_dump()
-    swipe_dict['created_at'] = swipe_dict['created_at'].isoformat()
     
     await db.swipes.insert_one(swipe_dict)
+    if event_log is not None:
+        event_log.emit("swipe", user_id=swipe.user_id, swiped_user_id=swipe.swiped_user_id, action=swipe.action)
     
     # Check for match if action is like or super_like
     is_match = False
@@ -732,9 +968,10 @@ async def swipe_action(request: SwipeRequest, current_user: dict = Depends(get_c
                 )
                 
                 match_dict = match.model_dump()
-                match_dict['matched_at'] = match_dict['matched_at'].isoformat()
                 
                 await db.matches.insert_one(match_dict)
+                if event_log is not None:
+                    event_log.emit("match", match_id=match.id, user1_id=match.user1_id, user2_id=match.user2_id)
     
     return {
         "success": True,
@@ -758,7 +995,7 @@ async def get_matches(current_user: dict = Depends(get_current_user)):
     match_profiles = []
     for match in matches:
         other_user_id = match['user2_id'] if match['user1_id'] == current_user['id'] else match['user1_id']
-        profile = await db.profiles.find_one({"user_id": other_user_id}, {"_id": 0})
+        profile = await db.profiles.find_one({"user_id": other_user_id}, versions.PUBLIC_PROJECTION)
         if profile:
             match_profiles.append({
                 "match_id": match['id'],
@@ -769,7 +1006,7 @@ async def get_matches(current_user: dict = Depends(get_current_user)):
     return {"matches": match_profiles}
 
 
-@api_router.get("/likes/sent")
+@api_router.get("/likes/sent", response_class=FastJSONResponse)
 async def get_sent_likes(current_user: dict = Depends(get_current_user)):
     # Get users I liked
     likes = await db.swipes.find({
@@ -780,29 +1017,32 @@ async def get_sent_likes(current_user: dict = Depends(get_current_user)):
     # Get profiles
     profiles = []
     for like in likes:
-        profile = await db.profiles.find_one({"user_id": like['swiped_user_id']}, {"_id": 0})
+        profile = await db.profiles.find_one({"user_id": like['swiped_user_id']}, versions.PUBLIC_PROJECTION)
         if profile:
             profiles.append(profile)
     
-    return {"profiles": profiles}
+    return FastJSONResponse({"profiles": profiles})
 
 
-@api_router.get("/likes/received")
-async def get_received_likes(current_user: dict = Depends(get_current_user)):
+async def load_received_likes(user_id: str) -> List[dict]:
     # Get users who liked me
     likes = await db.swipes.find({
-        "swiped_user_id": current_user['id'],
+        "swiped_user_id": user_id,
         "action": {"$in": ['like', 'super_like']}
     }, {"_id": 0}).to_list(length=100)
     
     # Get profiles
     profiles = []
     for like in likes:
-        profile = await db.profiles.find_one({"user_id": like['user_id']}, {"_id": 0})
+        profile = await db.profiles.find_one({"user_id": like['user_id']}, versions.PUBLIC_PROJECTION)
         if profile:
             profiles.append(profile)
-    
-    return {"profiles": profiles}
+    return profiles
+
+
+@api_router.get("/likes/received", response_class=FastJSONResponse)
+async def get_received_likes(current_user: dict = Depends(get_current_user)):
+    return FastJSONResponse({"profiles": await load_received_likes(current_user['id'])})
 
 
 @api_router.post("/seed/dummy-profiles")
@@ -868,11 +1108,11 @@ async def create_dummy_profiles():
             "email": f"dummy{i}@pizoo.com",
             "phone_number": f"+123456789{i:02d}",
             "password_hash": pwd_context.hash("dummy123"),
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "trial_end_date": (datetime.now(timezone.utc) + timedelta(days=14)).isoformat(),
+            "created_at": utcnow(),
+            "trial_end_date": utcnow() + timedelta(days=14),
             "subscription_status": "trial",
             "terms_accepted": True,
-            "terms_accepted_at": datetime.now(timezone.utc).isoformat(),
+            "terms_accepted_at": utcnow(),
             "profile_completed": True
         })
         
@@ -899,8 +1139,8 @@ async def create_dummy_profiles():
             "has_children": False,
             "wants_children": True if i % 2 == 0 else False,
             "languages": ["العربية", "English"] if i % 2 == 0 else ["English"],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utcnow(),
+            "updated_at": utcnow()
         })
     
     dummy_users = dummy_users_data
@@ -926,8 +1166,8 @@ async def create_dummy_profiles():
             "wants_children": True,
             "languages": ["العربية", "الإنجليزية"],
             "photos": [],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utcnow(),
+            "updated_at": utcnow()
         }
         for i, profile in enumerate([
             {"name": "سارة", "bio": "أحب السفر والقراءة والمغامرات الجديدة ☕📚✈️", "dob": "1995-05-15", "gender": "female", "height": 165, "looking_for": "علاقة جدية", "interests": ["السفر", "القراءة", "التصوير", "الطبخ"], "location": "جدة، السعودية", "occupation": "مصممة جرافيك", "education": "بكالوريوس", "goals": "serious"},
@@ -970,29 +1210,8 @@ async def create_dummy_profiles():
 @api_router.get("/premium/subscription")
 async def get_premium_subscription(current_user: dict = Depends(get_current_user)):
     """Get user's current premium subscription status"""
-    subscription = await db.premium_subscriptions.find_one(
-        {"user_id": current_user['id']},
-        {"_id": 0}
-    )
-    
-    if not subscription:
-        # Return free tier
-        return {
-            "tier": "free",
-            "status": "active",
-            "features": {
-                "unlimited_likes": False,
-                "see_who_liked": False,
-                "unlimited_rewinds": False,
-                "super_likes_per_day": 1,
-                "boosts_per_month": 0,
-                "top_picks": False,
-                "read_receipts": False,
-                "profile_controls": False
-            }
-        }
-    
-    return subscription
+    # Active subscription, or the free tier once it has ended
+    return await entitlements.get(current_user['id'])
 
 
 @api_router.post("/premium/subscribe")
@@ -1004,30 +1223,9 @@ async def subscribe_premium(
     """Subscribe to premium tier (Mock - no real payment)"""
     
     # Define features based on tier
-    if tier == "gold":
-        features = {
-            "unlimited_likes": True,
-            "see_who_liked": True,
-            "unlimited_rewinds": True,
-            "super_likes_per_day": 5,
-            "boosts_per_month": 1,
-            "top_picks": True,
-            "read_receipts": False,
-            "profile_controls": False
-        }
-    elif tier == "platinum":
-        features = {
-            "unlimited_likes": True,
-            "see_who_liked": True,
-            "unlimited_rewinds": True,
-            "super_likes_per_day": 10,
-            "boosts_per_month": 2,
-            "top_picks": True,
-            "read_receipts": True,
-            "profile_controls": True
-        }
-    else:
+    if tier not in TIER_FEATURES:
         raise HTTPException(status_code=400, detail="Invalid tier")
+    features = dict(TIER_FEATURES[tier])
     
     # Calculate end date based on duration
     duration_map = {
@@ -1039,7 +1237,7 @@ async def subscribe_premium(
     }
     
     days = duration_map.get(duration, 30)
-    end_date = datetime.now(timezone.utc) + timedelta(days=days)
+    end_date = utcnow() + timedelta(days=days)
     
     # Check if subscription exists
     existing = await db.premium_subscriptions.find_one({"user_id": current_user['id']})
@@ -1048,11 +1246,11 @@ async def subscribe_premium(
         "user_id": current_user['id'],
         "tier": tier,
         "status": "active",
-        "start_date": datetime.now(timezone.utc).isoformat(),
-        "end_date": end_date.isoformat(),
+        "start_date": utcnow(),
+        "end_date": end_date,
         "features": features,
         "auto_renew": False,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": utcnow()
     }
     
     if existing:
@@ -1062,8 +1260,12 @@ async def subscribe_premium(
         )
     else:
         subscription_data["id"] = str(uuid.uuid4())
-        subscription_data["created_at"] = datetime.now(timezone.utc).isoformat()
-        await db.premium_subscriptions.insert_one(subscription_data)
+        subscription_data["created_at"] = utcnow()
+        await db.premium_subscriptions.insert_one(subscription_data.copy())
+    
+    await entitlements.invalidate(current_user['id'])
+    if event_log is not None:
+        event_log.emit("premium_subscribe", user_id=current_user['id'], tier=tier, duration=duration, end_date=end_date)
     
     return {
         "message": f"تم الاشتراك في {tier.capitalize()} بنجاح!",
@@ -1071,9 +1273,8 @@ async def subscribe_premium(
     }
 
 
-@api_router.get("/premium/plans")
-async def get_premium_plans():
-    """Get available premium plans and pricing (Mock prices)"""
+def render_premium_plans() -> dict:
+    """Available premium plans and pricing (Mock prices)"""
     return {
         "plans": [
             {
@@ -1118,9 +1319,29 @@ async def get_premium_plans():
     }
 
 
+premium_plans_response = StaticResponse(render_premium_plans())
+
+
+@api_router.get("/premium/plans")
+async def get_premium_plans(request: Request):
+    """Get available premium plans and pricing (Mock prices)"""
+    return premium_plans_response.respond(request)
+
+
 # ===== Chat & Messaging APIs =====
 
-@api_router.get("/conversations")
+def sort_conversations(conversations: list) -> list:
+    """In place, by last message time (match time when there is none), newest first"""
+    def last_activity(conversation):
+        value = conversation['last_message']['created_at']
+        # Unmigrated documents still hold ISO strings
+        return value if isinstance(value, datetime) else parse_datetime(value) or EPOCH
+
+    conversations.sort(key=last_activity, reverse=True)
+    return conversations
+
+
+@api_router.get("/conversations", response_class=FastJSONResponse)
 async def get_conversations(current_user: dict = Depends(get_current_user)):
     """Get all conversations for current user"""
     matches = await db.matches.find(
@@ -1134,12 +1355,25 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
         {"_id": 0}
     ).to_list(length=None)
     
+    other_user_ids = [
+        match['user2_id'] if match['user1_id'] == current_user['id'] else match['user1_id']
+        for match in matches
+    ]
+    
+    # Presence comes from memory; only users who hide it need a lookup
+    hidden = await db.user_settings.find(
+        {"user_id": {"$in": other_user_ids}, "show_activity_status": False},
+        {"_id": 0, "user_id": 1}
+    ).to_list(length=None)
+    hidden_ids = {s['user_id'] for s in hidden}
+    online = presence.online_many(other_user_ids)
+    unread_counts = await unread.get_unread_counts(db, current_user['id'])
+    
     conversations = []
-    for match in matches:
-        other_user_id = match['user2_id'] if match['user1_id'] == current_user['id'] else match['user1_id']
+    for match, other_user_id in zip(matches, other_user_ids):
         
         # Get other user's profile
-        other_profile = await db.profiles.find_one({"user_id": other_user_id}, {"_id": 0})
+        other_profile = await db.profiles.find_one({"user_id": other_user_id}, versions.PUBLIC_PROJECTION)
         other_user = await db.users.find_one({"id": other_user_id}, {"_id": 0})
         
         # Get last message
@@ -1149,40 +1383,48 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
             sort=[("created_at", -1)]
         )
         
-        # Count unread messages
-        unread_count = await db.messages.count_documents({
-            "match_id": match['id'],
-            "receiver_id": current_user['id'],
-            "status": {"$ne": "read"}
-        })
-        
         conversations.append({
             "match_id": match['id'],
             "user": {
                 "id": other_user_id,
                 "name": other_user.get('name') if other_user else "Unknown",
                 "display_name": other_profile.get('display_name') if other_profile else "Unknown",
-                "photo": other_profile.get('photos', [None])[0] if other_profile else None,
-                "is_online": False  # TODO: implement online status
+                "photo": (other_profile.get('photos') or [None])[0] if other_profile else None,
+                "is_online": online[other_user_id] and other_user_id not in hidden_ids,
+                "last_seen": other_user.get('last_seen') if other_user and other_user_id not in hidden_ids else None
             },
             "last_message": {
                 "content": last_message.get('content') if last_message else None,
                 "created_at": last_message.get('created_at') if last_message else match['matched_at'],
                 "sender_id": last_message.get('sender_id') if last_message else None
             },
-            "unread_count": unread_count,
+            "unread_count": unread_counts.get(match['id'], 0),
             "matched_at": match['matched_at']
         })
     
-    # Sort by last message time
-    conversations.sort(key=lambda x: x['last_message']['created_at'], reverse=True)
-    
-    return {"conversations": conversations}
+    return FastJSONResponse({"conversations": sort_conversations(conversations)})
+
+
+@api_router.get("/conversations/unread")
+async def get_unread_total(current_user: dict = Depends(get_current_user)):
+    """Unread totals for the app badge (one document read)"""
+    counts = await unread.get_unread_counts(db, current_user['id'])
+    return {"total": sum(counts.values()), "conversations": counts}
 
 
-@api_router.get("/conversations/{match_id}/messages")
-async def get_messages(match_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all messages for a conversation"""
+@api_router.get("/conversations/{match_id}/messages", response_class=FastJSONResponse)
+async def get_messages(
+    match_id: str,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get messages for a conversation; pass `before`/`limit` to page back into
+    older history, with `before_id` (the id of the oldest message shown) so
+    messages sent in the same millisecond are not skipped
+    """
     # Verify match exists and user is part of it
     match = await db.matches.find_one(
         {
@@ -1198,28 +1440,38 @@ async def get_messages(match_id: str, current_user: dict = Depends(get_current_u
     if not match:
         raise HTTPException(status_code=404, detail="Match not found")
     
-    # Get messages
-    messages = await db.messages.find(
-        {"match_id": match_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(length=None)
+    paging = before is not None or limit is not None
+    if paging:
+        # Reads through to the monthly archive once the hot collection runs out
+        messages, has_more = await archive.load_messages(
+            db,
+            match_id,
+            before or utcnow(),
+            limit or archive.DEFAULT_PAGE_SIZE,
+            before_id=before_id if before is not None else None
+        )
+    else:
+        messages = await db.messages.find(
+            {"match_id": match_id},
+            {"_id": 0}
+        ).sort("created_at", 1).to_list(length=None)
     
-    # Mark messages as read
-    await db.messages.update_many(
-        {
-            "match_id": match_id,
-            "receiver_id": current_user['id'],
-            "status": {"$ne": "read"}
-        },
-        {
-            "$set": {
-                "status": "read",
-                "read_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
-    )
+    # Mark messages as read (no write unless something was unread)
+    if messages and before is None:
+        await unread.mark_read(db, match, current_user['id'], parse_datetime(messages[-1]['created_at']))
     
-    return {"messages": messages}
+    # Read state of my messages comes from the other participant's watermark
+    other_user_id = match['user2_id'] if match['user1_id'] == current_user['id'] else match['user1_id']
+    read_up_to = unread.read_watermark(match, other_user_id)
+    if read_up_to:
+        for message in messages:
+            # Unmigrated messages still carry ISO strings
+            if message['sender_id'] == current_user['id'] and parse_datetime(message['created_at']) <= read_up_to:
+                message['status'] = "read"
+    
+    if paging:
+        return FastJSONResponse({"messages": messages, "has_more": has_more})
+    return FastJSONResponse({"messages": messages})
 
 
 @api_router.post("/conversations/{match_id}/messages")
@@ -1257,11 +1509,29 @@ async def send_message(
         "content": content,
         "message_type": message_type,
         "status": "sent",
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": utcnow(),
         "read_at": None
     }
     
-    await db.messages.insert_one(message_data)
+    if message_writer is not None:
+        await message_writer.insert(message_data.copy())
+    else:
+        await db.messages.insert_one(message_data.copy())
+    await unread.increment_unread(db, receiver_id, match_id)
+    await search.index_message(db, message_data)
+    if event_log is not None:
+        event_log.emit(
+            "message",
+            message_id=message_data['id'],
+            match_id=match_id,
+            sender_id=current_user['id'],
+            receiver_id=receiver_id,
+            message_type=message_type,
+            content_length=len(content)
+        )
+    
+    # Push to the receiver on whichever worker holds their event stream
+    await broker.publish(f"user:{receiver_id}", {"type": "message", "data": message_data})
     
     return {
         "message": "Message sent successfully",
@@ -1272,30 +1542,68 @@ async def send_message(
 @api_router.post("/conversations/{match_id}/read-receipts")
 async def mark_as_read(match_id: str, current_user: dict = Depends(get_current_user)):
     """Mark all messages in conversation as read"""
-    result = await db.messages.update_many(
+    match = await db.matches.find_one(
         {
-            "match_id": match_id,
-            "receiver_id": current_user['id'],
-            "status": {"$ne": "read"}
+            "id": match_id,
+            "$or": [
+                {"user1_id": current_user['id']},
+                {"user2_id": current_user['id']}
+            ]
         },
-        {
-            "$set": {
-                "status": "read",
-                "read_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
+        {"_id": 0}
     )
     
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+    
+    count = await unread.mark_read(db, match, current_user['id'], utcnow())
+    
     return {
-        "message": f"Marked {result.modified_count} messages as read"
+        "message": f"Marked {count} messages as read"
     }
 
 
+@api_router.get("/search/messages", response_class=FastJSONResponse)
+async def search_messages(
+    q: str,
+    before: Optional[datetime] = None,
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search the current user's chat history (prefix match on every word)"""
+    messages = await search.search_messages(db, current_user['id'], q, before=before, limit=min(limit, 100))
+    return FastJSONResponse({"messages": messages})
+
+
+@api_router.get("/events")
+async def event_stream(request: Request, current_user: dict = Depends(get_current_user)):
+    """Server-sent events for the current user (new messages, ...)"""
+    subscription = await broker.subscribe(f"user:{current_user['id']}")
+    
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    _, event = await asyncio.wait_for(subscription.get(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    presence.touch(current_user['id'])
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=json_default)}\n\n"
+        finally:
+            await subscription.close()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 # ===== Settings APIs =====
 
 @api_router.get("/settings")
-async def get_settings(current_user: dict = Depends(get_current_user)):
+async def get_settings(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """Get user settings"""
+    cached = await versions.check(request, db.user_settings, {"user_id": current_user['id']})
+    if cached is not None:
+        return cached
     settings = await db.user_settings.find_one({"user_id": current_user['id']}, {"_id": 0})
     
     if not settings:
@@ -1311,13 +1619,16 @@ async def get_settings(current_user: dict = Depends(get_current_user)):
             "auto_play_videos": True,
             "show_activity_status": True,
             "theme": "system",
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utcnow(),
+            "updated_at": utcnow()
         }
-        await db.user_settings.insert_one(settings_data)
+        # insert_one adds _id to the dict it is given
+        await db.user_settings.insert_one(settings_data.copy())
+        versions.set_etag(response, versions.etag(settings_data))
         return settings_data
     
-    return settings
+    versions.set_etag(response, versions.etag(settings))
+    return versions.without_version(settings)
 
 
 @api_router.put("/settings")
@@ -1326,11 +1637,12 @@ async def update_settings(
     current_user: dict = Depends(get_current_user)
 ):
     """Update user settings"""
-    settings_update["updated_at"] = datetime.now(timezone.utc).isoformat()
+    settings_update.pop(versions.VERSION_FIELD, None)
+    settings_update["updated_at"] = utcnow()
     
     result = await db.user_settings.update_one(
         {"user_id": current_user['id']},
-        {"$set": settings_update}
+        {"$set": settings_update, "$inc": versions.BUMP}
     )
     
     if result.matched_count == 0:
@@ -1339,16 +1651,168 @@ async def update_settings(
             "id": str(uuid.uuid4()),
             "user_id": current_user['id'],
             **settings_update,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utcnow()
         }
-        await db.user_settings.insert_one(settings_data)
+        await db.user_settings.insert_one(settings_data.copy())
         return {"message": "Settings created", "settings": settings_data}
     
     return {"message": "Settings updated successfully"}
 
 
-@api_router.get("/terms")
-async def get_terms():
+# ===== Composite API =====
+
+async def _subscription_status_section(user: dict):
+    subscription = await db.subscriptions.find_one({"user_id": user['id']}, {"_id": 0})
+    return subscription_status_payload(subscription).model_dump(mode="json")
+
+
+async def _payment_status_section(user: dict):
+    return payment_status_payload(await db.payment_methods.find_one({"user_id": user['id']}, {"_id": 0}))
+
+
+async def _profile_section(user: dict):
+    return my_profile_payload(await db.profiles.find_one({"user_id": user['id']}, {"_id": 0}))
+
+
+async def _user_profile_section(user: dict):
+    return user_profile_payload(await load_current_user(user)).model_dump(mode="json")
+
+
+async def _likes_received_section(user: dict):
+    return {"profiles": await load_received_likes(user['id'])}
+
+
+async def _premium_subscription_section(user: dict):
+    return await entitlements.get(user['id'])
+
+
+# Section name -> loader; each returns what its standalone endpoint returns
+COMPOSITE_SECTIONS = {
+    "subscription_status": _subscription_status_section,  # /subscription/status
+    "payment_status": _payment_status_section,  # /payment/status
+    "profile": _profile_section,  # /profile/me
+    "user_profile": _user_profile_section,  # /user/profile
+    "likes_received": _likes_received_section,  # /likes/received
+    "premium_subscription": _premium_subscription_section,  # /premium/subscription
+}
+
+
+async def _version_tag(collection, query: dict, make_etag=versions.etag, fields=()) -> Optional[str]:
+    projection = {"_id": 0, "id": 1, versions.VERSION_FIELD: 1, **{field: 1 for field in fields}}
+    return make_etag(await collection.find_one(query, projection))
+
+
+# Section name -> the ETag its endpoint would send, from id/version only.
+# Sections without one (likes, entitlements) leave the composite untagged.
+COMPOSITE_ETAGS = {
+    "subscription_status": lambda user: _version_tag(
+        db.subscriptions, {"user_id": user['id']}, subscription_etag, ("trial_end_date",)
+    ),
+    "payment_status": lambda user: _version_tag(db.payment_methods, {"user_id": user['id']}),
+    "profile": lambda user: _version_tag(db.profiles, {"user_id": user['id']}),
+    "user_profile": lambda user: _version_tag(db.users, {"id": user['id']}),
+}
+
+
+async def composite_etag(names: List[str], user: dict) -> Optional[str]:
+    if any(name not in COMPOSITE_ETAGS for name in names):
+        return None
+    tags = await asyncio.gather(*(COMPOSITE_ETAGS[name](user) for name in names))
+    return versions.combined_etag(zip(names, tags))
+
+
+async def _load_section(name: str, user: dict) -> dict:
+    try:
+        return {"data": await COMPOSITE_SECTIONS[name](user)}
+    except HTTPException as e:
+        # One missing resource (e.g. no profile yet) must not fail the page
+        return {"error": {"status": e.status_code, "detail": e.detail}}
+
+
+@api_router.get("/composite", response_class=FastJSONResponse)
+async def get_composite(request: Request, sections: str, current_user: dict = Depends(get_current_user)):
+    """
+    Several page-load reads in one round trip, e.g.
+    `/composite?sections=subscription_status,payment_status`: authenticates
+    once and loads the sections concurrently. Each section comes back as
+    {"data": ...} or, where its endpoint would fail, {"error": {"status", "detail"}}.
+
+    When every section has a version ETag (and its document exists), the
+    response carries one combined from them, and a matching If-None-Match
+    is answered 304 after reading only ids and versions. The tags are read
+    before the sections, so a write in between can only cost a refetch.
+    """
+    names = list(dict.fromkeys(name.strip() for name in sections.split(",") if name.strip()))
+    unknown = [name for name in names if name not in COMPOSITE_SECTIONS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown or missing sections {unknown}; available: {', '.join(COMPOSITE_SECTIONS)}"
+        )
+    
+    tag = await composite_etag(names, current_user)
+    cached = versions.not_modified(request, tag)
+    if cached is not None:
+        return cached
+    results = await asyncio.gather(*(_load_section(name, current_user) for name in names))
+    response = FastJSONResponse(dict(zip(names, results)))
+    versions.set_etag(response, tag)
+    return response
+
+
+# ===== Admin APIs =====
+
+# Admin endpoints answer 404 unless ADMIN_TOKEN is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+profiler_lock = asyncio.Lock()
+
+
+async def require_admin(x_admin_token: str = Header("")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+@api_router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(seconds: float = 10, interval_ms: float = 10, all_threads: bool = False):
+    """
+    Sample the stacks of the worker that serves this request for `seconds`
+    and return them as collapsed stacks (flamegraph.pl, speedscope), rooted
+    at the route being served. Event loop thread only, unless `all_threads`
+    (Motor's executor threads do the BSON work). See profiler.py for overhead.
+    """
+    if not 0 < seconds <= profiler.MAX_SECONDS or not profiler.MIN_INTERVAL * 1000 <= interval_ms <= 1000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds must be in (0, {profiler.MAX_SECONDS:g}], interval_ms in [{profiler.MIN_INTERVAL * 1000:g}, 1000]"
+        )
+    if profiler_lock.locked():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running on this worker")
+    
+    async with profiler_lock:
+        sampler = profiler.StackSampler(
+            None if all_threads else [threading.get_ident()],
+            interval=interval_ms / 1000
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    
+    return Response(
+        sampler.collapsed(),
+        media_type="text/plain",
+        headers={
+            "X-Profile-Worker": str(os.getpid()),
+            "X-Profile-Samples": str(sampler.samples),
+            "X-Profile-Overhead": f"{sampler.overhead:.4f}",
+        }
+    )
+
+
+def render_terms(date: datetime) -> dict:
     terms_content = """
 # شروط وأحكام استخدام التطبيق
 
@@ -1600,14 +2064,46 @@ async def get_terms():
 
 *آخر تحديث: {date}*  
 *رقم الإصدار: 1.0*
-""".format(date=datetime.now().strftime("%d/%m/%Y"))
+""".format(date=date.strftime("%d/%m/%Y"))
     
     return {"terms": terms_content}
 
 
+terms_rendered_on = datetime.now().date()
+terms_response = StaticResponse(render_terms(datetime.now()))
+
+
+@api_router.get("/terms")
+async def get_terms(request: Request):
+    global terms_rendered_on
+    # The terms carry today's date; re-render once a day rather than per hit
+    today = datetime.now().date()
+    if today != terms_rendered_on:
+        terms_response.refresh(render_terms(datetime.now()))
+        terms_rendered_on = today
+    return terms_response.respond(request)
+
+
+if METRICS:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """Prometheus scrape endpoint (outside /api: for the scraper, not the app)"""
+        return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# gzip/brotli by Accept-Encoding; RESPONSE_COMPRESSION=0 when a proxy in front already compresses
+if os.environ.get('RESPONSE_COMPRESSION', '1') == '1':
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get('COMPRESSION_MIN_BYTES', '1024')),
+        gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+        brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4')),
+        thread_size=int(os.environ.get('COMPRESSION_THREAD_KB', '64')) * 1024,
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1616,6 +2112,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if QUERY_BUDGET:
+    app.add_middleware(
+        QueryBudgetMiddleware,
+        max_queries=QUERY_BUDGET,
+        max_seconds=float(os.environ.get('QUERY_BUDGET_MS', '250')) / 1000,
+        repeat_threshold=int(os.environ.get('QUERY_REPEAT_THRESHOLD', '10')),
+        server_timing=DEBUG,
+    )
+
+if traffic_recorder is not None:
+    app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
+
+# Outermost, so latency includes compression and CORS
+if METRICS:
+    app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -1623,6 +2135,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_broker():
+    await unread.ensure_indexes(db)
+    await archive.ensure_indexes(db)
+    await search.ensure_indexes(db)
+    await billing.ensure_indexes(db)
+    await broker.start()
+    background_tasks.append(asyncio.create_task(run_presence(presence, db, broker)))
+    background_tasks.append(asyncio.create_task(entitlements.run_invalidations()))
+    if event_log is not None:
+        background_tasks.append(asyncio.create_task(event_log.run()))
+    if traffic_recorder is not None:
+        background_tasks.append(asyncio.create_task(traffic_recorder.run()))
+    
+    # Trial expiry and renewals; off unless an interval is configured
+    billing_interval = float(os.environ.get('BILLING_INTERVAL_SECONDS', '0'))
+    if billing_interval > 0:
+        scheduler = billing.BillingScheduler(
+            db,
+            payment_gateway,
+            max_in_flight=int(os.environ.get('BILLING_MAX_IN_FLIGHT', str(billing.MAX_IN_FLIGHT)))
+        )
+        background_tasks.append(asyncio.create_task(billing.run_billing(scheduler, billing_interval)))
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    if message_writer is not None:
+        await message_writer.drain()
+    await flush_presence(presence, db, broker)
+    if event_log is not None:
+        event_log.close()
+    if traffic_recorder is not None:
+        traffic_recorder.close()
+    await payment_gateway.close()
+    await broker.close()
     client.close()
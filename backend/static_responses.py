@@ -0,0 +1,88 @@
+"""
+Pre-rendered responses for endpoints whose payload only changes with code
+or configuration (terms, premium plans).
+
+The payload is serialized once, compressed once per encoding, and served
+with a strong ETag, so a hit costs a header comparison and a bytes copy,
+and a revalidating client gets a bodiless 304. Call `refresh()` with the
+new payload when the underlying configuration changes.
+"""
+import gzip
+import hashlib
+import json
+from typing import Dict, Set
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: served as gzip/identity only
+    brotli = None
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """Encodings the client accepts (q > 0) from an Accept-Encoding header."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for If-None-Match)."""
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class StaticResponse:
+    media_type = "application/json"
+
+    def __init__(self, content):
+        self.refresh(content)
+
+    def refresh(self, content):
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        variants: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=11)
+        # Only keep encodings that actually save bytes
+        self.variants = {k: v for k, v in variants.items() if k == "identity" or len(v) < len(body)}
+
+    def respond(self, request: Request) -> Response:
+        headers = {
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, self.etag):
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                headers["Content-Encoding"] = encoding
+                return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.variants["identity"], media_type=self.media_type, headers=headers)
@@ -0,0 +1,161 @@
+"""
+Dates are stored as native BSON datetimes.
+
+Clients are created with `tz_aware=True`, so dates read back as aware UTC
+datetimes, range queries compare dates instead of strings, and handlers
+no longer call `datetime.fromisoformat` on every read. Conversion to and
+from ISO strings happens only at the boundary: FastAPI serializes
+responses, `json_default` covers hand-written json.dumps (SSE, broker),
+and `parse_datetime` reads query parameters and token claims.
+
+BSON dates have millisecond precision. `utcnow()` truncates to match, so
+the value a handler returns (and a client later sends back as a `before`
+cursor) is exactly what was stored.
+
+Documents written before the switch hold ISO strings. `migrate` rewrites
+them collection by collection in `_id` order, a batch at a time; it only
+selects fields that are still strings, so an interrupted run simply
+continues where it stopped when started again. Run it before (or right
+after) deploying: until a document is migrated, date range queries do not
+match it, and code reading dates passes them through `parse_datetime`.
+
+A string some key was derived from is kept next to the converted date
+(KEPT_STRINGS): billing's idempotency key is the subscription id plus the
+next_payment_date string, and a charge in flight across the migration
+must be retried under the same key.
+
+    python storage.py migrate
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+from archive import ARCHIVE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Every date field, by collection (archive partitions share `messages`)
+DATE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "users": ("created_at", "trial_end_date", "terms_accepted_at", "last_seen"),
+    "subscriptions": (
+        "created_at", "start_date", "trial_end_date", "next_payment_date",
+        "last_payment_date", "billing_lease_until"
+    ),
+    "payment_methods": ("created_at",),
+    "payments": ("created_at",),
+    "profiles": ("created_at", "updated_at"),
+    "user_settings": ("created_at", "updated_at"),
+    "swipes": ("created_at",),
+    "matches": ("matched_at", "user1_read_up_to", "user2_read_up_to"),
+    "messages": ("created_at", "read_at"),
+    "premium_subscriptions": ("start_date", "end_date", "created_at", "updated_at"),
+    "search_postings": ("created_at",),
+    "analytics_daily": ("computed_at",),
+}
+
+# (collection, field) -> where the original string is kept when converted
+KEPT_STRINGS: Dict[Tuple[str, str], str] = {
+    ("subscriptions", "next_payment_date"): "billing_key_date",
+}
+
+
+def utcnow() -> datetime:
+    """Now, at the precision BSON stores."""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    """Aware UTC datetime from a stored value, ISO string or None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def json_default(value):
+    """`default=` for json.dumps: dates as ISO strings, like FastAPI responses."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _converted(name: str, document: dict, fields: Iterable[str]) -> dict:
+    changes = {}
+    for field in fields:
+        value = document.get(field)
+        if isinstance(value, str):
+            try:
+                changes[field] = parse_datetime(value)
+            except ValueError:
+                logger.warning("Leaving unparseable %s=%r on %s", field, value, document['_id'])
+                continue
+            if (name, field) in KEPT_STRINGS:
+                changes[KEPT_STRINGS[name, field]] = value
+    return changes
+
+
+async def migrate_collection(db, name: str, fields: Tuple[str, ...], batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Rewrite string dates in one collection; returns the number of documents updated."""
+    collection = db[name]
+    criteria = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+    updated = 0
+    last_id = None
+    while True:
+        query = criteria if last_id is None else {"$and": [criteria, {"_id": {"$gt": last_id}}]}
+        batch = await collection.find(query, projection).sort("_id", ASCENDING).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        # Match on the old value too, so a concurrent write is never overwritten
+        requests = [
+            UpdateOne({"_id": document['_id'], **{f: document[f] for f in changes if f in fields}}, {"$set": changes})
+            for document in batch
+            for changes in [_converted(name, document, fields)]
+            if changes
+        ]
+        if requests:
+            result = await collection.bulk_write(requests, ordered=False)
+            updated += result.modified_count
+        logger.info("%s: %d documents migrated", name, updated)
+    return updated
+
+
+async def migrate(db, batch_size: int = MIGRATION_BATCH_SIZE) -> Dict[str, int]:
+    """Migrate every known collection and archive partition; safe to re-run."""
+    names = await db.list_collection_names()
+    targets = [(name, fields) for name, fields in DATE_FIELDS.items() if name in names]
+    targets += [(name, DATE_FIELDS["messages"]) for name in sorted(names) if name.startswith(ARCHIVE_PREFIX)]
+    return {name: await migrate_collection(db, name, fields, batch_size) for name, fields in targets}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("usage: python storage.py migrate")
+        sys.exit(2)
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    database = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+
+    async def main():
+        print(await migrate(database))
+
+    asyncio.run(main())
@@ -0,0 +1,285 @@
+"""
+Sampled, anonymized capture of request shapes for replay on a dev box.
+
+TrafficCaptureMiddleware writes one JSON line per sampled request:
+
+    {"t": 1760870400.123, "m": "POST", "r": "/api/conversations/{match_id}/messages",
+     "u": "9c1f0e2a7b3d", "p": {"match_id": "@51e0c9d24a8f"},
+     "q": [["content", "<str:17>"]], "s": 200, "d": 4.2}
+
+t is the start time, r the route template, u the caller, p/q/b the path
+parameters, query and JSON body, c set for a conditional GET
+(If-None-Match), s the status and d the milliseconds to the end of the
+response. Nothing identifying is kept:
+
+    ids                         "@" + keyed hash; the same id always gets
+                                the same pseudonym, so a user's swipes,
+                                matches and messages still line up. An id
+                                is any uuid, any value of an id-named field
+                                (id, *_id, *_ids) and any non-numeric path
+                                parameter, whatever its shape (the seeded
+                                dummy-user-N accounts)
+    the caller                  the same pseudonym as their user id
+    emails, timestamps          "<email>", "<datetime>"
+    enum-like values            kept: lowercase words (like, super_like,
+                                dark), short numbers, booleans
+    any other text              "<str:N>", its length only
+    REDACTED fields             always "<str:N>": free text (content, q,
+                                bio, names), credentials, card details
+
+Pseudonyms are HMAC-SHA256 under `key`, so they can't be reversed by
+hashing known ids, and every worker given the same key (server.py
+derives it from SECRET_KEY) writes the same pseudonyms. Sampling is per
+user, by the pseudonym, so a sampled user's whole session is captured
+and replays coherently; anonymous requests (register, login) are
+sampled at random at the same rate.
+
+Lines are buffered and appended from a worker thread by a background
+task, as the event log does, so a request never waits on the file; each
+process writes its own `traffic-<start>-<pid>.jsonl`.
+benchmarks/traffic_replay.py merges the files and replays them.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 0.1
+FLUSH_INTERVAL = 1.0
+FLUSH_BYTES = 256 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+EXCLUDED_PREFIXES = ("/api/events", "/api/admin/", "/metrics")
+REDACTED = frozenset({
+    "q", "content", "bio", "name", "display_name", "location", "occupation", "education", "date_of_birth",
+    "email", "phone_number", "password", "card_number", "card_holder_name", "card_expiry", "card_cvv",
+})
+
+_ID_KEY = re.compile(r"(^|_)ids?$")
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_TOKEN = re.compile(r"^[a-z_]{1,32}(,[a-z_]{1,32})*$")
+_NUMBER = re.compile(r"^-?\d{1,6}$")
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+$")
+_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+_USER_CACHE_SIZE = 10000
+
+
+class TrafficRecorder:
+    """Pseudonymizes and buffers records; `run` appends them in the background."""
+
+    def __init__(
+        self,
+        directory,
+        key: bytes,
+        sample_rate: float = SAMPLE_RATE,
+        flush_interval: float = FLUSH_INTERVAL
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"traffic-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.jsonl"
+        self.key = key
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self._threshold = int(sample_rate * 2 ** 32)
+        self._buffer: List[str] = []
+        self._buffered_bytes = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        # Held while appending; a write in a worker thread may outlive a cancelled `run`
+        self._lock = threading.Lock()
+        # Authorization header -> caller pseudonym; tokens are reused for their lifetime
+        self._callers: Dict[str, Optional[str]] = {}
+
+    def pseudonym(self, value: str) -> str:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def caller(self, authorization: Optional[str]) -> Optional[str]:
+        """Pseudonym of the bearer token's `sub`; the signature is not checked, only the handler does that."""
+        if not authorization:
+            return None
+        cached = self._callers.get(authorization, False)
+        if cached is not False:
+            return cached
+        subject = None
+        try:
+            payload = authorization.split(" ", 1)[1].split(".")[1]
+            subject = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))).get("sub")
+        except (IndexError, ValueError, AttributeError):
+            pass
+        if len(self._callers) >= _USER_CACHE_SIZE:
+            self._callers.clear()
+        caller = self._callers[authorization] = self.pseudonym(subject) if isinstance(subject, str) else None
+        return caller
+
+    def sampled(self, caller: Optional[str]) -> bool:
+        if caller is None:
+            return random.random() < self.sample_rate
+        return int(caller[:8], 16) < self._threshold
+
+    def anonymize(self, value, key: Optional[str] = None, identifier: bool = False):
+        if isinstance(value, dict):
+            return {k: self.anonymize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(item, key, identifier) for item in value]
+        if not isinstance(value, str):
+            return value
+        if identifier or _UUID.match(value) or (key is not None and _ID_KEY.search(key)):
+            return "@" + self.pseudonym(value)
+        if key not in REDACTED:
+            if _TOKEN.match(value) or _NUMBER.match(value):
+                return value
+            if _EMAIL.match(value):
+                return "<email>"
+            if _DATETIME.match(value):
+                return "<datetime>"
+        return f"<str:{len(value)}>"
+
+    def record(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        self._buffer.append(line)
+        self._buffered_bytes += len(line) + 1
+        if self._buffered_bytes >= FLUSH_BYTES:
+            if self._wakeup is not None:
+                self._wakeup.set()
+            else:
+                # No background task (scripts, tests): write inline
+                self.flush()
+
+    def _take(self) -> str:
+        if not self._buffer:
+            return ""
+        data = "\n".join(self._buffer) + "\n"
+        self._buffer = []
+        self._buffered_bytes = 0
+        return data
+
+    def _write(self, data: str):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+
+    def flush(self):
+        """Append everything buffered, blocking the caller; `run` does this off the event loop."""
+        data = self._take()
+        if data:
+            self._write(data)
+
+    async def run(self):
+        """Background task: append buffered records every flush_interval seconds, or once FLUSH_BYTES are buffered."""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                data = self._take()
+                if not data:
+                    continue
+                try:
+                    await asyncio.to_thread(self._write, data)
+                except OSError as e:
+                    logger.warning("Traffic capture flush failed: %s", e)
+                    # Kept for the next attempt, in order
+                    self._buffer.insert(0, data[:-1])
+                    self._buffered_bytes += len(data)
+        finally:
+            self._wakeup = None
+
+    def close(self):
+        self.flush()
+
+
+class TrafficCaptureMiddleware:
+    def __init__(self, app: ASGIApp, recorder: TrafficRecorder, excluded_prefixes=EXCLUDED_PREFIXES):
+        self.app = app
+        self.recorder = recorder
+        self.excluded_prefixes = tuple(excluded_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = None
+        conditional = False
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+            elif name == b"if-none-match":
+                conditional = True
+        recorder = self.recorder
+        caller = recorder.caller(authorization)
+        if not recorder.sampled(caller):
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        started = time.perf_counter()
+        body = bytearray()
+        body_size = 0
+        status_code = 500
+
+        async def receive_with_copy() -> Message:
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_size += len(chunk)
+                if body_size <= MAX_BODY_BYTES:
+                    body.extend(chunk)
+            return message
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_copy, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route is not None:
+                record = {
+                    "t": round(started_at, 3),
+                    "m": scope["method"],
+                    "r": route,
+                    "u": caller,
+                    "s": status_code,
+                    "d": round((time.perf_counter() - started) * 1000, 1),
+                }
+                if scope.get("path_params"):
+                    record["p"] = {
+                        k: recorder.anonymize(str(v), k, identifier=not _NUMBER.match(str(v)))
+                        for k, v in scope["path_params"].items()
+                    }
+                if scope["query_string"]:
+                    query = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+                    record["q"] = [[k, recorder.anonymize(v, k)] for k, v in query]
+                if body_size:
+                    record["b"] = self._body(body, body_size)
+                if conditional:
+                    record["c"] = 1
+                recorder.record(record)
+
+    def _body(self, body: bytearray, size: int):
+        if size > MAX_BODY_BYTES:
+            return f"<body:{size}>"
+        try:
+            return self.recorder.anonymize(json.loads(body))
+        except ValueError:
+            return f"<body:{size}>"
@@ -0,0 +1,171 @@
+"""
+Per-user unread counters and read watermarks.
+
+Each user has one `unread_counters` document, {"user_id": ..., "matches":
+{match_id: n}}, bumped with $inc when a message is sent to them and cleared
+when they read the conversation. The inbox and the app badge read that one
+document instead of counting messages per conversation.
+
+Reading a conversation does not touch the message documents. The match
+stores how far each participant has read (`user1_read_up_to` /
+`user2_read_up_to`, the created_at of the newest message read), and
+message status is derived from that when messages are listed. The
+watermark always moves forward with $max, whatever the counter says, and
+the counter only loses the messages the watermark now covers, so a
+message that arrives while the reader is mid-read stays unread. Polling
+an idle conversation reads the counter and writes nothing.
+
+If the counters ever drift (crash between the message insert and the $inc,
+manual data fixes, ...) `python unread.py reconcile` recounts them from
+`messages` in batches of users.
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from storage import EPOCH, parse_datetime
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 500
+
+
+async def ensure_indexes(db):
+    await db.unread_counters.create_index("user_id", unique=True)
+    await db.messages.create_index([("receiver_id", ASCENDING), ("status", ASCENDING)])
+    await db.matches.create_index("id")
+
+
+async def increment_unread(db, user_id: str, match_id: str):
+    await db.unread_counters.update_one(
+        {"user_id": user_id},
+        {"$inc": {f"matches.{match_id}": 1}},
+        upsert=True
+    )
+
+
+async def reset_unread(db, user_id: str, match_id: str, covered: int) -> int:
+    """
+    Take `covered` newly read messages off one conversation's counter and
+    return how many came off. Clears the entry when nothing else is left,
+    leaves messages beyond `covered` (arrived since) counted.
+    """
+    field = f"matches.{match_id}"
+    for _ in range(2):
+        cleared = await db.unread_counters.find_one_and_update(
+            {"user_id": user_id, field: {"$gt": 0, "$lte": covered}},
+            {"$unset": {field: ""}},
+            projection={"_id": 0, field: 1}
+        )
+        if cleared:
+            return cleared['matches'][match_id]
+        reduced = await db.unread_counters.update_one(
+            {"user_id": user_id, field: {"$gt": covered}},
+            {"$inc": {field: -covered}}
+        )
+        if reduced.modified_count:
+            return covered
+        # Neither: the counter went to zero, or dropped to <= covered between the two; look once more
+    return 0
+
+
+def watermark_field(match: dict, user_id: str) -> str:
+    return "user1_read_up_to" if match['user1_id'] == user_id else "user2_read_up_to"
+
+
+def read_watermark(match: dict, user_id: str) -> Optional[datetime]:
+    return parse_datetime(match.get(watermark_field(match, user_id)))
+
+
+async def mark_read(db, match: dict, user_id: str, up_to) -> int:
+    """Record that `user_id` has read `match` up to `up_to`; returns the number of messages that were unread."""
+    field = watermark_field(match, user_id)
+    up_to = parse_datetime(up_to)
+    previous = parse_datetime(match.get(field))
+    if previous is None or previous < up_to:
+        # A not yet migrated ISO string is behind (checked above); $max across types compares the types
+        operator = "$set" if isinstance(match.get(field), str) else "$max"
+        await db.matches.update_one({"id": match['id']}, {operator: {field: up_to}})
+
+    counters = await db.unread_counters.find_one(
+        {"user_id": user_id},
+        {"_id": 0, f"matches.{match['id']}": 1}
+    )
+    if not counters or not counters.get('matches', {}).get(match['id']):
+        return 0
+    covered = await db.messages.count_documents({
+        "match_id": match['id'],
+        "receiver_id": user_id,
+        "created_at": {"$gt": previous or EPOCH, "$lte": up_to}
+    })
+    if not covered:
+        return 0
+    return await reset_unread(db, user_id, match['id'], covered)
+
+
+async def get_unread_counts(db, user_id: str) -> Dict[str, int]:
+    counters = await db.unread_counters.find_one({"user_id": user_id}, {"_id": 0, "matches": 1})
+    return counters.get('matches', {}) if counters else {}
+
+
+async def reconcile_unread(db, batch_size: int = RECONCILE_BATCH_SIZE) -> int:
+    """Recount every user's counters from `messages`; returns the number of users rewritten."""
+    rewritten = 0
+    last_id = ""
+    while True:
+        users = await db.users.find(
+            {"id": {"$gt": last_id}},
+            {"_id": 0, "id": 1}
+        ).sort("id", ASCENDING).limit(batch_size).to_list(length=batch_size)
+        if not users:
+            break
+        user_ids = [u['id'] for u in users]
+        last_id = user_ids[-1]
+
+        counts = {user_id: {} for user_id in user_ids}
+        async for row in db.messages.aggregate([
+            {"$match": {"receiver_id": {"$in": user_ids}, "status": {"$ne": "read"}}},
+            {"$lookup": {"from": "matches", "localField": "match_id", "foreignField": "id", "as": "match"}},
+            {"$unwind": "$match"},
+            {"$match": {"$expr": {"$gt": ["$created_at", {"$ifNull": [
+                {"$cond": [
+                    {"$eq": ["$receiver_id", "$match.user1_id"]},
+                    "$match.user1_read_up_to",
+                    "$match.user2_read_up_to"
+                ]},
+                EPOCH
+            ]}]}}},
+            {"$group": {"_id": {"user_id": "$receiver_id", "match_id": "$match_id"}, "n": {"$sum": 1}}},
+        ]):
+            counts[row['_id']['user_id']][row['_id']['match_id']] = row['n']
+
+        await db.unread_counters.bulk_write(
+            [
+                UpdateOne({"user_id": user_id}, {"$set": {"matches": matches}}, upsert=True)
+                for user_id, matches in counts.items()
+            ],
+            ordered=False
+        )
+        rewritten += len(user_ids)
+        logger.info("Reconciled unread counters for %d users", rewritten)
+    return rewritten
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reconcile"]:
+        print("usage: python unread.py reconcile")
+        sys.exit(2)
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    asyncio.run(reconcile_unread(client[os.environ['DB_NAME']]))
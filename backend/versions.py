@@ -0,0 +1,91 @@
+"""
+Per-document version counters and the ETags built from them.
+
+Per-user documents that the frontend re-fetches on every page (profile,
+settings, user, subscription, payment method) carry a `version` counter.
+Every write that changes what those endpoints return adds `BUMP` to its
+update (`{"$inc": BUMP}`); bookkeeping writes that no response shows
+(presence `last_seen`, billing leases and attempt counters) leave it
+alone so they don't invalidate clients. Documents written before the
+counter existed read as version 0 until their first update. The counter
+is bookkeeping: endpoints returning a stored document as-is strip it
+with `without_version`.
+
+The ETag is weak: it names the document and its version, not the exact
+bytes, which also keeps it valid across Content-Encodings. A GET with
+If-None-Match costs a projection of `id` and `version` and answers 304
+when nothing changed; only a miss loads and serializes the document.
+A missing document has no ETag, so a conditional GET for it is answered
+in full (usually a 404), never with a 304.
+"""
+import hashlib
+from typing import Callable, Iterable, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from static_responses import etag_matches
+
+VERSION_FIELD = "version"
+BUMP = {VERSION_FIELD: 1}
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(document: Optional[dict], *extra) -> Optional[str]:
+    """Weak ETag for a document plus any derived values the response depends on; None when it is missing."""
+    if document is None:
+        return None
+    parts = (document.get('id'), document.get(VERSION_FIELD, 0), *extra)
+    return 'W/"' + ".".join(str(part) for part in parts) + '"'
+
+
+# For reads that return stored documents as they are and need no ETag
+PUBLIC_PROJECTION = {"_id": 0, VERSION_FIELD: 0}
+
+
+def combined_etag(tags: Iterable[Tuple[str, Optional[str]]]) -> Optional[str]:
+    """Weak ETag over named parts (composite responses); None if any part has none."""
+    digest = hashlib.sha1()
+    for name, tag in tags:
+        if tag is None:
+            return None
+        digest.update(f"{name}={tag};".encode())
+    return 'W/"c.' + digest.hexdigest()[:20] + '"'
+
+
+def without_version(document: dict) -> dict:
+    return {k: v for k, v in document.items() if k != VERSION_FIELD}
+
+
+def set_etag(response: Response, tag: Optional[str]):
+    if tag is None:
+        return
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def not_modified(request: Request, tag: Optional[str]) -> Optional[Response]:
+    """A 304 if the request's If-None-Match matches `tag`, else None."""
+    header = request.headers.get("if-none-match")
+    if header and tag is not None and etag_matches(header, tag):
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+async def check(
+    request: Request,
+    collection,
+    query: dict,
+    make_etag: Callable[[Optional[dict]], Optional[str]] = etag,
+    fields: Iterable[str] = ()
+) -> Optional[Response]:
+    """
+    304 for a conditional GET whose ETag still matches the stored version.
+    Reads only id, version and `fields` (whatever `make_etag` needs), and
+    nothing at all when the request is unconditional.
+    """
+    if "if-none-match" not in request.headers:
+        return None
+    projection = {"_id": 0, "id": 1, VERSION_FIELD: 1, **{field: 1 for field in fields}}
+    return not_modified(request, make_etag(await collection.find_one(query, projection)))
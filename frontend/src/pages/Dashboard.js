@@ -23,16 +23,12 @@ const Dashboard = () => {
 
   const fetchData = async () => {
     try {
-      const [subResponse, payResponse] = await Promise.all([
-        axios.get(`${API}/subscription/status`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
-        axios.get(`${API}/payment/status`, {
-          headers: { Authorization: `Bearer ${token}` }
-        })
-      ]);
-      setSubscription(subResponse.data);
-      setPaymentStatus(payResponse.data);
+      const { data } = await axios.get(`${API}/composite`, {
+        params: { sections: 'subscription_status,payment_status' },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setSubscription(data.subscription_status.data);
+      setPaymentStatus(data.payment_status.data);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
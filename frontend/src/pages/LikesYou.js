@@ -24,17 +24,13 @@ const LikesYou = () => {
 
   const fetchData = async () => {
     try {
-      const [likesRes, subRes] = await Promise.all([
-        axios.get(`${API}/likes/received`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
-        axios.get(`${API}/premium/subscription`, {
-          headers: { Authorization: `Bearer ${token}` }
-        })
-      ]);
+      const { data } = await axios.get(`${API}/composite`, {
+        params: { sections: 'likes_received,premium_subscription' },
+        headers: { Authorization: `Bearer ${token}` }
+      });
       
-      setReceivedLikes(likesRes.data.profiles || []);
-      setSubscription(subRes.data);
+      setReceivedLikes(data.likes_received.data?.profiles || []);
+      setSubscription(data.premium_subscription.data);
     } catch (error) {
       console.error('Error:', error);
     } finally {
@@ -23,16 +23,12 @@ const Profile = () => {
 
   const fetchProfileData = async () => {
     try {
-      const [profileRes, userRes] = await Promise.all([
-        axios.get(`${API}/profile/me`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
-        axios.get(`${API}/user/profile`, {
-          headers: { Authorization: `Bearer ${token}` }
-        })
-      ]);
-      setProfile(profileRes.data);
-      setUser(userRes.data);
+      const { data } = await axios.get(`${API}/composite`, {
+        params: { sections: 'profile,user_profile' },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setProfile(data.profile.data);
+      setUser(data.user_profile.data);
     } catch (error) {
       console.error('Error fetching profile:', error);
     } finally {
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other flatly, as server.py does when run from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server.py reads these at import; the client it creates never connects in tests
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "tests")
+
+
+@pytest.fixture
+def mongo_db():
+    """An empty in-memory database, tz-aware like the app's client; drive it with asyncio.run(scenario(mongo_db))."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test"]
+
+
+@pytest.fixture
+def api(monkeypatch, mongo_db):
+    """(call, db): `call(method, path, **kwargs)` requests the app as a fresh user, on an in-memory database."""
+    import httpx
+    import server
+    from broker import InProcessBroker
+    from entitlements import EntitlementResolver
+    from storage import utcnow
+
+    db = mongo_db
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "entitlements", EntitlementResolver(db, InProcessBroker()))
+    user_id = str(uuid.uuid4())
+    now = utcnow()
+    asyncio.run(db.users.insert_one({
+        "id": user_id, "name": "Layla", "email": "user@example.com", "subscription_status": "trial",
+        "trial_end_date": now + timedelta(days=30), "created_at": now,
+    }))
+    headers = {"Authorization": f"Bearer {server.create_access_token(data={'sub': user_id})}"}
+
+    def call(method, path, **kwargs):
+        async def request():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.request(method, path, headers={**headers, **kwargs.pop("headers", {})}, **kwargs)
+
+        return asyncio.run(request())
+
+    call.user_id = user_id
+    return call, db
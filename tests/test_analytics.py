@@ -0,0 +1,141 @@
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pandas")
+
+import analytics  # noqa: E402
+from archive import ARCHIVE_PREFIX  # noqa: E402
+from billing import RENEWAL_PERIOD  # noqa: E402
+
+TODAY = datetime.now(timezone.utc).date()
+
+
+def at(day: date, hour: int = 12) -> datetime:
+    return datetime.combine(day, time(hour), tzinfo=timezone.utc)
+
+
+async def swipe(db, swipe_id, user_id, action, created_at):
+    await db.swipes.insert_one({"id": swipe_id, "user_id": user_id, "action": action, "created_at": created_at})
+
+
+def test_batches_page_through_ties_without_repeats(mongo_db):
+    day = TODAY - timedelta(days=1)
+
+    async def scenario(db):
+        # Five swipes share one timestamp, so pages have to continue by id
+        for n in range(5):
+            await swipe(db, f"s{n}", "u1", "like", at(day))
+        await swipe(db, "s5", "u1", "like", at(day, 18))
+        await swipe(db, "before", "u1", "like", at(day) - timedelta(days=1))
+        await swipe(db, "after", "u1", "like", at(day) + timedelta(days=1))
+
+        frames = [frame async for frame in analytics._batches(db.swipes, "created_at", day, ["user_id"], 2)]
+        assert [len(frame) for frame in frames] == [2, 2, 2]
+        assert [swipe_id for frame in frames for swipe_id in frame["id"]] == [f"s{n}" for n in range(6)]
+        assert list(frames[0].columns) == ["id", "user_id"]
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_payment_converts_a_trial_only_for_the_first_period():
+    trial_end = at(TODAY - timedelta(days=1))
+    frame = analytics.pd.DataFrame.from_records([
+        # Paid at the end of the trial: the first period
+        {"trial_end_date": trial_end, "next_payment_date": trial_end + RENEWAL_PERIOD},
+        # A year later the same subscription renews: not a conversion again
+        {"trial_end_date": trial_end - RENEWAL_PERIOD, "next_payment_date": trial_end + RENEWAL_PERIOD},
+        # Unmigrated subscriptions still carry ISO strings
+        {"trial_end_date": trial_end.isoformat(), "next_payment_date": (trial_end + RENEWAL_PERIOD).isoformat()},
+        {"trial_end_date": None, "next_payment_date": trial_end + RENEWAL_PERIOD},
+    ])
+    metrics = analytics.DailyMetrics(trial_end.date())
+    metrics.add_payments(frame)
+    assert metrics.trial_conversions == 2
+
+
+def test_compute_day(mongo_db):
+    day = TODAY - timedelta(days=1)
+    trial_end = at(day, 6)
+
+    async def scenario(db):
+        await swipe(db, "s1", "u1", "like", at(day))
+        await swipe(db, "s2", "u1", "super_like", at(day))
+        await swipe(db, "s3", "u2", "pass", at(day))
+        await swipe(db, "s4", "u2", "like", at(day))
+        await db.matches.insert_one({"id": "m1", "matched_at": at(day)})
+        await db.messages.insert_many([
+            {"id": "x1", "match_id": "m1", "created_at": at(day)},
+            {"id": "x2", "match_id": "m1", "created_at": at(day, 13)},
+        ])
+        await db[ARCHIVE_PREFIX + day.strftime("%Y_%m")].insert_one({"id": "x0", "match_id": "m0", "created_at": at(day, 1)})
+        await db.subscriptions.insert_many([
+            {"id": "sub1", "trial_end_date": trial_end, "last_payment_date": at(day, 7),
+             "next_payment_date": trial_end + RENEWAL_PERIOD},
+            {"id": "sub2", "trial_end_date": trial_end},
+            {"id": "sub3", "trial_end_date": trial_end - RENEWAL_PERIOD, "last_payment_date": at(day, 8),
+             "next_payment_date": trial_end + RENEWAL_PERIOD},
+        ])
+
+        document = await analytics.compute_day(db, day, batch_size=2)
+        assert {k: v for k, v in document.items() if k != "computed_at"} == {
+            "date": day.isoformat(),
+            "swipes": 4, "likes": 3, "super_likes": 1, "passes": 1, "active_swipers": 2, "likes_per_swiper": 1.5,
+            "matches": 1, "match_rate": 0.3333,
+            "messages": 3, "active_conversations": 2, "messages_per_conversation": 1.5,
+            "trials_ended": 2, "trial_conversions": 1, "trial_to_paid_rate": 0.5,
+        }
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_run_daily_resumes_from_the_watermark(mongo_db, monkeypatch):
+    first = TODAY - timedelta(days=3)
+
+    async def scenario(db):
+        for offset in (0, 1, 2):
+            await swipe(db, f"s{offset}", "u1", "like", at(first + timedelta(days=offset)))
+        await swipe(db, "today", "u1", "like", at(TODAY, 0))
+        assert await analytics._first_day(db) == first
+
+        compute_day = analytics.compute_day
+
+        async def interrupted(db, day, batch_size):
+            if day == first + timedelta(days=1):
+                raise RuntimeError("interrupted")
+            return await compute_day(db, day, batch_size)
+
+        monkeypatch.setattr(analytics, "compute_day", interrupted)
+        with pytest.raises(RuntimeError):
+            await analytics.run_daily(db)
+        assert (await db.analytics_state.find_one({"id": analytics.WATERMARK_ID}))["next_day"] == (first + timedelta(days=1)).isoformat()
+
+        monkeypatch.setattr(analytics, "compute_day", compute_day)
+        days = [(first + timedelta(days=offset)).isoformat() for offset in (1, 2)]
+        assert await analytics.run_daily(db) == days
+        # Today is not complete, and nothing is left to do until it is
+        assert await analytics.run_daily(db) == []
+        assert (await db.analytics_state.find_one({"id": analytics.WATERMARK_ID}))["next_day"] == TODAY.isoformat()
+
+        written = await db.analytics_daily.find({}, {"_id": 0}).sort("date", 1).to_list(length=None)
+        assert [(doc["date"], doc["swipes"]) for doc in written] == [(first.isoformat(), 1), (days[0], 1), (days[1], 1)]
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_first_day_looks_at_unmigrated_strings(mongo_db):
+    async def scenario(db):
+        await swipe(db, "s1", "u1", "like", at(TODAY - timedelta(days=2)))
+        await db.matches.insert_one({"id": "m1", "matched_at": at(TODAY - timedelta(days=5)).isoformat()})
+        assert await analytics._first_day(db) == TODAY - timedelta(days=5)
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_run_daily_without_data_writes_nothing(mongo_db):
+    async def scenario(db):
+        assert await analytics.run_daily(db) == []
+        assert await db.analytics_state.count_documents({}) == 0
+
+    asyncio.run(scenario(mongo_db))
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import archive
+from storage import utcnow
+
+
+def message(n: int, created_at, match_id="m1") -> dict:
+    return {"id": f"msg-{n:03d}", "match_id": match_id, "content": str(n), "created_at": created_at}
+
+
+async def page_back(db, limit: int):
+    """Every page from the newest back, following the cursor the API hands out."""
+    pages, before, before_id = [], utcnow() + timedelta(seconds=1), None
+    while True:
+        page, has_more = await archive.load_messages(db, "m1", before, limit, before_id=before_id)
+        pages.append(page)
+        if not has_more:
+            return pages
+        before, before_id = page[0]['created_at'], page[0]['id']
+
+
+def test_messages_sharing_a_millisecond_are_not_skipped(mongo_db):
+    async def scenario(db):
+        burst = utcnow() - timedelta(minutes=1)
+        await db.messages.insert_many([message(n, burst) for n in range(7)])
+        await db.messages.insert_many([message(n, burst + timedelta(seconds=n)) for n in range(7, 10)])
+
+        pages = await page_back(db, 3)
+        seen = [m['id'] for page in reversed(pages) for m in page]
+        assert seen == sorted(seen) and len(seen) == 10 == len(set(seen))
+
+    asyncio.run(scenario(mongo_db))
+
+
+@pytest.mark.parametrize("count, limit, pages", [(6, 3, 2), (7, 3, 3), (3, 3, 1), (0, 3, 1)])
+def test_has_more_is_exact(count, limit, pages, mongo_db):
+    async def scenario(db):
+        start = utcnow() - timedelta(hours=1)
+        if count:
+            await db.messages.insert_many([message(n, start + timedelta(seconds=n)) for n in range(count)])
+        result = await page_back(db, limit)
+        assert len(result) == pages
+        assert sum(len(page) for page in result) == count
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_pages_read_through_to_the_archive(mongo_db):
+    async def scenario(db):
+        now = utcnow()
+        old = now - timedelta(days=200)
+        # What archive_messages leaves behind (the in-memory client has no zstd collections)
+        month = archive.month_key(old)
+        await db[archive.ARCHIVE_PREFIX + month].insert_many([message(n, old + timedelta(seconds=n)) for n in range(4)])
+        await db.message_archive_catalog.insert_one({"match_id": "m1", "months": [month]})
+        await db.messages.insert_many([message(n, now - timedelta(seconds=10 - n)) for n in range(4, 6)])
+
+        pages = await page_back(db, 3)
+        assert [[m['id'] for m in page] for page in pages] == [
+            ["msg-003", "msg-004", "msg-005"],
+            ["msg-000", "msg-001", "msg-002"],
+        ]
+
+    asyncio.run(scenario(mongo_db))
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import server
+from storage import utcnow
+
+
+@pytest.fixture
+def claims(api, monkeypatch):
+    """(call, db, tokens): the api fixture in claims mode, with tokens issued for its user."""
+    call, db = api
+    monkeypatch.setattr(server, "TOKEN_CLAIMS", True)
+    user = asyncio.run(db.users.find_one({"id": call.user_id}, {"_id": 0}))
+    return call, db, asyncio.run(server.issue_tokens(user))
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_claims_token_authenticates_without_reading_the_user(claims):
+    call, db, tokens = claims
+    payload = server.jwt.decode(tokens["access_token"], server.SECRET_KEY, algorithms=[server.ALGORITHM])
+    assert payload["typ"] == "access" and payload["tier"] == "free" and payload["sst"] == "trial"
+
+    # Gone from the database: only the claims can authenticate it now
+    asyncio.run(db.users.delete_one({"id": call.user_id}))
+    response = call("GET", "/api/premium/subscription", headers=bearer(tokens["access_token"]))
+    assert response.status_code == 200
+    assert response.json()["tier"] == "free"
+    plain = server.create_access_token(data={"sub": call.user_id})
+    assert call("GET", "/api/premium/subscription", headers=bearer(plain)).status_code == 401
+
+
+def test_claims_expire_with_the_subscription(claims):
+    call, db, _ = claims
+    end_date = utcnow() + timedelta(minutes=5)
+    asyncio.run(db.premium_subscriptions.insert_one({
+        "user_id": call.user_id, "tier": "gold", "status": "active", "end_date": end_date,
+        "features": server.TIER_FEATURES["gold"],
+    }))
+    asyncio.run(server.entitlements.invalidate(call.user_id))
+    user = asyncio.run(db.users.find_one({"id": call.user_id}, {"_id": 0}))
+    tokens = asyncio.run(server.issue_tokens(user))
+    payload = server.jwt.decode(tokens["access_token"], server.SECRET_KEY, algorithms=[server.ALGORITHM])
+    assert payload["tier"] == "gold"
+    assert payload["exp"] <= end_date.timestamp() + 1
+
+
+def test_refresh_issues_a_new_pair(claims):
+    call, db, tokens = claims
+    response = call("POST", "/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    fresh = response.json()
+    assert fresh["access_token"] and fresh["refresh_token"]
+    assert call("GET", "/api/premium/subscription", headers=bearer(fresh["access_token"])).status_code == 200
+
+
+def test_token_types_are_not_interchangeable(claims):
+    call, db, tokens = claims
+    assert call("GET", "/api/premium/subscription", headers=bearer(tokens["refresh_token"])).status_code == 401
+    response = call("POST", "/api/auth/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
+
+def test_refresh_for_a_deleted_user_is_rejected(claims):
+    call, db, tokens = claims
+    asyncio.run(db.users.delete_one({"id": call.user_id}))
+    assert call("POST", "/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+
+def test_expired_and_tampered_tokens_are_rejected(claims):
+    call, db, tokens = claims
+    expired = server.create_access_token(data={"sub": call.user_id}, expires_delta=timedelta(seconds=-1))
+    header, payload, signature = tokens["access_token"].split(".")
+    tampered = ".".join((header, payload, signature[:-4] + ("AAAA" if signature[-4:] != "AAAA" else "BBBB")))
+    foreign = server.jwt.encode({"sub": call.user_id, "typ": "access"}, "not-the-key", algorithm=server.ALGORITHM)
+    for token in (expired, tampered, foreign, "not-a-jwt"):
+        assert call("GET", "/api/premium/subscription", headers=bearer(token)).status_code == 401
+    expired_refresh = server.create_access_token(data={"sub": call.user_id, "typ": "refresh"}, expires_delta=timedelta(seconds=-1))
+    assert call("POST", "/api/auth/refresh", json={"refresh_token": expired_refresh}).status_code == 401
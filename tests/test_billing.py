@@ -0,0 +1,145 @@
+import asyncio
+from datetime import timedelta
+
+import billing
+from payments import ChargeResult, CircuitOpenError, PaymentDeclined, PaymentGateway, PaymentGatewayError
+from storage import utcnow
+
+
+class ScriptedGateway(PaymentGateway):
+    """Raises the exception queued for a user, else charges; records every key it sees."""
+
+    def __init__(self, script=None):
+        self.script = script or {}
+        self.keys = []
+
+    async def charge(self, *, user_id, payment_method, amount, currency, idempotency_key):
+        self.keys.append(idempotency_key)
+        queued = self.script.get(user_id)
+        if queued:
+            raise queued.pop(0)
+        return ChargeResult(transaction_id="tx", amount=amount, currency=currency, idempotency_key=idempotency_key)
+
+
+def seed(db, users=("u1",), with_method=True):
+    """Subscriptions for `users`, due a day ago, each with a payment method unless told otherwise."""
+    async def insert():
+        due = utcnow() - timedelta(days=1)
+        for user_id in users:
+            await db.users.insert_one({"id": user_id, "subscription_status": "trial"})
+            await db.subscriptions.insert_one({
+                "id": f"s-{user_id}", "user_id": user_id, "status": "trial", "next_payment_date": due,
+                "annual_amount": 396.0, "currency": "CHF",
+            })
+            if with_method:
+                await db.payment_methods.insert_one({"user_id": user_id, "is_active": True})
+
+    asyncio.run(insert())
+
+
+async def subscription(db, user_id="u1"):
+    return await db.subscriptions.find_one({"user_id": user_id}, {"_id": 0})
+
+
+async def expire_lease(db):
+    await db.subscriptions.update_many({}, {"$set": {"billing_lease_until": utcnow() - timedelta(seconds=1)}})
+
+
+def test_charge_renews_and_records_payment(mongo_db):
+    async def scenario(db):
+        before = await subscription(db)
+        totals = await billing.BillingScheduler(db, ScriptedGateway()).run_once()
+        assert totals["charged"] == 1
+        after = await subscription(db)
+        assert after["status"] == "active"
+        assert after["next_payment_date"] == before["next_payment_date"] + billing.RENEWAL_PERIOD
+        assert "billing_lease_until" not in after
+        assert await db.payments.count_documents({}) == 1
+
+    seed(mongo_db)
+    asyncio.run(scenario(mongo_db))
+
+
+def test_decline_expires(mongo_db):
+    async def scenario(db):
+        gateway = ScriptedGateway({"u1": [PaymentDeclined("card_declined")]})
+        assert (await billing.BillingScheduler(db, gateway).run_once())["declined"] == 1
+        assert (await subscription(db))["status"] == "expired"
+        assert (await db.users.find_one({"id": "u1"}))["subscription_status"] == "expired"
+
+    seed(mongo_db)
+    asyncio.run(scenario(mongo_db))
+
+
+def test_missing_payment_method_expires(mongo_db):
+    async def scenario(db):
+        gateway = ScriptedGateway()
+        assert (await billing.BillingScheduler(db, gateway).run_once())["declined"] == 1
+        assert (await subscription(db))["status"] == "expired"
+        assert gateway.keys == []
+
+    seed(mongo_db, with_method=False)
+    asyncio.run(scenario(mongo_db))
+
+
+def test_gateway_failures_never_expire_and_retry_with_the_same_key(mongo_db):
+    async def scenario(db):
+        failures = billing.WARN_AFTER_ATTEMPTS + 2
+        gateway = ScriptedGateway({"u1": [PaymentGatewayError("timeout") for _ in range(failures)]})
+        for attempt in range(1, failures + 1):
+            totals = await billing.BillingScheduler(db, gateway).run_once()
+            assert totals["failed"] == 1
+            current = await subscription(db)
+            assert current["status"] == "trial"
+            assert current["billing_attempts"] == attempt
+            # The lease holds it until it runs out
+            assert (await billing.BillingScheduler(db, gateway).run_once())["failed"] == 0
+            await expire_lease(db)
+
+        assert (await billing.BillingScheduler(db, gateway).run_once())["charged"] == 1
+        assert (await subscription(db))["status"] == "active"
+        assert len(set(gateway.keys)) == 1
+
+    seed(mongo_db)
+    asyncio.run(scenario(mongo_db))
+
+
+def test_open_circuit_is_not_an_attempt(mongo_db):
+    async def scenario(db):
+        gateway = ScriptedGateway({"u1": [CircuitOpenError("open")]})
+        totals = await billing.BillingScheduler(db, gateway).run_once()
+        assert totals["deferred"] == 1
+        current = await subscription(db)
+        assert current["status"] == "trial"
+        assert "billing_attempts" not in current
+        assert "billing_lease_until" not in current
+
+        # Released, so the next run retries straight away
+        assert (await billing.BillingScheduler(db, gateway).run_once())["charged"] == 1
+
+    seed(mongo_db)
+    asyncio.run(scenario(mongo_db))
+
+
+def test_open_circuit_stops_the_run(mongo_db):
+    async def scenario(db):
+        gateway = ScriptedGateway({user_id: [CircuitOpenError("open")] for user_id in ("u1", "u2", "u3")})
+        totals = await billing.BillingScheduler(db, gateway, chunk_size=1).run_once()
+        assert totals == {"charged": 0, "declined": 0, "failed": 0, "deferred": 1}
+        assert await db.subscriptions.count_documents({"billing_lease_until": {"$exists": True}}) == 0
+
+    seed(mongo_db, users=("u1", "u2", "u3"))
+    asyncio.run(scenario(mongo_db))
+
+
+def test_lease_keeps_concurrent_runs_disjoint(mongo_db):
+    async def scenario(db):
+        gateway = ScriptedGateway()
+        results = await asyncio.gather(*(
+            billing.BillingScheduler(db, gateway, chunk_size=2).run_once() for _ in range(3)
+        ))
+        assert sum(totals["charged"] for totals in results) == 5
+        assert len(gateway.keys) == 5
+
+    seed(mongo_db, users=("u1", "u2", "u3", "u4", "u5"))
+    asyncio.run(scenario(mongo_db))
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+
+from broker import BLOCK, DROP_NEWEST, DROP_OLDEST, InProcessBroker, SocketBroker, _decode
+
+
+def test_in_process_fan_out():
+    async def scenario():
+        broker = InProcessBroker()
+        first = await broker.subscribe("user:1")
+        second = await broker.subscribe("user:1", "user:2")
+        await broker.publish("user:1", {"n": 1})
+        await broker.publish("user:2", {"n": 2})
+        assert await first.get() == ("user:1", {"n": 1})
+        assert await second.get() == ("user:1", {"n": 1})
+        assert await second.get() == ("user:2", {"n": 2})
+        assert first.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_unsubscribed_channels_are_forgotten():
+    async def scenario():
+        broker = InProcessBroker()
+        async with await broker.subscribe("a", "b"):
+            assert set(broker._subscribers) == {"a", "b"}
+        assert broker._subscribers == {}
+        await broker.publish("a", {})
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("policy, kept", [(DROP_OLDEST, [2, 3]), (DROP_NEWEST, [1, 2])])
+def test_full_queue_policy(policy, kept):
+    async def scenario():
+        broker = InProcessBroker(queue_size=2, policy=policy)
+        subscription = await broker.subscribe("ch")
+        for n in (1, 2, 3):
+            await broker.publish("ch", {"n": n})
+        assert subscription.dropped == 1
+        assert [(await subscription.get())[1]["n"] for _ in range(2)] == kept
+
+    asyncio.run(scenario())
+
+
+def test_block_policy_drops_after_timeout():
+    async def scenario():
+        broker = InProcessBroker(queue_size=1, policy=BLOCK, block_timeout=0.01)
+        subscription = await broker.subscribe("ch")
+        await broker.publish("ch", {"n": 1})
+        await broker.publish("ch", {"n": 2})
+        assert subscription.dropped == 1
+        assert await subscription.get() == ("ch", {"n": 1})
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("line", [
+    b"not json\n",
+    b"[1, 2]\n",
+    b'{"op": "pub", "msg": {}}\n',
+    b'{"op": "pub", "ch": ["x"], "msg": {}}\n',
+])
+def test_decode_rejects_malformed_frames(line):
+    assert _decode(line) is None
+
+
+def test_decode_published_frame():
+    assert _decode(b'{"op":"pub","ch":"user:1","msg":{"n":1}}\n') == ("user:1", {"n": 1})
+
+
+def test_socket_broker_survives_malformed_frames(tmp_path):
+    async def scenario():
+        url = f"unix://{tmp_path}/broker.sock"
+        host = SocketBroker(url, reconnect_delay=0.01)
+        worker = SocketBroker(url, reconnect_delay=0.01)
+        await host.start()
+        await worker.start()
+        try:
+            assert host.hub is not None and worker.hub is None
+            subscription = await worker.subscribe("user:1")
+            await asyncio.sleep(0.05)
+
+            # A peer publishing garbage must not stop the worker's reader
+            for frame in ([1, 2], {"op": "pub", "ch": "user:1"}, {"op": "pub", "ch": {"x": 1}, "msg": {}}):
+                host._writer.write(json.dumps(frame).encode() + b"\n")
+            await host._writer.drain()
+            await host.publish("user:1", {"n": 1})
+
+            assert await asyncio.wait_for(subscription.get(), 2) == ("user:1", {"n": 1})
+            assert not worker._reader_task.done()
+        finally:
+            await worker.close()
+            await host.close()
+
+    asyncio.run(scenario())
+
+
+def test_socket_broker_publish_survives_a_lost_hub(tmp_path):
+    class BrokenWriter:
+        """The hub went away between the connected check and the write."""
+
+        def __init__(self, real):
+            self.real = real
+
+        def write(self, data):
+            pass
+
+        async def drain(self):
+            raise ConnectionResetError("hub gone")
+
+        def close(self):
+            self.real.close()
+
+    async def scenario():
+        url = f"unix://{tmp_path}/broker.sock"
+        host = SocketBroker(url, reconnect_delay=0.01)
+        worker = SocketBroker(url, reconnect_delay=0.01)
+        await host.start()
+        await worker.start()
+        try:
+            subscription = await host.subscribe("user:1")
+            worker._writer = BrokenWriter(worker._writer)
+            await worker.publish("user:1", {"n": 1})
+            assert not worker._connected.is_set()
+
+            # The reader sees our end closed and reconnects
+            await asyncio.wait_for(worker._connected.wait(), 2)
+            await asyncio.sleep(0.05)
+            await worker.publish("user:1", {"n": 2})
+            assert await asyncio.wait_for(subscription.get(), 2) == ("user:1", {"n": 2})
+        finally:
+            await worker.close()
+            await host.close()
+
+    asyncio.run(scenario())
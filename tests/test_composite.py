@@ -0,0 +1,42 @@
+import asyncio
+
+import versions
+
+PAGE = "/api/composite?sections=payment_status,profile,user_profile"
+
+
+def test_combined_etag():
+    tag = versions.combined_etag([("a", 'W/"x.1"'), ("b", 'W/"y.2"')])
+    assert tag.startswith('W/"c.')
+    assert tag != versions.combined_etag([("a", 'W/"x.1"'), ("b", 'W/"y.3"')])
+    assert tag != versions.combined_etag([("b", 'W/"y.2"'), ("a", 'W/"x.1"')])
+    assert versions.combined_etag([("a", 'W/"x.1"'), ("b", None)]) is None
+
+
+def test_composite_honours_if_none_match(api):
+    call, db = api
+    asyncio.run(db.profiles.insert_one({"id": "p1", "user_id": call.user_id, "display_name": "Layla"}))
+    asyncio.run(db.payment_methods.insert_one({"id": "pm1", "user_id": call.user_id, "payment_type": "card"}))
+
+    first = call("GET", PAGE)
+    assert first.status_code == 200
+    tag = first.headers["etag"]
+    cached = call("GET", PAGE, headers={"If-None-Match": tag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == tag
+
+    # A write to any section changes the combined tag
+    asyncio.run(db.profiles.update_one({"id": "p1"}, {"$set": {"display_name": "Lina"}, "$inc": versions.BUMP}))
+    changed = call("GET", PAGE, headers={"If-None-Match": tag})
+    assert changed.status_code == 200
+    assert changed.json()["profile"]["data"]["display_name"] == "Lina"
+    assert changed.headers["etag"] != tag
+
+
+def test_composite_without_every_tag_is_unconditional(api):
+    call, db = api
+    # No profile yet, and likes have no version
+    for path in (PAGE, "/api/composite?sections=likes_received"):
+        response = call("GET", path, headers={"If-None-Match": "*"})
+        assert response.status_code == 200
+        assert "etag" not in response.headers
@@ -0,0 +1,133 @@
+import asyncio
+import gzip
+
+import pytest
+
+import compression
+from compression import CompressionMiddleware
+
+BODY = b'{"profiles": [' + b'{"name": "Layla", "bio": "coffee and books"},' * 200 + b"{}]}"
+
+
+def app(body=BODY, content_type="application/json", chunks=None, extra_headers=()):
+    """ASGI app sending `body` in one message, or `chunks` as a stream."""
+    async def asgi(scope, receive, send):
+        headers = [(b"content-type", content_type.encode()), *extra_headers]
+        if chunks is None:
+            headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        if chunks is None:
+            await send({"type": "http.response.body", "body": body})
+            return
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+
+    return asgi
+
+
+def request(asgi, accept_encoding="gzip", **options):
+    """(headers, body messages) of one GET through the middleware."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": headers}
+    asyncio.run(CompressionMiddleware(asgi, **options)(scope, receive, send))
+    start, *bodies = messages
+    return {k.decode(): v.decode() for k, v in start["headers"]}, bodies
+
+
+def joined(bodies):
+    return b"".join(message.get("body", b"") for message in bodies)
+
+
+def test_gzip():
+    headers, bodies = request(app())
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert int(headers["content-length"]) == len(joined(bodies))
+    assert gzip.decompress(joined(bodies)) == BODY
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli not installed")
+def test_brotli_is_preferred():
+    headers, bodies = request(app(), accept_encoding="gzip, br")
+    assert headers["content-encoding"] == "br"
+    assert compression.brotli.decompress(joined(bodies)) == BODY
+
+
+@pytest.mark.parametrize("accept_encoding", [None, "", "identity", "gzip;q=0, br;q=0", "deflate"])
+def test_no_acceptable_encoding(accept_encoding):
+    headers, bodies = request(app(), accept_encoding=accept_encoding)
+    assert "content-encoding" not in headers
+    assert joined(bodies) == BODY
+
+
+def test_q_values_are_honoured():
+    headers, _ = request(app(), accept_encoding="br;q=0, gzip;q=0.5")
+    assert headers["content-encoding"] == "gzip"
+
+
+def test_existing_vary_is_kept():
+    headers, _ = request(app(extra_headers=[(b"vary", b"Authorization")]))
+    assert headers["vary"] == "Authorization, Accept-Encoding"
+
+
+def test_small_bodies_pass_through():
+    headers, bodies = request(app(body=b'{"ok": true}'))
+    assert "content-encoding" not in headers
+    assert joined(bodies) == b'{"ok": true}'
+    headers, _ = request(app(body=b"x" * 2000), minimum_size=4096)
+    assert "content-encoding" not in headers
+
+
+@pytest.mark.parametrize("content_type", ["image/png", "application/zip", "text/event-stream", "IMAGE/JPEG"])
+def test_excluded_content_types_pass_through(content_type):
+    headers, bodies = request(app(content_type=content_type))
+    assert "content-encoding" not in headers
+    assert joined(bodies) == BODY
+
+
+def test_already_encoded_response_passes_through():
+    encoded = gzip.compress(BODY)
+    headers, bodies = request(app(body=encoded, extra_headers=[(b"content-encoding", b"gzip")]), accept_encoding="br, gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert joined(bodies) == encoded
+
+
+def test_streaming_body_is_compressed_chunk_by_chunk():
+    chunks = [BODY[:1000], b"", BODY[1000:3000], BODY[3000:]]
+    headers, bodies = request(app(chunks=chunks))
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert bodies[-1]["more_body"] is False
+    assert all(message["more_body"] for message in bodies[:-1])
+    assert gzip.decompress(joined(bodies)) == BODY
+
+
+def test_large_bodies_are_compressed_in_a_thread(monkeypatch):
+    offloaded = []
+
+    async def to_thread(function, *args):
+        offloaded.append(len(args[1]))
+        return function(*args)
+
+    monkeypatch.setattr(compression.asyncio, "to_thread", to_thread)
+    request(app(), thread_size=len(BODY))
+    request(app(), thread_size=len(BODY) + 1)
+    assert offloaded == [len(BODY)]
+
+
+def test_non_http_scopes_pass_through():
+    seen = []
+
+    async def asgi(scope, receive, send):
+        seen.append(scope["type"])
+
+    asyncio.run(CompressionMiddleware(asgi)({"type": "lifespan"}, None, None))
+    assert seen == ["lifespan"]
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+import entitlements
+from broker import InProcessBroker
+from storage import utcnow
+
+
+@pytest.fixture
+def broker():
+    return InProcessBroker()
+
+
+async def subscribe(db, user_id, end_date):
+    await db.premium_subscriptions.insert_one({"user_id": user_id, "tier": "gold", "status": "active", "end_date": end_date})
+
+
+def test_free_tier_entries_expire(mongo_db, broker):
+    async def scenario(db, broker):
+        resolver = entitlements.EntitlementResolver(db, broker)
+        assert (await resolver.get("u1"))["tier"] == "free"
+        until = resolver._cache["u1"][1]
+        assert until <= time.time() + entitlements.ENTRY_TTL
+
+        # An upgrade whose invalidation was lost shows up once the entry runs out
+        await subscribe(db, "u1", utcnow() + timedelta(days=30))
+        assert (await resolver.get("u1"))["tier"] == "free"
+        resolver._cache["u1"] = (resolver._cache["u1"][0], time.time() - 1)
+        assert (await resolver.get("u1"))["tier"] == "gold"
+
+    asyncio.run(scenario(mongo_db, broker))
+
+
+def test_premium_entries_end_at_end_date_or_ttl(mongo_db, broker):
+    async def scenario(db, broker):
+        resolver = entitlements.EntitlementResolver(db, broker, ttl=60)
+        soon = utcnow() + timedelta(seconds=10)
+        await subscribe(db, "u1", soon)
+        await subscribe(db, "u2", utcnow() + timedelta(days=30))
+        await resolver.get("u1")
+        await resolver.get("u2")
+        assert resolver._cache["u1"][1] == soon.timestamp()
+        assert resolver._cache["u2"][1] <= time.time() + 60
+
+    asyncio.run(scenario(mongo_db, broker))
+
+
+def test_invalidation_reaches_other_workers(mongo_db, broker):
+    async def scenario(db, broker):
+        first = entitlements.EntitlementResolver(db, broker)
+        second = entitlements.EntitlementResolver(db, broker)
+        listener = asyncio.create_task(second.run_invalidations())
+        await asyncio.sleep(0)
+        try:
+            assert (await second.get("u1"))["tier"] == "free"
+            await subscribe(db, "u1", utcnow() + timedelta(days=30))
+            await first.invalidate("u1")
+            for _ in range(10):
+                await asyncio.sleep(0)
+            assert "u1" not in second._cache
+            assert (await second.get("u1"))["tier"] == "gold"
+        finally:
+            listener.cancel()
+
+    asyncio.run(scenario(mongo_db, broker))
@@ -0,0 +1,90 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import event_log
+
+DAY = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> int:
+    return (DAY + timedelta(minutes=minutes) - event_log.EPOCH) // event_log.MICROSECOND
+
+
+def test_round_trip(tmp_path):
+    user, other, match = (str(uuid.uuid4()) for _ in range(3))
+    log = event_log.EventLog(tmp_path)
+    log.emit("register", timestamp=at(0), user_id=user, trial_end_date=DAY + timedelta(days=30))
+    log.emit("swipe", timestamp=at(1), user_id=user, swiped_user_id=other, action="like")
+    log.emit("match", timestamp=at(2), match_id=match, user1_id=user, user2_id=other)
+    log.emit(
+        "message", timestamp=at(3), message_id=str(uuid.uuid4()), match_id=match, sender_id=user,
+        receiver_id=other, message_type="text", content_length=9
+    )
+    log.close()
+
+    events = list(event_log.replay(tmp_path, DAY.date()))
+    assert [e.type for e in events] == ["register", "swipe", "match", "message"]
+    assert events[0].data == {"user_id": user, "trial_end_date": DAY + timedelta(days=30)}
+    assert events[1].data == {"user_id": user, "swiped_user_id": other, "action": "like"}
+    assert events[1].time == DAY + timedelta(minutes=1)
+    assert events[3].data["content_length"] == 9
+    assert "content" not in events[3].data
+
+
+def test_string_ids_use_the_wide_form(tmp_path):
+    log = event_log.EventLog(tmp_path)
+    log.emit("swipe", timestamp=at(0), user_id="dummy-user-1", swiped_user_id=str(uuid.UUID(int=1)), action="pass")
+    log.emit("swipe", timestamp=at(1), user_id="x" * 36, swiped_user_id="dummy-user-2", action="like")
+    log.close()
+
+    events = list(event_log.replay(tmp_path, DAY.date()))
+    assert [e.type for e in events] == ["swipe", "swipe"]
+    assert events[0].data == {"user_id": "dummy-user-1", "swiped_user_id": str(uuid.UUID(int=1)), "action": "pass"}
+    assert events[1].data["user_id"] == "x" * 36
+
+
+def test_malformed_events_are_dropped(tmp_path):
+    log = event_log.EventLog(tmp_path)
+    log.emit("swipe", timestamp=at(0), user_id="u1", action="like")
+    log.emit("register", timestamp=at(0), user_id="u1", trial_end_date="not a date")
+    log.close()
+    assert list(event_log.replay(tmp_path, DAY.date())) == []
+
+
+def test_torn_record_is_skipped(tmp_path):
+    log = event_log.EventLog(tmp_path)
+    for minute in range(3):
+        log.emit("swipe", timestamp=at(minute), user_id="u1", swiped_user_id="u2", action="like")
+    log.close()
+    (path,) = event_log.segments(tmp_path)
+    path.write_bytes(path.read_bytes()[:-5])
+    assert len(list(event_log.read_segment(path))) == 2
+
+
+def test_segments_never_mix_days(tmp_path):
+    log = event_log.EventLog(tmp_path)
+    log.emit("swipe", timestamp=at(0), user_id="u1", swiped_user_id="u2", action="like")
+    log.emit("swipe", timestamp=at(24 * 60), user_id="u1", swiped_user_id="u2", action="like")
+    log.close()
+    assert len(event_log.segments(tmp_path, DAY.date())) == 1
+    assert len(event_log.segments(tmp_path, (DAY + timedelta(days=1)).date())) == 1
+
+
+def test_run_writes_in_the_background(tmp_path):
+    async def scenario():
+        log = event_log.EventLog(tmp_path, flush_interval=60, flush_bytes=1)
+        task = asyncio.create_task(log.run())
+        await asyncio.sleep(0)
+        log.emit("swipe", timestamp=at(0), user_id="u1", swiped_user_id="u2", action="like")
+        # A full buffer wakes the task instead of writing inline
+        assert event_log.segments(tmp_path) == []
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if event_log.segments(tmp_path):
+                break
+        task.cancel()
+        log.close()
+        assert len(list(event_log.replay(tmp_path, DAY.date()))) == 1
+
+    asyncio.run(scenario())
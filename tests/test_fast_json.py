@@ -0,0 +1,58 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+import fast_json
+from fast_json import ENCODERS, FastJSONResponse, use_encoder
+
+PAYLOAD = {"profiles": [
+    {
+        "id": "u1", "name": "ليلى", "age": 28, "score": 0.75, "photos": ["a.jpg", "b.jpg"], "verified": True,
+        "bio": None, "last_seen": datetime(2024, 5, 1, 12, 30, 5, 123000, tzinfo=timezone.utc),
+        "created_at": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    },
+    {"id": "u2", "name": "Omar", "interests": [], "location": {"city": "Riyadh", "lat": 24.7, "lng": 46.7}},
+]}
+
+
+@pytest.fixture(autouse=True)
+def restore_encoder():
+    # The staticmethod itself, not the function it unwraps to
+    dumps = FastJSONResponse.__dict__["dumps"]
+    yield
+    FastJSONResponse.dumps = dumps
+
+
+@pytest.mark.parametrize("name", sorted(ENCODERS))
+def test_encoders_match_the_default_response_path(name):
+    expected = json.loads(json.dumps(jsonable_encoder(PAYLOAD)))
+    assert json.loads(ENCODERS[name](PAYLOAD)) == expected
+
+
+@pytest.mark.parametrize("name", sorted(ENCODERS))
+def test_encoders_keep_text_as_utf8(name):
+    assert "ليلى".encode("utf-8") in ENCODERS[name](PAYLOAD)
+
+
+@pytest.mark.parametrize("name", sorted(ENCODERS))
+def test_encoders_reject_unknown_types(name):
+    with pytest.raises(TypeError):
+        ENCODERS[name]({"value": object()})
+
+
+def test_use_encoder():
+    assert use_encoder("stdlib") == "stdlib"
+    assert FastJSONResponse({"a": 1}).body == b'{"a":1}'
+    assert use_encoder("auto") == ("orjson" if fast_json.orjson is not None else "stdlib")
+    with pytest.raises(ValueError):
+        use_encoder("simdjson")
+
+
+def test_list_endpoint_renders_through_the_fast_response(api):
+    call, _ = api
+    response = call("GET", "/api/conversations")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"conversations": []}
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+from group_commit import GroupCommitter
+
+
+class FakeCollection:
+    """Records insert_many batches; `fail` maps a document's id to a write error code."""
+
+    def __init__(self, fail=None, error=None):
+        self.batches = []
+        self.fail = fail or {}
+        self.error = error
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        self.batches.append([document["id"] for document in documents])
+        if self.error is not None:
+            raise self.error
+        errors = [
+            {"index": index, "code": self.fail[document["id"]], "errmsg": "rejected"}
+            for index, document in enumerate(documents) if document["id"] in self.fail
+        ]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def test_concurrent_inserts_share_one_round_trip():
+    async def scenario():
+        collection = FakeCollection()
+        committer = GroupCommitter(collection, window=0.01)
+        results = await asyncio.gather(*(committer.insert({"id": n}) for n in range(5)))
+        assert results == [None] * 5
+        assert collection.batches == [[0, 1, 2, 3, 4]]
+
+    asyncio.run(scenario())
+
+
+def test_max_batch_flushes_without_waiting():
+    async def scenario():
+        collection = FakeCollection()
+        committer = GroupCommitter(collection, window=60, max_batch=3)
+        await asyncio.wait_for(asyncio.gather(*(committer.insert({"id": n}) for n in range(3))), 1)
+        assert collection.batches == [[0, 1, 2]]
+
+    asyncio.run(scenario())
+
+
+def test_write_errors_reach_only_their_caller():
+    async def scenario():
+        collection = FakeCollection(fail={1: 11000, 2: 121})
+        committer = GroupCommitter(collection, window=0.01)
+        results = await asyncio.gather(
+            *(committer.insert({"id": n}) for n in range(4)), return_exceptions=True
+        )
+        assert results[0] is None and results[3] is None
+        assert isinstance(results[1], DuplicateKeyError)
+        assert isinstance(results[2], WriteError) and not isinstance(results[2], DuplicateKeyError)
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_fails_every_caller():
+    async def scenario():
+        committer = GroupCommitter(FakeCollection(error=ConnectionError("down")), window=0.01)
+        results = await asyncio.gather(*(committer.insert({"id": n}) for n in range(2)), return_exceptions=True)
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_drain_commits_pending_documents():
+    async def scenario():
+        collection = FakeCollection()
+        committer = GroupCommitter(collection, window=60)
+        pending = asyncio.create_task(committer.insert({"id": "last"}))
+        await asyncio.sleep(0)
+        await committer.drain()
+        assert collection.batches == [["last"]]
+        assert await pending is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_break_the_batch():
+    async def scenario():
+        collection = FakeCollection()
+        committer = GroupCommitter(collection, window=0.01)
+        gone = asyncio.create_task(committer.insert({"id": "gone"}))
+        kept = asyncio.create_task(committer.insert({"id": "kept"}))
+        await asyncio.sleep(0)
+        gone.cancel()
+        assert await kept is None
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        assert collection.batches == [["gone", "kept"]]
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from metrics import Counter, Histogram, MetricsMiddleware, MongoCommandMetrics, Registry, RequestMetrics
+
+
+def test_counter_sums_the_per_thread_shards():
+    counter = Counter("jobs_total", "Jobs", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(("a",))
+        counter.inc(("b",), 2)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(counter._shards) == 4
+    assert counter.samples() == ['jobs_total{kind="a"} 4000', 'jobs_total{kind="b"} 8']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(("/a",), value)
+    assert histogram.samples() == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_render_escapes_label_values():
+    registry = Registry()
+    counter = registry.register(Counter("odd_total", "Odd labels", ("value",)))
+    counter.inc(('say "hi"\\\n',))
+    assert registry.render().decode() == (
+        "# HELP odd_total Odd labels\n"
+        "# TYPE odd_total counter\n"
+        'odd_total{value="say \\"hi\\"\\\\\\n"} 1\n'
+    )
+
+
+def test_middleware_labels_by_route_template():
+    app = FastAPI()
+    metrics = RequestMetrics(Registry())
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        if item_id == "missing":
+            raise HTTPException(status_code=404)
+        assert metrics.in_flight.value == 1
+        return {"id": item_id}
+
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            for path in ("/items/1", "/items/2", "/items/missing", "/nowhere"):
+                await client.get(path)
+
+    asyncio.run(scenario())
+    assert metrics.in_flight.value == 0
+    assert metrics.requests.samples() == [
+        'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2',
+        'http_requests_total{method="GET",route="/items/{item_id}",status="404"} 1',
+        'http_requests_total{method="GET",route="unmatched",status="404"} 1',
+    ]
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 3' in metrics.duration.samples()
+
+
+def command_event(name, command, request_id, duration_micros=None):
+    return SimpleNamespace(
+        command_name=name, command=command, request_id=request_id, operation_id=request_id,
+        duration_micros=duration_micros,
+    )
+
+
+def test_mongo_listener_counts_by_collection_and_outcome():
+    listener = MongoCommandMetrics(Registry())
+    listener.started(command_event("find", {"find": "users"}, 1))
+    listener.started(command_event("getMore", {"getMore": 123, "collection": "users"}, 2))
+    listener.started(command_event("insert", {"insert": "messages"}, 3))
+    listener.succeeded(command_event("find", {}, 1, 1500))
+    listener.succeeded(command_event("getMore", {}, 2, 500))
+    listener.failed(command_event("insert", {}, 3, 2000))
+    listener.started(command_event("ping", {"ping": 1}, 4))
+    listener.succeeded(command_event("ping", {}, 4, 100))
+
+    assert listener.commands.samples() == [
+        'mongodb_commands_total{collection="",command="ping",outcome="succeeded"} 1',
+        'mongodb_commands_total{collection="messages",command="insert",outcome="failed"} 1',
+        'mongodb_commands_total{collection="users",command="find",outcome="succeeded"} 1',
+        'mongodb_commands_total{collection="users",command="getMore",outcome="succeeded"} 1',
+    ]
+    assert 'mongodb_command_duration_seconds_sum{collection="users",command="find"} 0.0015' in listener.duration.samples()
+    assert listener._collections == {}
+
+
+def test_metrics_endpoint(api):
+    call, _ = api
+    call("GET", "/api/premium/plans")
+    response = call("GET", "/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'route="/api/premium/plans",status="200"' in response.text
@@ -0,0 +1,196 @@
+import asyncio
+
+import httpx
+import pytest
+
+import payments
+from payments import (
+    ChargeResult, CircuitBreaker, CircuitOpenError, HTTPPaymentGateway, PaymentDeclined, PaymentGateway,
+    PaymentGatewayError, ResilientGateway,
+)
+
+CHARGE = {"user_id": "u1", "payment_method": {"id": "pm1"}, "amount": 396.0, "currency": "CHF"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(payments.time, "monotonic", clock)
+    return clock
+
+
+def http_charge(status_code, body=None):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(status_code, json=body if body is not None else {})
+
+    async def scenario():
+        gateway = HTTPPaymentGateway("https://gateway.test", "key", transport=httpx.MockTransport(handler))
+        try:
+            return await gateway.charge(idempotency_key="s1:2026", **CHARGE)
+        finally:
+            await gateway.close()
+
+    return asyncio.run(scenario()), seen
+
+
+@pytest.mark.parametrize("status_code, body", [
+    (402, {}),
+    (402, {"error": {"code": "insufficient_funds"}}),
+    (400, {"error": {"code": "card_declined"}}),
+])
+def test_declines(status_code, body):
+    with pytest.raises(PaymentDeclined):
+        http_charge(status_code, body)
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 403, 404, 408, 409, 422, 429, 500, 503])
+def test_other_errors_are_not_declines(status_code):
+    with pytest.raises(PaymentGatewayError):
+        http_charge(status_code, {"error": {"code": "invalid_api_key"}})
+
+
+def test_non_json_error_body_is_not_a_decline():
+    def handler(request):
+        return httpx.Response(404, text="<html>not found</html>")
+
+    async def scenario():
+        gateway = HTTPPaymentGateway("https://gateway.test", "key", transport=httpx.MockTransport(handler))
+        with pytest.raises(PaymentGatewayError):
+            await gateway.charge(idempotency_key="k", **CHARGE)
+        await gateway.close()
+
+    asyncio.run(scenario())
+
+
+def test_success_sends_the_idempotency_key():
+    result, seen = http_charge(200, {"id": "tx_1", "amount": 396.0, "currency": "CHF"})
+    assert result == ChargeResult(transaction_id="tx_1", amount=396.0, currency="CHF", idempotency_key="s1:2026")
+    assert seen[0].headers["Idempotency-Key"] == "s1:2026"
+    assert seen[0].headers["Authorization"] == "Bearer key"
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    # The probe is alone: others are refused until it reports back
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 29
+    assert breaker.state == "open"
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+class FlakyGateway(PaymentGateway):
+    def __init__(self, failures, error=PaymentGatewayError("503")):
+        self.failures = failures
+        self.error = error
+        self.keys = []
+
+    async def charge(self, *, idempotency_key, amount, currency, **kwargs):
+        self.keys.append(idempotency_key)
+        if len(self.keys) <= self.failures:
+            raise self.error
+        return ChargeResult(transaction_id="tx", amount=amount, currency=currency, idempotency_key=idempotency_key)
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """The backoff bounds ResilientGateway draws its jittered delays from; sleeps none."""
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append(high)
+        return 0
+
+    monkeypatch.setattr(payments.random, "uniform", uniform)
+    return bounds
+
+
+def test_retries_with_the_same_key_and_backs_off(delays):
+    inner = FlakyGateway(failures=2)
+    gateway = ResilientGateway(inner, max_attempts=3, base_delay=0.2, max_delay=0.5)
+    result = asyncio.run(gateway.charge(idempotency_key="s1:2026", **CHARGE))
+    assert result.transaction_id == "tx"
+    assert inner.keys == ["s1:2026"] * 3
+    assert delays == [0.4, 0.5]
+
+
+def test_gives_up_after_max_attempts(delays):
+    inner = FlakyGateway(failures=5)
+    gateway = ResilientGateway(inner, max_attempts=3)
+    with pytest.raises(PaymentGatewayError):
+        asyncio.run(gateway.charge(idempotency_key="k", **CHARGE))
+    assert len(inner.keys) == 3
+    assert gateway.breaker.failures == 3
+
+
+def test_timeouts_are_retried_and_reported_as_gateway_errors(delays):
+    class SlowGateway(PaymentGateway):
+        calls = 0
+
+        async def charge(self, **kwargs):
+            SlowGateway.calls += 1
+            await asyncio.sleep(1)
+
+    gateway = ResilientGateway(SlowGateway(), timeout=0.01, max_attempts=2)
+    with pytest.raises(PaymentGatewayError, match="timed out"):
+        asyncio.run(gateway.charge(idempotency_key="k", **CHARGE))
+    assert SlowGateway.calls == 2
+
+
+def test_declines_are_final_and_not_failures(delays):
+    inner = FlakyGateway(failures=5, error=PaymentDeclined("card_declined"))
+    gateway = ResilientGateway(inner, max_attempts=3)
+    with pytest.raises(PaymentDeclined):
+        asyncio.run(gateway.charge(idempotency_key="k", **CHARGE))
+    assert len(inner.keys) == 1
+    assert gateway.breaker.failures == 0
+
+
+def test_open_circuit_refuses_without_calling(delays):
+    inner = FlakyGateway(failures=0)
+    gateway = ResilientGateway(inner, breaker=CircuitBreaker(failure_threshold=1))
+    gateway.breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(gateway.charge(idempotency_key="k", **CHARGE))
+    assert inner.keys == []
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import presence
+from broker import InProcessBroker
+from presence import PRESENCE_CHANNEL, PresenceTracker, flush_presence, run_presence
+
+
+@pytest.fixture
+def tracker():
+    return PresenceTracker(ttl=60, resolution=15)
+
+
+def test_touch_within_resolution_is_not_a_new_step(tracker):
+    tracker.touch("u1", now=1000)
+    tracker.touch("u1", now=1010)
+    assert tracker.last_seen("u1") == 1000
+    assert tracker.take_pending() == {"u1": 1000}
+
+    # Nothing new to flush until the entry moves a full step
+    tracker.touch("u1", now=1014)
+    assert tracker.take_pending() == {}
+    tracker.touch("u1", now=1015)
+    assert tracker.take_pending() == {"u1": 1015}
+
+
+def test_entries_go_offline_after_the_ttl(tracker):
+    tracker.touch("u1", now=1000)
+    assert tracker.is_online("u1", now=1059)
+    assert not tracker.is_online("u1", now=1060)
+    assert not tracker.is_online("nobody", now=1000)
+
+
+def test_online_many(tracker):
+    tracker.touch("u1", now=1000)
+    tracker.touch("u2", now=950)
+    assert tracker.online_many(["u1", "u2", "u3"], now=1020) == {"u1": True, "u2": False, "u3": False}
+
+
+def test_remote_heartbeats_only_move_forward(tracker):
+    tracker.touch("u1", now=1000)
+    tracker.seen("u1", 990)
+    assert tracker.last_seen("u1") == 1000
+    tracker.seen("u1", 1005)
+    assert tracker.last_seen("u1") == 1005
+    # Heard from another worker, so this one has nothing to flush for it
+    tracker.seen("u2", 1005)
+    assert tracker.take_pending() == {"u1": 1005}
+
+
+def test_prune_drops_expired_entries(tracker):
+    tracker.touch("u1", now=1000)
+    tracker.touch("u2", now=1030)
+    assert tracker.prune(now=1070) == 1
+    assert len(tracker) == 1
+    assert tracker.last_seen("u1") is None
+    # A user pruned before the flush is not written back
+    assert tracker.take_pending() == {"u2": 1030}
+
+
+def test_flush_publishes_and_writes_last_seen(mongo_db, tracker, monkeypatch):
+    monkeypatch.setattr(presence, "BROADCAST_CHUNK", 2)
+    monkeypatch.setattr(presence, "WRITE_CHUNK", 2)
+
+    async def scenario(db):
+        await db.users.insert_many([{"id": f"u{n}"} for n in range(3)])
+        broker = InProcessBroker()
+        subscription = await broker.subscribe(PRESENCE_CHANNEL)
+        for n in range(3):
+            tracker.touch(f"u{n}", now=1000 + n)
+
+        await flush_presence(tracker, db, broker)
+        frames = [(await subscription.get())[1] for _ in range(2)]
+        assert {k: v for frame in frames for k, v in frame["seen"].items()} == {"u0": 1000, "u1": 1001, "u2": 1002}
+        assert all(len(frame["seen"]) <= 2 for frame in frames)
+        user = await db.users.find_one({"id": "u2"})
+        assert user["last_seen"] == datetime.fromtimestamp(1002, timezone.utc)
+
+        # Nothing pending: no frame, no write
+        await flush_presence(tracker, db, broker)
+        assert subscription.queue.empty()
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_run_presence_applies_remote_and_flushes_local(mongo_db):
+    async def scenario(db):
+        await db.users.insert_one({"id": "local"})
+        tracker = PresenceTracker(ttl=60, resolution=0.01)
+        broker = InProcessBroker()
+        task = asyncio.create_task(run_presence(tracker, db, broker))
+        await asyncio.sleep(0)
+        tracker.touch("local")
+        await broker.publish(PRESENCE_CHANNEL, {"type": "presence", "seen": {"remote": 2e9}})
+        for _ in range(100):
+            if tracker.last_seen("remote") and (await db.users.find_one({"id": "local"})).get("last_seen"):
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert tracker.last_seen("remote") == 2e9
+        assert (await db.users.find_one({"id": "local"}))["last_seen"] is not None
+        assert broker._subscribers == {}
+
+    asyncio.run(scenario(mongo_db))
@@ -0,0 +1,48 @@
+import contextvars
+import threading
+from types import SimpleNamespace
+
+import query_budget
+
+
+def test_command_shape_drops_values():
+    assert query_budget.command_shape("find", {"find": "profiles", "filter": {"user_id": "u1"}}) == "find profiles {user_id}"
+    assert query_budget.command_shape(
+        "find", {"find": "matches", "filter": {"$or": [{"user1_id": "a"}, {"user2_id": "a"}], "unmatched": False}}
+    ) == "find matches {$or:[{user1_id},{user2_id}],unmatched}"
+    assert query_budget.command_shape(
+        "update", {"update": "users", "updates": [{"q": {"id": {"$in": ["a"]}}}]}
+    ) == "update users {id:{$in}}"
+
+
+def test_trace_counts_commands_finished_on_many_threads():
+    listener = query_budget.QueryBudgetListener()
+    trace = query_budget.QueryTrace()
+    token = query_budget._current.set(trace)
+    per_thread = 2000
+
+    def worker(thread_index):
+        for n in range(per_thread):
+            event = SimpleNamespace(
+                request_id=thread_index * per_thread + n, operation_id=0, command_name="find",
+                command={"find": "profiles", "filter": {"user_id": n}}, duration_micros=10
+            )
+            listener.started(event)
+            listener.succeeded(event)
+
+    try:
+        # Motor runs each command with a copy of the caller's context
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(worker, index)) for index in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        query_budget._current.reset(token)
+
+    assert trace.count == 8 * per_thread
+    assert trace.shapes == {"find profiles {user_id}": 8 * per_thread}
+    assert abs(trace.seconds - 8 * per_thread * 10 / 1e6) < 1e-9
+    assert trace._pending == {}
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import search
+from storage import utcnow
+
+
+def test_normalize_folds_arabic_variants():
+    assert {search.normalize(w) for w in ("أحمد", "احمد", "إحمد", "آحمد")} == {"احمد"}
+    assert search.normalize("مَرْحَبـــا") == "مرحبا"
+    assert search.normalize("مدرسة") == "مدرسه"
+    assert search.normalize("Hello") == "hello"
+
+
+@pytest.mark.parametrize("word, stem", [
+    ("الحب", "حب"),
+    ("والحب", "حب"),
+    ("بالبيت", "بيت"),
+    ("للبيت", "بيت"),
+    ("الح", "الح"),
+    ("حب", "حب"),
+    ("hello", "hello"),
+])
+def test_strip_article(word, stem):
+    assert search.strip_article(word) == stem
+
+
+def test_index_terms_cover_word_and_stem():
+    terms = search.index_terms("الحب")
+    assert {"ال", "الح", "الحب", "حب"} <= set(terms)
+    assert search.index_terms("a") == []
+
+
+def test_query_terms():
+    assert search.query_terms("الحب") == ["حب"]
+    assert search.query_terms("الح") == ["الح"]
+    assert search.query_terms("a Hello hello") == ["hello"]
+    assert search.query_terms("x" * 20) == ["x" * search.MAX_PREFIX]
+
+
+def ids(hits):
+    return [m['id'] for m in hits]
+
+
+async def add(db, n: int, content: str, at):
+    message = {
+        "id": f"msg-{n}", "match_id": "m1", "sender_id": "a", "receiver_id": "b",
+        "content": content, "created_at": at,
+    }
+    await db.messages.insert_one(dict(message))
+    await search.index_message(db, message)
+
+
+def test_article_and_stem_find_each_other(mongo_db):
+    async def scenario(db):
+        now = utcnow()
+        await add(db, 1, "الحب جميل", now)
+        await add(db, 2, "حب كبير", now + timedelta(seconds=1))
+        await add(db, 3, "حبيبي", now + timedelta(seconds=2))
+
+        assert ids(await search.search_messages(db, "a", "الحب")) == ["msg-3", "msg-2", "msg-1"]
+        assert ids(await search.search_messages(db, "b", "حب")) == ["msg-3", "msg-2", "msg-1"]
+        assert ids(await search.search_messages(db, "a", "الحب جميل")) == ["msg-1"]
+        assert await search.search_messages(db, "someone-else", "حب") == []
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_rarest_term_goes_first(mongo_db):
+    async def scenario(db):
+        now = utcnow()
+        for n in range(5):
+            await add(db, n, "hello there", now + timedelta(seconds=n))
+        await add(db, 9, "hello zebra", now + timedelta(seconds=9))
+
+        assert await search.rarest_first(db, "a", ["hello", "zebra"]) == ["zebra", "hello"]
+        hits = await search.search_messages(db, "a", "hello zebra")
+        assert [m['id'] for m in hits] == ["msg-9"]
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_reindex_rewrites_stale_terms(mongo_db):
+    async def scenario(db):
+        now = utcnow()
+        await add(db, 1, "الحب", now)
+        # A posting from before article stripping
+        await db.search_postings.update_many({}, {"$set": {"terms": ["ال", "الح", "الحب"]}})
+        assert await search.search_messages(db, "a", "حب") == []
+
+        await search.reindex(db)
+        assert [m['id'] for m in await search.search_messages(db, "a", "حب")] == ["msg-1"]
+        assert await db.search_postings.count_documents({}) == 2
+
+    asyncio.run(scenario(mongo_db))
@@ -0,0 +1,96 @@
+import gzip
+import json
+
+import pytest
+from starlette.requests import Request
+
+import static_responses
+from static_responses import StaticResponse, accepted_encodings, etag_matches
+
+CONTENT = {"plans": [{"tier": "gold", "price": 39.0, "features": ["Unlimited likes"] * 20}]}
+
+
+def get(response, **headers):
+    scope = {
+        "type": "http", "method": "GET", "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    }
+    return response.respond(Request(scope))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", {"gzip", "deflate", "br"}),
+    ("br;q=0, gzip;q=0.5", {"gzip"}),
+    ("GZIP;q=bogus, identity", {"identity"}),
+    ("", set()),
+])
+def test_accepted_encodings(header, expected):
+    assert accepted_encodings(header) == expected
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+def test_serves_the_smallest_accepted_encoding():
+    response = StaticResponse(CONTENT)
+    served = get(response, accept_encoding="gzip, br")
+    assert served.headers["content-encoding"] == "br"
+    assert served.headers["vary"] == "Accept-Encoding"
+
+    served = get(response, accept_encoding="gzip")
+    assert served.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(served.body)) == CONTENT
+
+    served = get(response)
+    assert "content-encoding" not in served.headers
+    assert json.loads(served.body) == CONTENT
+
+
+def test_without_brotli_falls_back_to_gzip(monkeypatch):
+    monkeypatch.setattr(static_responses, "brotli", None)
+    served = get(StaticResponse(CONTENT), accept_encoding="br, gzip")
+    assert served.headers["content-encoding"] == "gzip"
+
+
+def test_encodings_that_do_not_shrink_the_body_are_dropped():
+    response = StaticResponse({})
+    assert set(response.variants) == {"identity"}
+    assert "content-encoding" not in get(response, accept_encoding="gzip, br").headers
+
+
+def test_revalidation_gets_a_bodiless_304():
+    response = StaticResponse(CONTENT)
+    etag = get(response).headers["etag"]
+    served = get(response, if_none_match=etag, accept_encoding="gzip")
+    assert served.status_code == 304
+    assert served.body == b""
+    assert served.headers["etag"] == etag
+
+
+def test_refresh_changes_the_etag_and_body():
+    response = StaticResponse(CONTENT)
+    old = get(response).headers["etag"]
+    response.refresh({"plans": []})
+    assert get(response).headers["etag"] != old
+    assert get(response, if_none_match=old).status_code == 200
+    assert json.loads(get(response).body) == {"plans": []}
+    # The same content gives the same tag, on this or any other worker
+    assert StaticResponse({"plans": []}).etag == response.etag
+
+
+def test_premium_plans_endpoint(api):
+    call, _ = api
+    response = call("GET", "/api/premium/plans", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["plans"]
+    again = call("GET", "/api/premium/plans", headers={"If-None-Match": response.headers["etag"]})
+    assert again.status_code == 304
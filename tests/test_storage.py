@@ -0,0 +1,107 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import analytics
+import billing
+import server
+import storage
+
+
+STORED = "2025-03-01T10:20:30.123456+00:00"
+
+
+def test_parse_datetime():
+    aware = datetime(2025, 3, 1, 10, 20, 30, 123456, tzinfo=timezone.utc)
+    assert storage.parse_datetime(None) is None
+    assert storage.parse_datetime("") is None
+    assert storage.parse_datetime(STORED) == aware
+    assert storage.parse_datetime("2025-03-01T10:20:30.123456Z") == aware
+    assert storage.parse_datetime("2025-03-01T10:20:30.123456") == aware
+    assert storage.parse_datetime(aware.replace(tzinfo=None)) == aware
+    assert storage.parse_datetime(aware) is aware
+
+
+def test_utcnow_is_millisecond_precision():
+    assert storage.utcnow().microsecond % 1000 == 0
+
+
+def test_migrate_converts_strings_and_is_resumable(mongo_db):
+    async def scenario(db):
+        await db.messages.insert_many([
+            {"id": str(n), "created_at": STORED, "read_at": None} for n in range(5)
+        ] + [{"id": "new", "created_at": storage.utcnow()}])
+        await db.matches.insert_one({"id": "m1", "matched_at": "not a date"})
+
+        assert await storage.migrate(db, batch_size=2) == {"messages": 5, "matches": 0}
+        async for message in db.messages.find({}):
+            assert isinstance(message["created_at"], datetime)
+        assert (await db.matches.find_one({"id": "m1"}))["matched_at"] == "not a date"
+        assert await storage.migrate(db) == {"messages": 0, "matches": 0}
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_migrate_keeps_the_billing_key_string(mongo_db):
+    async def scenario(db):
+        subscription = {"id": "s1", "user_id": "u1", "status": "active", "next_payment_date": STORED}
+        await db.subscriptions.insert_one(dict(subscription))
+        before = billing.idempotency_key(subscription)
+        assert before == f"s1:{STORED}"
+
+        await storage.migrate(db)
+        migrated = await db.subscriptions.find_one({"id": "s1"}, {"_id": 0})
+        assert isinstance(migrated["next_payment_date"], datetime)
+        assert migrated["billing_key_date"] == STORED
+        assert billing.idempotency_key(migrated) == before
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_billing_key_ignores_a_stale_kept_string():
+    paying = datetime(2026, 3, 1, 10, 20, 30, 123000, tzinfo=timezone.utc)
+    subscription = {"id": "s1", "next_payment_date": paying, "billing_key_date": STORED}
+    assert billing.idempotency_key(subscription) == f"s1:{paying.isoformat()}"
+
+
+def test_read_boundaries_accept_unmigrated_strings():
+    soon = storage.utcnow() + timedelta(days=10, hours=1)
+    assert server.subscription_days_remaining({"trial_end_date": soon.isoformat()}) == 10
+    assert server.subscription_days_remaining({"trial_end_date": soon}) == 10
+
+    older = {"last_message": {"created_at": STORED}}
+    newer = {"last_message": {"created_at": storage.utcnow()}}
+    assert server.sort_conversations([older, newer]) == [newer, older]
+
+
+def test_first_day_sees_unmigrated_documents(mongo_db):
+    async def scenario(db):
+        await db.swipes.insert_one({"created_at": storage.utcnow()})
+        await db.matches.insert_one({"matched_at": STORED})
+        assert await analytics._first_day(db) == date(2025, 3, 1)
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_get_messages_mixes_string_and_datetime_dates(api):
+    call, db = api
+    now = storage.utcnow()
+    older = (now - timedelta(minutes=5)).isoformat()
+
+    async def seed():
+        await db.matches.insert_one({
+            "id": "m1", "user1_id": call.user_id, "user2_id": "other", "unmatched": False,
+            "user2_read_up_to": now - timedelta(minutes=1), "user1_read_up_to": older,
+        })
+        await db.messages.insert_many([
+            {"id": "a", "match_id": "m1", "sender_id": call.user_id, "receiver_id": "other", "content": "hi", "created_at": older},
+            {"id": "b", "match_id": "m1", "sender_id": "other", "receiver_id": call.user_id, "content": "hey", "created_at": now},
+        ])
+
+    asyncio.run(seed())
+    response = call("GET", "/api/conversations/m1/messages")
+    assert response.status_code == 200
+    mine, theirs = response.json()["messages"]
+    assert mine["id"] == "a" and mine["status"] == "read"
+
+    match = asyncio.run(db.matches.find_one({"id": "m1"}))
+    assert match["user1_read_up_to"] == now
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+import uuid
+
+from fastapi import FastAPI
+
+import traffic_capture
+
+
+def recorder(tmp_path, sample_rate=1.0):
+    return traffic_capture.TrafficRecorder(tmp_path, key=b"k" * 32, sample_rate=sample_rate)
+
+
+def test_anonymize(tmp_path):
+    rec = recorder(tmp_path)
+    user = str(uuid.uuid4())
+    body = {
+        "swiped_user_id": user,
+        "action": "super_like",
+        "content": "see you at 8",
+        "contact": "a@example.com",
+        "limit": "20",
+        "note": "Hello There",
+        "when": "2026-10-18T10:00:00Z",
+        "nested": {"id": "dummy-user-3", "photo_ids": ["p1", "p2"]},
+    }
+    assert rec.anonymize(body) == {
+        "swiped_user_id": "@" + rec.pseudonym(user),
+        "action": "super_like",
+        "content": "<str:12>",
+        "contact": "<email>",
+        "limit": "20",
+        "note": "<str:11>",
+        "when": "<datetime>",
+        "nested": {"id": "@" + rec.pseudonym("dummy-user-3"), "photo_ids": ["@" + rec.pseudonym("p1"), "@" + rec.pseudonym("p2")]},
+    }
+
+
+def test_ids_of_any_shape_get_the_same_pseudonym(tmp_path):
+    rec = recorder(tmp_path)
+    pseudonym = "@" + rec.pseudonym("dummy-user-1")
+    assert rec.anonymize("dummy-user-1", "user_id") == pseudonym
+    assert rec.anonymize("dummy-user-1", "swiped_user_id") == pseudonym
+    # Not an id-named field: only its length is kept
+    assert rec.anonymize("dummy-user-1", "bio") == "<str:12>"
+    # Names that merely end in "id" are not ids
+    assert rec.anonymize("yes", "paid") == "yes"
+
+
+def test_pseudonyms_depend_on_the_key(tmp_path):
+    other = traffic_capture.TrafficRecorder(tmp_path, key=b"x" * 32)
+    assert recorder(tmp_path).pseudonym("u1") != other.pseudonym("u1")
+    assert recorder(tmp_path).pseudonym("u1") == recorder(tmp_path).pseudonym("u1")
+
+
+def test_middleware_records_path_params_as_ids(tmp_path):
+    # The route template comes from FastAPI's routing, as in server.py
+    app = FastAPI()
+
+    @app.post("/api/conversations/{match_id}/messages")
+    async def send(match_id: str, body: dict):
+        return {"ok": True}
+
+    @app.delete("/api/profile/photo/{index}")
+    async def delete(index: int):
+        return {"ok": True}
+
+    rec = recorder(tmp_path)
+    middleware = traffic_capture.TrafficCaptureMiddleware(app, rec)
+
+    async def scenario():
+        import httpx
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/api/conversations/dummy-match-7/messages", json={"content": "hi there"})
+            await client.delete("/api/profile/photo/2")
+
+    asyncio.run(scenario())
+    rec.close()
+    posted, deleted = [json.loads(line) for line in rec.path.read_text().splitlines()]
+    assert posted["r"] == "/api/conversations/{match_id}/messages"
+    assert posted["p"] == {"match_id": "@" + rec.pseudonym("dummy-match-7")}
+    assert posted["b"] == {"content": "<str:8>"}
+    assert posted["s"] == 200
+    assert deleted["p"] == {"index": "2"}
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_background_flush_writes_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(traffic_capture, "FLUSH_BYTES", 1)
+    rec = traffic_capture.TrafficRecorder(tmp_path, key=b"k" * 32, flush_interval=60)
+    writer_threads = []
+    write = rec._write
+
+    def tracked_write(data):
+        writer_threads.append(threading.get_ident())
+        write(data)
+
+    rec._write = tracked_write
+
+    async def scenario():
+        task = asyncio.create_task(rec.run())
+        await asyncio.sleep(0)
+        rec.record({"n": 1})
+        # Handed to the background task rather than written by the request
+        assert writer_threads == []
+        await wait_for(lambda: writer_threads)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert writer_threads and threading.get_ident() not in writer_threads
+    assert [json.loads(line) for line in rec.path.read_text().splitlines()] == [{"n": 1}]
+
+
+def test_failed_background_flush_is_retried_in_order(tmp_path):
+    rec = traffic_capture.TrafficRecorder(tmp_path, key=b"k" * 32, flush_interval=0.01)
+    write = rec._write
+    failures = [OSError("disk full")]
+
+    def flaky_write(data):
+        if failures:
+            raise failures.pop()
+        write(data)
+
+    rec._write = flaky_write
+
+    async def scenario():
+        task = asyncio.create_task(rec.run())
+        rec.record({"n": 1})
+        await wait_for(lambda: not failures)
+        rec.record({"n": 2})
+        await wait_for(rec.path.exists)
+        task.cancel()
+
+    asyncio.run(scenario())
+    rec.close()
+    assert [json.loads(line) for line in rec.path.read_text().splitlines()] == [{"n": 1}, {"n": 2}]
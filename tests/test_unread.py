@@ -0,0 +1,89 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import unread
+from storage import utcnow
+
+
+ALICE, BOB = "alice", "bob"
+
+
+@pytest.fixture(autouse=True)
+def match(mongo_db):
+    asyncio.run(mongo_db.matches.insert_one({"id": "m1", "user1_id": ALICE, "user2_id": BOB}))
+
+
+async def send(db, at, sender=BOB, receiver=ALICE):
+    await db.messages.insert_one({"match_id": "m1", "sender_id": sender, "receiver_id": receiver, "created_at": at})
+    await unread.increment_unread(db, receiver, "m1")
+
+
+async def load_match(db):
+    return await db.matches.find_one({"id": "m1"}, {"_id": 0})
+
+
+def test_read_clears_counter_and_moves_watermark(mongo_db):
+    async def scenario(db):
+        start = utcnow()
+        for n in range(3):
+            await send(db, start + timedelta(seconds=n))
+        assert await unread.get_unread_counts(db, ALICE) == {"m1": 3}
+
+        last = start + timedelta(seconds=2)
+        assert await unread.mark_read(db, await load_match(db), ALICE, last) == 3
+        assert await unread.get_unread_counts(db, ALICE) == {}
+        assert unread.read_watermark(await load_match(db), ALICE) == last
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_messages_after_the_watermark_stay_unread(mongo_db):
+    async def scenario(db):
+        start = utcnow()
+        await send(db, start)
+        await send(db, start + timedelta(seconds=1))
+        # Arrives after the page the reader saw ended
+        await send(db, start + timedelta(seconds=5))
+
+        assert await unread.mark_read(db, await load_match(db), ALICE, start + timedelta(seconds=1)) == 2
+        assert await unread.get_unread_counts(db, ALICE) == {"m1": 1}
+
+        assert await unread.mark_read(db, await load_match(db), ALICE, start + timedelta(seconds=5)) == 1
+        assert await unread.get_unread_counts(db, ALICE) == {}
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_watermark_moves_even_when_counter_is_zero(mongo_db):
+    async def scenario(db):
+        at = utcnow()
+        await db.messages.insert_one({"match_id": "m1", "sender_id": BOB, "receiver_id": ALICE, "created_at": at})
+        # Drifted: no counter for the message
+        assert await unread.mark_read(db, await load_match(db), ALICE, at) == 0
+        assert unread.read_watermark(await load_match(db), ALICE) == at
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_watermark_never_moves_back(mongo_db):
+    async def scenario(db):
+        at = utcnow()
+        await unread.mark_read(db, await load_match(db), BOB, at)
+        await unread.mark_read(db, await load_match(db), BOB, at - timedelta(minutes=1))
+        match = await load_match(db)
+        assert unread.read_watermark(match, BOB) == at
+        assert unread.read_watermark(match, ALICE) is None
+
+    asyncio.run(scenario(mongo_db))
+
+
+def test_string_watermark_from_before_the_date_migration(mongo_db):
+    async def scenario(db):
+        at = utcnow()
+        await db.matches.update_one({"id": "m1"}, {"$set": {"user1_read_up_to": (at - timedelta(hours=1)).isoformat()}})
+        await send(db, at)
+        assert await unread.mark_read(db, await load_match(db), ALICE, at) == 1
+
+    asyncio.run(scenario(mongo_db))
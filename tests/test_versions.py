@@ -0,0 +1,63 @@
+import asyncio
+
+from starlette.requests import Request
+
+import versions
+
+
+def request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_names_document_version_and_extras():
+    assert versions.etag({"id": "d1"}) == 'W/"d1.0"'
+    assert versions.etag({"id": "d1", "version": 4}, 12) == 'W/"d1.4.12"'
+
+
+def test_missing_document_has_no_etag():
+    assert versions.etag(None) is None
+    assert versions.not_modified(request('W/"none"'), None) is None
+    assert versions.not_modified(request("*"), None) is None
+
+
+def test_not_modified_matches_weakly():
+    tag = versions.etag({"id": "d1", "version": 2})
+    assert versions.not_modified(request('"d1.2"'), tag).status_code == 304
+    assert versions.not_modified(request('W/"d1.1"'), tag) is None
+    assert versions.not_modified(request(), tag) is None
+
+
+def test_settings_round_trip(api):
+    call, db = api
+    first = call("GET", "/api/settings")
+    assert first.status_code == 200
+    tag = first.headers["etag"]
+    assert call("GET", "/api/settings", headers={"If-None-Match": tag}).status_code == 304
+
+    assert call("PUT", "/api/settings", json={"theme": "dark"}).status_code == 200
+    second = call("GET", "/api/settings", headers={"If-None-Match": tag})
+    assert second.status_code == 200
+    assert second.json()["theme"] == "dark"
+    assert versions.VERSION_FIELD not in second.json()
+    assert second.headers["etag"] != tag
+
+
+def test_conditional_get_of_a_missing_document_is_not_a_304(api):
+    call, db = api
+    for path in ("/api/profile/me", "/api/subscription/status"):
+        response = call("GET", path, headers={"If-None-Match": 'W/"none"'})
+        assert response.status_code == 404
+        assert "etag" not in response.headers
+    response = call("GET", "/api/payment/status", headers={"If-None-Match": 'W/"none"'})
+    assert response.status_code == 200
+    assert response.json() == {"has_payment": False}
+    assert "etag" not in response.headers
+
+
+def test_profile_body_has_no_version(api):
+    call, db = api
+    asyncio.run(db.profiles.insert_one({"id": "p1", "user_id": call.user_id, "display_name": "Layla", "version": 3}))
+    response = call("GET", "/api/profile/me")
+    assert response.headers["etag"] == 'W/"p1.3"'
+    assert "version" not in response.json()